@@ -0,0 +1,206 @@
+# Times each stage of the IJOQ calibration and analysis on synthetic monolayers drawn by Simulator.py, and saves the
+# timings to a JSON report that can be compared between revisions (e.g. "python3 Benchmark.py --compare old.json")
+
+import argparse
+import json
+from os import cpu_count, path
+import platform
+import subprocess
+import sys
+from tempfile import TemporaryDirectory
+from PIL import Image
+import PIL
+import numpy
+import modules.IJOQ_engine as Engine
+from modules.IJOQ_cli import create_executor, worker_count
+from Simulator import simulate_monolayer
+
+# Cell size (in pixels) of the simulated monolayers. The number of cells grows with the image size
+CELL_SIZE = 64
+
+def stage_summary(timers):
+    """
+    Summarizes the stage times of several runs, each timed by the engine (see Engine.StageTimer)
+    :param timers: StageTimer of each run
+    :return: Dictionary of {"median", "min", "total"} run times (in seconds), keyed by stage in the order in which the
+        stages first ran. The median and minimum are those of the mean time per image of each run. The "total" stage is
+        the elapsed time of each run
+    """
+
+    stage_times = {}
+    stage_totals = {}
+    for timer in timers:
+        images = max(timer.image_count, 1)
+        run_times = [(stage, seconds) for stage, (seconds, _) in timer.stage_times.items()]
+        for stage, seconds in run_times + [("total", timer.elapsed())]:
+            stage_times.setdefault(stage, []).append(seconds / images)
+            stage_totals[stage] = stage_totals.get(stage, 0.0) + seconds
+
+    return {stage: {"median": float(numpy.median(times)), "min": float(numpy.min(times)),
+                    "total": stage_totals[stage]}
+            for stage, times in stage_times.items()}
+
+def revision():
+    """
+    :return: Git commit hash of the working tree, or None if it cannot be determined
+    """
+
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=path.dirname(path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def benchmark_size(image_size, arguments, folder):
+    """
+    Generates the monolayers of one image size, calibrates with the intact monolayers, then analyzes the monolayers of
+    every junction-loss probability. Runs the engine's own calibration and analysis, timed by the engine (see
+    Engine.StageTimer), and saves the results the same way as the command-line analysis (see Engine.ResultWriter)
+    :param image_size: Width and height (in pixels) of the monolayers
+    :param arguments: Parsed command-line arguments
+    :param folder: Folder that the generated and processed images are saved to
+    :return: List of runs (dictionaries) for the report
+    """
+
+    # Above a bit depth of 8, the monolayers are saved as 16-bit images at that bit depth, like camera images
+    intersection_count = round(image_size / CELL_SIZE) + 2
+    files = {}
+    for probability_number, probability in enumerate(arguments.probabilities):
+        files[probability] = []
+        for i in range(arguments.images):
+            image_array, _ = simulate_monolayer(image_size, probability, intersection_count,
+                                                seed=(arguments.seed, image_size, probability_number, i))
+            if arguments.bit_depth > 8:
+                image_array = numpy.rint(image_array * (Engine.max_brightness(arguments.bit_depth) / 255))
+                files[probability].append(path.join(folder, f"{image_size}_{probability}_{i + 1}.tif"))
+                Image.fromarray(image_array.astype(numpy.uint16)).save(files[probability][-1])
+            else:
+                files[probability].append(path.join(folder, f"{image_size}_{probability}_{i + 1}.png"))
+                Image.fromarray(image_array).save(files[probability][-1])
+
+    cell_count = intersection_count - 2
+    options = Engine.CalibrationOptions.basic(cell_count, cell_count, "Red")
+    options.settings.fast_ingest = int(not arguments.exact_ingest)
+    options.settings.fast_blur = int(arguments.fast_blur)
+    options.settings.tile_size = arguments.tile_size
+    options.settings.bit_depth = arguments.bit_depth
+    calibration_files = files[min(arguments.probabilities)]
+
+    # Images analyzed in tiles are analyzed one at a time, with their tiles spread across the worker processes (see
+    # IJOQ_cli.analyze)
+    tiled = arguments.tile_size > 0
+    with create_executor(arguments.workers) as executor:
+        # Calibrate with the intact monolayers
+        timers = []
+        for _ in range(arguments.repeats):
+            timers.append(Engine.StageTimer(arguments.workers))
+            settings = Engine.calibrate(calibration_files, options, executor=executor, timer=timers[-1]).settings
+            timers[-1].stop()
+        runs = [{"mode": "calibration", "size": image_size, "probability": min(arguments.probabilities),
+                 "images": len(calibration_files), "settings": settings.to_text(),
+                 "calibrate": float(numpy.median([timer.elapsed() for timer in timers])),
+                 "stages": stage_summary(timers)}]
+        print(f"{image_size} px calibration: {runs[-1]['calibrate']:.3f} s")
+
+        # Analyze the monolayers of every junction-loss probability with the calibrated settings
+        for probability in arguments.probabilities:
+            timers = []
+            IJOQ_values = []
+            for _ in range(arguments.repeats):
+                timers.append(Engine.StageTimer(arguments.workers))
+                save_path = Engine.create_output_folder(folder, "Analysis_Output")
+                IJOQ_values = []
+                with Engine.ResultWriter(save_path, "benchmark") as result_writer:
+                    if tiled:
+                        jobs = ((file_path, settings, False, None, executor) for file_path in files[probability])
+                        results = Engine.map_timed_jobs(Engine.analyze_image, jobs, timers[-1])
+                    else:
+                        jobs = ((file_path, settings) for file_path in files[probability])
+                        results = Engine.map_timed_jobs(Engine.analyze_image, jobs, timers[-1], executor)
+                    for result in results:
+                        IJOQ_values.append(result.IJOQ)
+                        with timers[-1].stage("save"):
+                            result_writer.write(result)
+                        timers[-1].add_image(result.name)
+                timers[-1].stop()
+            runs.append({"mode": "analysis", "size": image_size, "probability": probability,
+                         "images": len(files[probability]), "IJOQ": float(numpy.mean(IJOQ_values)),
+                         "images_per_second": float(numpy.median([timer.images_per_second() for timer in timers])),
+                         "stages": stage_summary(timers)})
+            print(f"{image_size} px analysis, junction loss {probability}: {runs[-1]['images_per_second']:.1f} "
+                  f"images/s (mean IJOQ {runs[-1]['IJOQ']:.4f})")
+
+    return runs
+
+def compare(report, baseline):
+    """
+    Prints the change of the median run time of every stage relative to a baseline report
+    :param report: Report of this run
+    :param baseline: Report of an earlier run
+    :return: None
+    """
+
+    baseline_runs = {(run["mode"], run["size"], run["probability"]): run for run in baseline["runs"]}
+    print(f"\nCompared to revision {baseline.get('revision')} (ratio of median times, below 1 is faster):")
+    for run in report["runs"]:
+        baseline_run = baseline_runs.get((run["mode"], run["size"], run["probability"]))
+        if baseline_run is None:
+            continue
+
+        ratios = []
+        for stage, times in run["stages"].items():
+            if stage in baseline_run["stages"] and baseline_run["stages"][stage]["median"] > 0:
+                ratios.append(f"{stage} {times['median'] / baseline_run['stages'][stage]['median']:.2f}")
+        print(f"{run['mode']} {run['size']} px, junction loss {run['probability']}: " + ", ".join(ratios))
+        if run.get("IJOQ") != baseline_run.get("IJOQ"):
+            print(f"    WARNING! Mean IJOQ changed from {baseline_run.get('IJOQ')} to {run.get('IJOQ')}")
+
+def main(argv):
+    """
+    Runs the benchmark
+    :param argv: Command-line arguments, excluding the program name
+    :return: Exit code
+    """
+
+    parser = argparse.ArgumentParser(prog="Benchmark.py", description="Times each stage of the IJOQ calibration and "
+                                                                      "analysis on synthetic monolayers.")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[512, 1024, 2048, 4096],
+                        help="image sizes in pixels (default: %(default)s)")
+    parser.add_argument("--probabilities", nargs="+", type=float, default=[0, 0.2, 0.5],
+                        help="junction-loss probabilities. The lowest is used for calibration (default: %(default)s)")
+    parser.add_argument("--images", type=int, default=3, help="images per size and probability (default: %(default)s)")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="number of times each image is processed (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the simulated monolayers")
+    parser.add_argument("--exact-ingest", action="store_true",
+                        help="benchmark with exact image loading instead of fast image loading (see README)")
+    parser.add_argument("--fast-blur", action="store_true", help="benchmark with the fast blur (see README)")
+    parser.add_argument("--tile-size", type=int, default=0, metavar="PIXELS",
+                        help="analyze the monolayers at full resolution in tiles of this size (default: no tiling)")
+    parser.add_argument("--bit-depth", type=int, choices=range(8, 17), default=8, metavar="BITS",
+                        help="bit depth of the analysis. Above 8, the monolayers are saved as 16-bit images at this "
+                             "bit depth (default: %(default)s)")
+    parser.add_argument("-w", "--workers", type=worker_count, default=1,
+                        help="number of worker processes (default: %(default)s)")
+    parser.add_argument("-o", "--output", default="benchmark.json", help="report file (default: %(default)s)")
+    parser.add_argument("--compare", metavar="REPORT", help="report of an earlier run to compare with")
+    arguments = parser.parse_args(argv)
+
+    report = {"revision": revision(), "python": platform.python_version(), "numpy": numpy.__version__,
+              "pillow": PIL.__version__, "cpu_count": cpu_count(), "arguments": vars(arguments), "runs": []}
+    with TemporaryDirectory() as folder:
+        for image_size in arguments.sizes:
+            report["runs"] += benchmark_size(image_size, arguments, folder)
+
+    with open(arguments.output, mode="w") as report_file:
+        json.dump(report, report_file, indent=2)
+    print(f"The benchmark report has been saved to {arguments.output}")
+
+    if arguments.compare:
+        with open(arguments.compare, mode="r") as baseline_file:
+            compare(report, json.load(baseline_file))
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,455 @@
+# Checks the calibration and analysis of every speed-focused mode of the IJOQ engine against the reference
+# implementation of the original algorithm (modules/IJOQ_reference.py), on simulated monolayers and on any given
+# images, and measures how well the IJOQ of each mode follows the ground-truth junction length of the simulated
+# monolayers (e.g. "python3 Equivalence.py images/ --output equivalence.json")
+
+import argparse
+from dataclasses import replace
+import json
+from os import mkdir, path
+import sys
+from tempfile import TemporaryDirectory
+import numpy
+from PIL import Image
+import modules.IJOQ_engine as Engine
+import modules.IJOQ_reference as Reference
+from IJOQ import valid_image_types
+from Simulator import simulate_dataset, simulate_monolayer
+
+# Settings of each mode of the engine. Exact modes must match the reference exactly. The other modes approximate it.
+# The bit depth mode analyzes 16-bit copies of the grayscale images, whose pixel values are those of the 8-bit images
+# analyzed by the reference, multiplied by HIGH_BIT_DEPTH_FACTOR
+MODES = {
+    "exact": {"fast_ingest": 0, "fast_blur": 0, "tile_size": 0},
+    "tiled": {"fast_ingest": 0, "fast_blur": 0, "tile_size": 256},
+    "fast ingest": {"fast_ingest": 1, "fast_blur": 0, "tile_size": 0},
+    "fast blur": {"fast_ingest": 0, "fast_blur": 1, "tile_size": 0},
+    "fast ingest + fast blur": {"fast_ingest": 1, "fast_blur": 1, "tile_size": 0},
+    "bit depth 12": {"fast_ingest": 0, "fast_blur": 0, "tile_size": 0, "bit_depth": 12}}
+EXACT_MODES = ("exact", "tiled")
+HIGH_BIT_DEPTH_FACTOR = 16
+
+# Tolerances of each mode:
+# - threshold: largest difference of the calibrated normalization cutoff
+# - calibration pixels: largest fraction of differing thresholded calibration pixels. A normalization cutoff one step
+#   away from that of the reference thresholds a few percent of the pixels differently
+# - pixels: largest fraction of differing thresholded pixels in the analysis
+# - IJOQ: largest IJOQ difference
+# - ingest levels: largest difference of the loaded pixels from exact image loading, in brightness levels out of 255
+# - blur levels: largest difference of the blurred pixels from the exact blur, in brightness levels out of 255, away
+#   from the image border (see blur_levels)
+# The level bounds are those stated in the README. The others leave about twice the margin of the differences
+# measured with the default arguments at blur radii 2 to 5
+TOLERANCES = {
+    "exact": {"threshold": 0, "calibration pixels": 0, "pixels": 0, "IJOQ": 0, "ingest levels": 0, "blur levels": 0},
+    "tiled": {"threshold": 0, "calibration pixels": 0, "pixels": 0, "IJOQ": 0, "ingest levels": 0, "blur levels": 0},
+    "fast ingest": {"threshold": 2, "calibration pixels": 0.01, "pixels": 0.01, "IJOQ": 0.001, "ingest levels": 12,
+                    "blur levels": 0},
+    "fast blur": {"threshold": 2, "calibration pixels": 0.01, "pixels": 0.01, "IJOQ": 0.001, "ingest levels": 0,
+                  "blur levels": 2},
+    "fast ingest + fast blur": {"threshold": 2, "calibration pixels": 0.015, "pixels": 0.015, "IJOQ": 0.0015,
+                                "ingest levels": 12, "blur levels": 2},
+    "bit depth 12": {"threshold": 2, "calibration pixels": 0.05, "pixels": 0.01, "IJOQ": 0.0015, "ingest levels": 0,
+                     "blur levels": 0}}
+
+# Number of cells along each axis of the simulated monolayers, at every size
+CELL_COUNT = 10
+
+# Width and height (in pixels), number of cells along each axis and tile size of the simulated whole-slide image of the
+# large image check. The image is above Pillow's decompression bomb limit (about 179 megapixels)
+LARGE_IMAGE_SIZE = 13500
+LARGE_IMAGE_CELL_COUNT = 90
+LARGE_IMAGE_TILE_SIZE = 2048
+
+# Bit depth and image size of the calibration session check. Sessions above a bit depth of 8 store 16-bit arrays
+SESSION_BIT_DEPTH = 12
+SESSION_IMAGE_SIZE = 768
+
+def pixel_difference(first_array, second_array):
+    """
+    :param first_array: 2D array containing a thresholded image
+    :param second_array: 2D array containing a thresholded image
+    :return: Fraction of the pixels that differ (1 if the images have different sizes)
+    """
+
+    if first_array.shape != second_array.shape:
+        return 1.0
+
+    return float(numpy.count_nonzero(first_array != second_array) / first_array.size)
+
+def length_correlation(IJOQ_values, lengths):
+    """
+    :param IJOQ_values: IJOQ values of the simulated monolayers
+    :param lengths: Ground-truth junction lengths of the simulated monolayers
+    :return: Pearson correlation coefficient of the IJOQ values and lengths, or None if either does not vary
+    """
+
+    if numpy.std(IJOQ_values) == 0 or numpy.std(lengths) == 0:
+        return None
+
+    return float(numpy.corrcoef(IJOQ_values, lengths)[0, 1])
+
+def reference_resolution(settings):
+    """
+    :param settings: Settings of a mode
+    :return: Compressed image size that the reference has to use to match the mode (0 for full resolution)
+    """
+
+    return 0 if settings.tile_size > 0 else settings.compressed_image_size
+
+def simulated_images(arguments, image_size, folder):
+    """
+    Draws the simulated monolayers of one size
+    :param arguments: Parsed command-line arguments
+    :param image_size: Width and height (in pixels) of the monolayers
+    :param folder: Temporary folder. The monolayers are saved to a subfolder named after their size
+    :return: Tuple of the list of image paths and the dictionary of ground-truth junction lengths by path
+    """
+
+    images = []
+    lengths = {}
+    folder = path.join(folder, str(image_size))
+    mkdir(folder)
+    for file_number, _, _, length in simulate_dataset(arguments.simulated, arguments.probabilities, image_size,
+                                                      CELL_COUNT + 2, seed=arguments.seed, folder=folder):
+        images.append(path.join(folder, f"{file_number}.png"))
+        lengths[images[-1]] = length
+
+    return images, lengths
+
+def high_bit_depth_copies(images, folder):
+    """
+    Saves 16-bit copies of the 8-bit grayscale images, with their pixel values multiplied by HIGH_BIT_DEPTH_FACTOR
+    :param images: Paths of the images
+    :param folder: Folder that the copies are saved to, as numbered TIFF files
+    :return: Dictionary of the path of each copy by image path. Other images are their own copy
+    """
+
+    copies = {}
+    for i, image in enumerate(images):
+        with Image.open(image) as opened_image:
+            if opened_image.mode != "L":
+                copies[image] = image
+                continue
+            image_array = numpy.array(opened_image, dtype=numpy.uint16) * HIGH_BIT_DEPTH_FACTOR
+        copies[image] = path.join(folder, f"{i}.tif")
+        Image.fromarray(image_array).save(copies[image])
+
+    return copies
+
+def blur_levels(fast_array, exact_array, blur_radius):
+    """
+    :param fast_array: 2D array blurred with the fast blur
+    :param exact_array: 2D array blurred with the exact blur
+    :param blur_radius: Blur radius of both arrays
+    :return: Largest brightness difference of the arrays, ignoring pixels within 3 times the blur radius of the image
+        border, where the fast blur differs more (see README)
+    """
+
+    border = 3 * blur_radius
+    height, width = exact_array.shape
+
+    return int(numpy.max(numpy.abs(fast_array[border:height - border, border:width - border].astype(numpy.int32) -
+                                   exact_array[border:height - border, border:width - border]), initial=0))
+
+def level_differences(images, settings):
+    """
+    Measures how far the fast image loading and the fast blur of a mode move the brightness of the pixels
+    :param images: Paths of the images, as analyzed by the mode
+    :param settings: Settings of the mode
+    :return: Tuple of the largest difference of the loaded pixels from exact image loading and the largest difference
+        of the blurred pixels from the exact blur (see blur_levels), both in brightness levels out of 255
+    """
+
+    if not settings.fast_ingest and not settings.fast_blur:
+        return 0, 0
+
+    ingest_levels = 0
+    blur_level_difference = 0
+    scale = 255 / Engine.max_brightness(settings.bit_depth)
+    for image in images:
+        image_array = Engine.load_image(image, reference_resolution(settings), settings.channel, False,
+                                        settings.bit_depth)
+        if settings.fast_ingest:
+            fast_array = Engine.load_image(image, reference_resolution(settings), settings.channel, True,
+                                           settings.bit_depth)
+            ingest_levels = max(ingest_levels, int(numpy.max(numpy.abs(fast_array.astype(numpy.int32) -
+                                                                       image_array))) * scale)
+        if settings.fast_blur:
+            blur_level_difference = max(blur_level_difference, scale * blur_levels(
+                Engine.blur_image(image_array, settings.blur_radius, True),
+                Engine.blur_image(image_array, settings.blur_radius), settings.blur_radius))
+
+    return round(ingest_levels, 2), round(blur_level_difference, 2)
+
+def check_mode(mode, options, controls, images, lengths, reference_results, folder):
+    """
+    Calibrates with the control images and analyzes the images with one mode of the engine and with the reference, and
+    compares the results. Reference results are shared between modes that load images at the same resolution
+    :param mode: Name of the mode (see MODES)
+    :param options: CalibrationOptions without the mode settings
+    :param controls: Paths of the calibration images
+    :param images: Paths of the analyzed images
+    :param lengths: Ground-truth junction lengths of the simulated images among the analyzed images (by path)
+    :param reference_results: Dictionary of reference results keyed by resolution. Updated with new results
+    :param folder: Temporary folder that the 16-bit copies of the images of modes above a bit depth of 8 are saved to
+    :return: Dictionary describing the results of the mode, including whether it is within its tolerances (see
+        TOLERANCES)
+    """
+
+    options = replace(options, settings=replace(options.settings, **MODES[mode]))
+    resolution = reference_resolution(options.settings)
+    if resolution not in reference_results:
+        print(f"Running the reference at {resolution or 'full'} resolution...")
+        reference_settings, reference_images = Reference.calibrate(
+            controls, replace(options.settings, compressed_image_size=resolution), options.cell_count,
+            options.estimate_noise)
+        reference_settings = replace(reference_settings, compressed_image_size=options.settings.compressed_image_size)
+        reference_analysis = [Reference.analyze_image(image, replace(reference_settings,
+                                                                     compressed_image_size=resolution))
+                              for image in images]
+        reference_results[resolution] = (reference_settings, reference_images, reference_analysis)
+    reference_settings, reference_images, reference_analysis = reference_results[resolution]
+
+    # Modes above a bit depth of 8 analyze 16-bit copies of the images that the reference analyzes
+    print(f"Checking the {mode} mode...")
+    copies = {image: image for image in controls + images}
+    if options.settings.bit_depth > 8:
+        folder = path.join(folder, mode)
+        mkdir(folder)
+        copies = high_bit_depth_copies(list(copies), folder)
+
+    # Calibration: compare the calibrated settings and the thresholded calibration images
+    calibration = Engine.calibrate([copies[control] for control in controls], options)
+    settings = calibration.settings
+    calibration_differences = {
+        "blur_radius": settings.blur_radius - reference_settings.blur_radius,
+        "normalization_cutoff": settings.normalization_cutoff - reference_settings.normalization_cutoff,
+        "noise_cutoff": round(settings.noise_cutoff - reference_settings.noise_cutoff, 2),
+        "pixels": max(pixel_difference(processed_image, reference_image)
+                      for processed_image, reference_image in zip(calibration.processed_images, reference_images))}
+
+    # Analysis: analyze with the reference settings, so that only the analysis itself is compared
+    analysis_settings = replace(reference_settings, **MODES[mode])
+    IJOQ_differences = []
+    pixel_differences = []
+    IJOQ_values = {}
+    for image, (reference_IJOQ, reference_image) in zip(images, reference_analysis):
+        result = Engine.analyze_image(copies[image], analysis_settings)
+        IJOQ_values[image] = (result.IJOQ, reference_IJOQ)
+        IJOQ_differences.append(abs(result.IJOQ - reference_IJOQ))
+        pixel_differences.append(pixel_difference(result.processed_image, reference_image))
+
+    # Accuracy: how well the IJOQ follows the ground-truth junction length
+    simulated = [image for image in images if image in lengths]
+    accuracy = {}
+    if simulated:
+        ground_truth = [lengths[image] for image in simulated]
+        accuracy = {"correlation": length_correlation([IJOQ_values[image][0] for image in simulated], ground_truth),
+                    "reference_correlation": length_correlation([IJOQ_values[image][1] for image in simulated],
+                                                                ground_truth)}
+
+    # Brightness of the loaded and blurred pixels, compared to exact image loading and the exact blur
+    ingest_levels, blur_level_difference = level_differences([copies[image] for image in images], analysis_settings)
+
+    tolerances = TOLERANCES[mode]
+    if mode in EXACT_MODES:
+        passed = not any(calibration_differences.values()) and max(IJOQ_differences) == 0 and \
+                 max(pixel_differences) == 0
+    else:
+        passed = abs(calibration_differences["normalization_cutoff"]) <= tolerances["threshold"] and \
+                 calibration_differences["pixels"] <= tolerances["calibration pixels"] and \
+                 max(IJOQ_differences) <= tolerances["IJOQ"] and max(pixel_differences) <= tolerances["pixels"]
+    passed = passed and ingest_levels <= tolerances["ingest levels"] and \
+             blur_level_difference <= tolerances["blur levels"]
+
+    return {"mode": mode, "exact": mode in EXACT_MODES, "passed": passed, "settings": settings.to_text(),
+            "reference_settings": reference_settings.to_text(), "calibration_differences": calibration_differences,
+            "max_IJOQ_difference": round(max(IJOQ_differences), 4),
+            "mean_IJOQ_difference": round(float(numpy.mean(IJOQ_differences)), 5),
+            "max_pixel_difference": max(pixel_differences), "ingest_levels": ingest_levels,
+            "blur_levels": blur_level_difference, "tolerances": tolerances, "accuracy": accuracy,
+            "IJOQ": {path.basename(image): values for image, values in IJOQ_values.items()}}
+
+def check_large_image(arguments, folder):
+    """
+    Analyzes a simulated whole-slide image above Pillow's decompression bomb limit with the tiled mode, saved as an
+    uncompressed TIFF file. The reference cannot analyze an image that large, so only checks that the image reaches the
+    tiler, that the processed image is shrunk to TILED_IMAGE_SIZE and that Pillow's limit is restored afterwards
+    :param arguments: Parsed command-line arguments
+    :param folder: Temporary folder that the image is saved to
+    :return: Dictionary describing the result of the check
+    """
+
+    print(f"Checking a {LARGE_IMAGE_SIZE} x {LARGE_IMAGE_SIZE} image with the tiled mode...")
+    image_array, length = simulate_monolayer(LARGE_IMAGE_SIZE, arguments.probabilities[0], LARGE_IMAGE_CELL_COUNT + 2,
+                                             seed=arguments.seed)
+    image_path = path.join(folder, "large.tif")
+    Image.fromarray(image_array).save(image_path)
+    del image_array
+
+    max_image_pixels = Image.MAX_IMAGE_PIXELS
+    settings = Engine.Settings(blur_radius=arguments.blur_radius, tile_size=LARGE_IMAGE_TILE_SIZE)
+    try:
+        result = Engine.analyze_image(image_path, settings)
+    except Exception as error:
+        return {"passed": False, "size": LARGE_IMAGE_SIZE, "error": str(error) or type(error).__name__}
+
+    passed = result.IJOQ > 0 and max(result.processed_image.shape) <= Engine.TILED_IMAGE_SIZE and \
+             Image.MAX_IMAGE_PIXELS == max_image_pixels
+
+    return {"passed": passed, "size": LARGE_IMAGE_SIZE, "IJOQ": result.IJOQ, "length": length,
+            "processed_image_size": list(result.processed_image.shape)}
+
+def check_session(arguments, folder):
+    """
+    Calibrates simulated 16-bit grayscale monolayers at SESSION_BIT_DEPTH, computes every blur level, saves the
+    calibration session and loads it again. The loaded session must match the calibration exactly
+    :param arguments: Parsed command-line arguments
+    :param folder: Temporary folder that the images and the session file are saved to
+    :return: Dictionary describing the result of the check
+    """
+
+    print(f"Checking a calibration session saved at a bit depth of {SESSION_BIT_DEPTH}...")
+    images = []
+    for file_number, _, image_array, _ in simulate_dataset(3, arguments.probabilities[:1], SESSION_IMAGE_SIZE,
+                                                           CELL_COUNT + 2, seed=arguments.seed):
+        images.append(path.join(folder, f"session_{file_number}.tif"))
+        Image.fromarray(image_array.astype(numpy.uint16) * 16).save(images[-1])
+
+    options = Engine.CalibrationOptions.advanced(Engine.Settings(blur_radius=arguments.blur_radius,
+                                                                 bit_depth=SESSION_BIT_DEPTH))
+    calibration = Engine.calibrate(images, options)
+    for b in range(len(Engine.BLUR_RADIUS_VALUES)):
+        calibration.compute_blur_level(b)
+    session_path = path.join(folder, "session.npz")
+    calibration.save(session_path)
+    try:
+        loaded = Engine.CalibrationResult.load(session_path)
+    except (OSError, ValueError) as error:
+        return {"passed": False, "bit_depth": SESSION_BIT_DEPTH, "error": str(error)}
+
+    # Pairs of (calibrated array, loaded array)
+    array_pairs = list(zip(calibration.processed_images, loaded.processed_images))
+    array_pairs += zip(calibration.image_arrays, loaded.image_arrays)
+    for i in range(len(images)):
+        array_pairs += zip(calibration.blurred_images[i], loaded.blurred_images[i])
+        array_pairs += zip(calibration.section_thresholds[i], loaded.section_thresholds[i])
+    passed = loaded.settings == calibration.settings and \
+             loaded.normalization_thresholds == calibration.normalization_thresholds and \
+             all(numpy.array_equal(array, loaded_array) and array.dtype == loaded_array.dtype
+                 for array, loaded_array in array_pairs)
+
+    return {"passed": passed, "bit_depth": SESSION_BIT_DEPTH, "settings": loaded.settings.to_text()}
+
+def main(argv):
+    """
+    Runs the equivalence check
+    :param argv: Command-line arguments, excluding the program name
+    :return: Exit code (1 if any mode is outside its tolerances, or the session or large image check fails)
+    """
+
+    parser = argparse.ArgumentParser(
+        prog="Equivalence.py", description="Checks every mode of the IJOQ engine against the reference implementation.",
+        epilog="Each mode must stay within its own tolerances (largest normalization cutoff difference, fraction of "
+               "differing thresholded pixels in calibration and analysis, IJOQ difference, and brightness level "
+               "differences of the loaded and blurred pixels from the exact ones): "
+               + "; ".join(f"{mode}: " + ", ".join(f"{key} {value}" for key, value in tolerances.items())
+                           for mode, tolerances in TOLERANCES.items()))
+    parser.add_argument("inputs", nargs="*", help="real images to analyze as well (files, folders, or glob patterns)")
+    parser.add_argument("--controls", nargs="+",
+                        help="negative control images to calibrate with (default: the simulated monolayers of the "
+                             "first junction-loss probability)")
+    parser.add_argument("--cells", nargs=2, type=int, metavar=("X", "Y"),
+                        help="estimated number of cells along the width and height of the control images (default: "
+                             "the number of cells of the simulated monolayers)")
+    parser.add_argument("--blur-radius", type=int, choices=Engine.BLUR_RADIUS_VALUES, default=2,
+                        help="blur radius to calibrate with. The fast blur only differs from the exact blur from a "
+                             "radius of 2 (default: %(default)s)")
+    parser.add_argument("--estimate-blur", action="store_true",
+                        help="estimate the blur radius from the number of cells instead")
+    parser.add_argument("--modes", nargs="+", choices=tuple(MODES), default=list(MODES),
+                        help="modes to check (default: all)")
+    parser.add_argument("--simulated", type=int, default=3,
+                        help="simulated monolayers per junction-loss probability (default: %(default)s)")
+    parser.add_argument("--probabilities", nargs="+", type=float, default=[0, 0.2, 0.5],
+                        help="junction-loss probabilities of the simulated monolayers (default: %(default)s)")
+    parser.add_argument("--size", type=int, default=3072,
+                        help="size of the simulated monolayers. Fast image loading only differs from exact loading "
+                             "for images at least 6 times the compressed size (default: %(default)s)")
+    parser.add_argument("--tiled-size", type=int, default=768,
+                        help="size of the simulated monolayers of the tiled mode, which the reference analyzes at full "
+                             "resolution (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the simulated monolayers")
+    parser.add_argument("--large-image", action="store_true",
+                        help=f"also check that the tiled mode analyzes a {LARGE_IMAGE_SIZE} x {LARGE_IMAGE_SIZE} "
+                             f"image, which is above Pillow's decompression bomb limit (writes a 180 MB temporary "
+                             f"file)")
+    parser.add_argument("-o", "--output", default="equivalence.json", help="report file (default: %(default)s)")
+    arguments = parser.parse_args(argv)
+
+    input_images = Engine.find_images(arguments.inputs, valid_image_types)
+    input_controls = Engine.find_images(arguments.controls, valid_image_types) if arguments.controls else []
+    cells = arguments.cells or (CELL_COUNT, CELL_COUNT)
+    options = Engine.CalibrationOptions.basic(cells[0], cells[1], "Red")
+    if not arguments.estimate_blur:
+        options = replace(options, settings=replace(options.settings, blur_radius=arguments.blur_radius),
+                          cell_count=0)
+
+    with TemporaryDirectory() as folder:
+        # The tiled mode analyzes at full resolution, so it uses smaller simulated monolayers
+        datasets = {}
+        reference_results = {}
+        report = {"modes": []}
+        for mode in arguments.modes:
+            image_size = arguments.tiled_size if MODES[mode]["tile_size"] > 0 else arguments.size
+            if image_size not in datasets:
+                datasets[image_size] = simulated_images(arguments, image_size, folder) if arguments.simulated > 0 \
+                    else ([], {})
+            images, lengths = datasets[image_size]
+            controls = input_controls or images[:arguments.simulated]
+            images = images + input_images
+            if not images or not controls:
+                print("No images found!", file=sys.stderr)
+                return 1
+
+            result = check_mode(mode, options, controls, images, lengths,
+                                reference_results.setdefault(image_size, {}), folder)
+            result.update(simulated_size=image_size, images=len(images), simulated=len(lengths),
+                          controls=len(controls))
+            report["modes"].append(result)
+
+        report["session"] = check_session(arguments, folder)
+        if arguments.large_image:
+            report["large_image"] = check_large_image(arguments, folder)
+
+    for result in report["modes"]:
+        correlation = result["accuracy"].get("correlation")
+        print(f"{result['mode']}: {'PASSED' if result['passed'] else 'FAILED'} "
+              f"({'exact' if result['exact'] else 'within tolerances' if result['passed'] else 'outside tolerances'}). "
+              f"Max IJOQ difference {result['max_IJOQ_difference']}, max pixel difference "
+              f"{result['max_pixel_difference']:.4f}, calibration differences {result['calibration_differences']}, "
+              f"max level differences {result['ingest_levels']} (loading) and {result['blur_levels']} (blur)"
+              + (f", IJOQ/length correlation {correlation:.4f} (reference "
+                 f"{result['accuracy']['reference_correlation']:.4f})" if correlation is not None else ""))
+
+    print(f"session: {'PASSED' if report['session']['passed'] else 'FAILED'}. "
+          + report["session"].get("error", f"Saved and loaded at a bit depth of {SESSION_BIT_DEPTH}"))
+    if arguments.large_image:
+        large_image = report["large_image"]
+        print(f"large image: {'PASSED' if large_image['passed'] else 'FAILED'}. "
+              + (f"Error: {large_image['error']}" if "error" in large_image else
+                 f"IJOQ {large_image['IJOQ']}, processed image {large_image['processed_image_size']}"))
+
+    with open(arguments.output, mode="w") as report_file:
+        json.dump(report, report_file, indent=2)
+    print(f"The equivalence report has been saved to {arguments.output}")
+
+    passed = all(result["passed"] for result in report["modes"]) and report["session"]["passed"]
+    if arguments.large_image:
+        passed = passed and report["large_image"]["passed"]
+
+    return 0 if passed else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -5,6 +5,14 @@ current_version = "v1.4.0"
 
 # Initialize program
 if __name__ == "__main__":
+    import sys
+
+    # Run from the command line if any arguments are given (e.g. "python3 IJOQ.py analyze ..."). Only the calculation
+    # libraries are needed here, so the GUI and update check are skipped
+    if len(sys.argv) > 1:
+        import modules.IJOQ_cli as Cli
+        sys.exit(Cli.main(sys.argv[1:], valid_image_types, current_version))
+
     # Check if all required modules are present by importing them
     # Reports an error if the program is unable to open up the required modules
     try:
@@ -1,88 +1,249 @@
-# Version 0.1.1 (Updated 1/12/2021)
-# Made by Devons Mo
-
-from PIL import Image, ImageDraw
-import random
-import math
-import csv
-
-probabilities = [0, 0.1, 0.2, 0.3, 0.5, 0.7]
-image_count = 10
-dampener = 0.6
-intersection_count = 10
-image_size = 512
-
-cell_size = image_size / (intersection_count - 2)
-length_array = []
-
-for k in range(image_count * len(probabilities)):
-    probability = probabilities[math.floor(k / image_count)]
-    intersections = [[[0] * 2 for i in range(intersection_count)] for j in range(intersection_count)]
-
-    # Determine intersection positions
-    for i in range(intersection_count):
-        for j in range(intersection_count):
-            intersections[i][j][0] = round((i + dampener * (random.random() - 0.5) - 0.5) * cell_size)
-            intersections[i][j][1] = round((j + dampener * (random.random() - 0.5) - 0.5) * cell_size)
-
-    # Draw lines between points
-    length = 0
-    image = Image.new("RGB", (image_size, image_size))
-    draw = ImageDraw.Draw(image)
-    # Draw horizontal lines
-    for i in range(intersection_count - 1):
-        for j in range(intersection_count):
-            # Remove lines
-            if random.random() > probability:
-                intersection = [intersections[i][j][0], intersections[i][j][1],
-                                intersections[i + 1][j][0], intersections[i + 1][j][1]]
-
-                draw.line(intersection, fill=(255, 255, 255), width=4)
-
-                # Add length
-                line_length = ((intersection[0] - intersection[2])**2 + (intersection[1] - intersection[3])**2)**0.5
-                # On the left
-                if i == 0:
-                    ratio = intersection[2] / (intersection[2] - intersection[0])
-                    length += ratio * line_length
-                # On the right
-                elif i == intersection_count - 2:
-                    ratio = (image_size - intersection[0]) / (intersection[2] - intersection[0])
-                    length += ratio * line_length
-                # Normal
-                else:
-                    length += line_length
-
-    # Draw vertical lines
-    for i in range(intersection_count):
-        for j in range(intersection_count - 1):
-            # Remove lines
-            if random.random() > probability:
-                intersection = [intersections[i][j][0], intersections[i][j][1],
-                                intersections[i][j + 1][0], intersections[i][j + 1][1]]
-
-                draw.line(intersection, fill=(255, 255, 255), width=4)
-
-                # Add length
-                line_length = ((intersection[0] - intersection[2]) ** 2 + (intersection[1] - intersection[3]) ** 2) ** 0.5
-                # On the top
-                if j == 0:
-                    ratio = intersection[3] / (intersection[3] - intersection[1])
-                    length += ratio * line_length
-                # On the bottom
-                elif j == intersection_count - 2:
-                    ratio = (image_size - intersection[1]) / (intersection[3] - intersection[1])
-                    length += ratio * line_length
-                # Normal
-                else:
-                    length += line_length
-
-    print(length)
-    image.save(str(k + 1) + ".png")
-    length_array.append(length)
-
-with open("length.csv", mode="w", newline="") as data_file:
-    data_writer = csv.writer(data_file)
-    data_writer.writerow(["File name", "Length"])
-    for i in range(image_count * len(probabilities)):
-        data_writer.writerow([i + 1, length_array[i]])
+# Version 0.3.0 (Updated 10/18/2026)
+# Made by Devons Mo
+
+# Generates simulated monolayer images along with the total length of their junctions. Run as a script to save a data
+# set of images and a length.csv file (see "python3 Simulator.py --help"), or import simulate_monolayer and
+# simulate_dataset to generate images in memory
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+import csv
+from os import cpu_count, makedirs, path
+import sys
+from PIL import Image
+import numpy
+import modules.IJOQ_engine as Engine
+
+# Width (in pixels) of the drawn junctions, and largest number of runs of pixels drawn at once (see draw_lines)
+JUNCTION_WIDTH = 4
+DRAW_BATCH_SIZE = 2 ** 20
+
+def junction_lengths(start_points, end_points, axis, image_size, line_count):
+    """
+    Calculates the length of each junction inside the image. Junctions leaving the image through the side that their
+    axis points to are only counted up to the image border
+    :param start_points: 3D array of the (x, y) start points of the junctions, indexed [i][j] as the intersections
+    :param end_points: 3D array of the (x, y) end points of the junctions
+    :param axis: 0 for horizontal junctions, 1 for vertical junctions
+    :param image_size: Width and height (in pixels) of the image
+    :param line_count: Number of junctions along the axis (index 0 starts before the image, the last one ends past it)
+    :return: 2D array of the length of each junction
+    """
+
+    line_lengths = numpy.hypot(*numpy.moveaxis(end_points - start_points, -1, 0))
+    start, end = start_points[..., axis], end_points[..., axis]
+
+    # Only the part on the image side of the first and last junction along the axis is counted
+    ratios = numpy.ones(line_lengths.shape)
+    index = numpy.arange(line_count).reshape((-1, 1) if axis == 0 else (1, -1))
+    index = numpy.broadcast_to(index, line_lengths.shape)
+    first, last = index == 0, index == line_count - 1
+    ratios[first] = end[first] / (end[first] - start[first])
+    ratios[last] = (image_size - start[last]) / (end[last] - start[last])
+
+    return ratios * line_lengths
+
+def draw_line_batch(image_array, starts, ends, width, transposed):
+    """
+    Draws a batch of lines into an image (see draw_lines). Each line is drawn as runs of pixels across its major axis,
+    one run per pixel along the major axis
+    :param image_array: 2D uint8 array that the lines are drawn into
+    :param starts: 2D array of the (u, v) start points of the lines, where u is the major axis of every line
+    :param ends: 2D array of the (u, v) end points of the lines
+    :param width: Line width in pixels
+    :param transposed: If False, u is x and v is y. If True, u is y and v is x
+    :return: None
+    """
+
+    height, image_width = image_array.shape
+    u_size, v_size = (height, image_width) if transposed else (image_width, height)
+    u_stride, v_stride = (image_width, 1) if transposed else (1, image_width)
+
+    # Step along u one pixel at a time, from half a width before each line to half a width after it
+    u_start, v_start = starts[:, 0], starts[:, 1]
+    u_direction, v_direction = ends[:, 0] - u_start, ends[:, 1] - v_start
+    length_squared = u_direction ** 2 + v_direction ** 2
+    slope = v_direction / u_direction
+    half_run = width / 2 * numpy.sqrt(length_squared) / numpy.abs(u_direction)
+    first = numpy.floor(numpy.minimum(u_start, ends[:, 0]) - width / 2).astype(numpy.int64)
+    steps = numpy.ceil(numpy.maximum(u_start, ends[:, 0]) + width / 2).astype(numpy.int64) - first + 1
+    line_index = numpy.repeat(numpy.arange(len(starts)), steps)
+    u = numpy.arange(len(line_index)) - numpy.repeat(numpy.cumsum(steps) - steps - first, steps)
+
+    # Pixel centers within width / 2 of the line
+    u_offset = u + 0.5 - u_start[line_index]
+    center = v_start[line_index] + u_offset * slope[line_index]
+    run_half = half_run[line_index]
+    low = center - run_half
+    high = center + run_half
+
+    # Pixel centers between the end points, whose position along the line is from 0 to its length. Across a line that
+    # is not parallel to u, this limits v. Otherwise, it limits u
+    position = u_offset * u_direction[line_index]
+    run_length_squared = length_squared[line_index]
+    run_v_direction = v_direction[line_index]
+    sloped = run_v_direction != 0
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        first_end = v_start[line_index] - position / run_v_direction
+        last_end = first_end + run_length_squared / run_v_direction
+    numpy.maximum(low, numpy.minimum(first_end, last_end), out=low, where=sloped)
+    numpy.minimum(high, numpy.maximum(first_end, last_end), out=high, where=sloped)
+    inside = sloped | ((position >= 0) & (position <= run_length_squared))
+
+    # Clip the runs to the image, then draw them
+    inside &= (u >= 0) & (u < u_size)
+    v_low = numpy.maximum(numpy.ceil(low - 0.5), 0).astype(numpy.int64)
+    v_high = numpy.minimum(numpy.floor(high - 0.5), v_size - 1).astype(numpy.int64)
+    counts = numpy.where(inside, v_high - v_low + 1, 0)
+    run_position = numpy.arange(counts.max(initial=0))
+    pixels = (u * u_stride + v_low * v_stride)[:, None] + run_position * v_stride
+    image_array.reshape(-1)[pixels[run_position < counts[:, None]]] = 255
+
+def draw_lines(image_array, lines, width=JUNCTION_WIDTH):
+    """
+    Draws straight lines with flat ends into an image in numpy, in batches of lines instead of one line at a time. A
+    pixel is drawn if its center is within width / 2 of a line and between its end points, so a horizontal line of
+    length L covers L * width pixels. Pixel (x, y) spans the coordinates x to x + 1 and y to y + 1
+    :param image_array: 2D uint8 array that the lines are drawn into, with a value of 255. Must be contiguous
+    :param lines: 2D array of (x0, y0, x1, y1) lines
+    :param width: Line width in pixels
+    :return: None
+    """
+
+    lines = numpy.asarray(lines, dtype=numpy.float64).reshape(-1, 4)
+    lines = lines[(lines[:, 0] != lines[:, 2]) | (lines[:, 1] != lines[:, 3])]
+
+    # Lines closer to horizontal are drawn as vertical runs of pixels, and the others as horizontal runs, in batches
+    # of about DRAW_BATCH_SIZE runs to bound the memory used
+    steep = numpy.abs(lines[:, 3] - lines[:, 1]) > numpy.abs(lines[:, 2] - lines[:, 0])
+    for transposed, major_lines in ((False, lines[~steep]), (True, lines[steep][:, [1, 0, 3, 2]])):
+        sizes = numpy.abs(major_lines[:, 2] - major_lines[:, 0]) + width + 3
+        batch_numbers = (numpy.cumsum(sizes) - sizes) // DRAW_BATCH_SIZE
+        for batch in numpy.split(major_lines, numpy.flatnonzero(numpy.diff(batch_numbers)) + 1):
+            if len(batch) > 0:
+                draw_line_batch(image_array, batch[:, :2], batch[:, 2:], width, transposed)
+
+def simulate_monolayer(image_size=512, probability=0, intersection_count=10, dampener=0.6, seed=None):
+    """
+    Draws a synthetic monolayer: a jittered grid of cell junctions, with some of the junctions removed
+    :param image_size: Width and height (in pixels) of the image
+    :param probability: Probability that each junction is removed
+    :param intersection_count: Number of grid points along each axis (the cell size is image_size / (count - 2))
+    :param dampener: Amount of random jitter of the grid points, relative to the cell size
+    :param seed: Seed of the random numbers (anything accepted by numpy.random.default_rng, such as an integer or a
+        list of integers). The same seed always gives the same image. If None, a random image is drawn
+    :return: Tuple of the 2D uint8 array containing the image (junctions are 255, the rest is 0) and the total length
+        (in pixels) of the junctions inside the image
+    """
+
+    random_generator = numpy.random.default_rng(seed)
+    cell_size = image_size / (intersection_count - 2)
+
+    # Determine intersection positions, indexed [i][j] = (x, y) with i along x and j along y
+    grid = numpy.stack(numpy.meshgrid(numpy.arange(intersection_count), numpy.arange(intersection_count),
+                                      indexing="ij"), axis=-1)
+    jitter = dampener * (random_generator.random((intersection_count, intersection_count, 2)) - 0.5)
+    intersections = numpy.rint((grid + jitter - 0.5) * cell_size).astype(numpy.int64)
+
+    # Keep each junction unless it is removed
+    horizontal_kept = random_generator.random((intersection_count - 1, intersection_count)) > probability
+    vertical_kept = random_generator.random((intersection_count, intersection_count - 1)) > probability
+    horizontal_lines = numpy.concatenate((intersections[:-1, :], intersections[1:, :]), axis=-1)[horizontal_kept]
+    vertical_lines = numpy.concatenate((intersections[:, :-1], intersections[:, 1:]), axis=-1)[vertical_kept]
+
+    length = junction_lengths(intersections[:-1, :], intersections[1:, :], 0, image_size,
+                              intersection_count - 1)[horizontal_kept].sum()
+    length += junction_lengths(intersections[:, :-1], intersections[:, 1:], 1, image_size,
+                               intersection_count - 1)[vertical_kept].sum()
+
+    # Draw lines between points
+    image_array = numpy.zeros((image_size, image_size), dtype=numpy.uint8)
+    draw_lines(image_array, numpy.concatenate((horizontal_lines, vertical_lines)))
+
+    return image_array, float(length)
+
+def simulate_dataset_image(index, probability, image_size, intersection_count, dampener, seed, folder=None):
+    """
+    Draws one image of a data set. Safe to run in a worker process
+    :param index: Index of the image in the data set
+    :param probability: Probability that each junction is removed
+    :param image_size: Width and height (in pixels) of the image
+    :param intersection_count: Number of grid points along each axis
+    :param dampener: Amount of random jitter of the grid points
+    :param seed: Seed of the data set (an integer), or None for random images
+    :param folder: If given, the image is saved to this folder as "(index + 1).png" instead of being returned
+    :return: Tuple of the image array (None if saved) and the total junction length
+    """
+
+    image_array, length = simulate_monolayer(image_size, probability, intersection_count, dampener,
+                                             None if seed is None else (seed, index))
+    if folder is None:
+        return image_array, length
+
+    Image.fromarray(image_array).save(path.join(folder, f"{index + 1}.png"))
+
+    return None, length
+
+def simulate_dataset(image_count, probabilities, image_size=512, intersection_count=10, dampener=0.6, seed=0,
+                     folder=None, workers=1):
+    """
+    Draws a data set of simulated monolayers: image_count images for each junction-removal probability. Every image
+    has its own seed derived from the data set seed, so the data set does not depend on the number of workers
+    :param image_count: Number of images per probability
+    :param probabilities: Probabilities that each junction is removed
+    :param image_size: Width and height (in pixels) of the images
+    :param intersection_count: Number of grid points along each axis
+    :param dampener: Amount of random jitter of the grid points
+    :param seed: Seed of the data set (an integer), or None for random images
+    :param folder: If given, images are saved to this folder as "1.png", "2.png", ... instead of being returned
+    :param workers: Number of worker processes that draw (and save) the images in parallel. Only a few images per
+        worker are held in memory at a time
+    :return: Generator yielding (file number, probability, image array (None if saved), junction length) for every
+        image, in order
+    """
+
+    jobs = ((index, probabilities[index // image_count], image_size, intersection_count, dampener, seed, folder)
+            for index in range(image_count * len(probabilities)))
+    with ProcessPoolExecutor(workers) if workers > 1 else nullcontext() as executor:
+        for index, (image_array, length) in enumerate(Engine.map_jobs(simulate_dataset_image, jobs, executor,
+                                                                      4 * workers)):
+            yield index + 1, probabilities[index // image_count], image_array, length
+
+def main(argv):
+    """
+    Saves a data set of simulated monolayers and their junction lengths
+    :param argv: Command-line arguments, excluding the program name
+    :return: Exit code
+    """
+
+    parser = argparse.ArgumentParser(prog="Simulator.py", description="Saves simulated monolayer images as 1.png, "
+                                                                      "2.png, ... and their junction lengths to "
+                                                                      "length.csv.")
+    parser.add_argument("--probabilities", nargs="+", type=float, default=[0, 0.1, 0.2, 0.3, 0.5, 0.7],
+                        help="probabilities that each junction is removed (default: %(default)s)")
+    parser.add_argument("--count", type=int, default=10, help="images per probability (default: %(default)s)")
+    parser.add_argument("--size", type=int, default=512, help="image width and height (default: %(default)s)")
+    parser.add_argument("--intersections", type=int, default=10,
+                        help="grid points along each axis (default: %(default)s)")
+    parser.add_argument("--dampener", type=float, default=0.6,
+                        help="random jitter of the grid points, relative to the cell size (default: %(default)s)")
+    parser.add_argument("--seed", type=int, help="seed of the data set. The same seed always gives the same images")
+    parser.add_argument("-w", "--workers", type=int, default=cpu_count() or 1,
+                        help="number of worker processes (default: number of CPU cores)")
+    parser.add_argument("-o", "--output", default=".", help="folder to save to (default: current folder)")
+    arguments = parser.parse_args(argv)
+
+    makedirs(arguments.output, exist_ok=True)
+    with open(path.join(arguments.output, "length.csv"), mode="w", newline="") as data_file:
+        data_writer = csv.writer(data_file)
+        data_writer.writerow(["File name", "Length"])
+        for file_number, _, _, length in simulate_dataset(arguments.count, arguments.probabilities, arguments.size,
+                                                          arguments.intersections, arguments.dampener, arguments.seed,
+                                                          arguments.output, arguments.workers):
+            data_writer.writerow([file_number, length])
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,8 +1,22 @@
-from math import floor
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import astuple, replace
+import multiprocessing
+from os import cpu_count, path
+from queue import Empty, SimpleQueue
 import tkinter
-from threading import Thread
-from PIL import Image, ImageFilter, ImageTk
-import numpy
+from tkinter import filedialog
+from threading import Condition, Thread
+from time import perf_counter
+from PIL import Image
+import modules.IJOQ_engine as Engine
+
+def error_text(error):
+    """
+    :param error: Exception to describe
+    :return: Message of the exception, or its type if it has no message
+    """
+
+    return str(error) or type(error).__name__
 
 class Calculations:
 
@@ -22,24 +36,22 @@ class Calculations:
         self.confirmed_files = []
         self.confirmed_file_names = ()
         self.processed_files = []
-        self.confirmed_channel = 0
-        self.confirmed_image_compression = 0
-        self.confirmed_blur_radius = 0
-        self.confirmed_section_number = 0
-        self.confirmed_pixel_number = 0
-        self.confirmed_normal_threshold = 0
-        self.confirmed_noise_filter = 0
-        self.confirmed_line_number = 0
+        self.settings = Engine.Settings()
         self.current_viewed_picture = 0
         self.input_files = []
         self.minimum_files = 3 if self.type == "calculation" else 1
+        self.timer = None  # StageTimer of the last calibration or analysis run, saved next to its results
+
+        # Events sent by the calculation threads, handled by the GUI thread (see take_events). Tkinter is not
+        # thread-safe, so the calculation threads never update the GUI themselves
+        self.events = SimpleQueue()
 
         # Variables used for only calibration
         if self.type == "calibration":
-            self.blurred_images = []
-            self.normalization_thresholds = []
-            self.brightness_maps = []
-            self.noise_filter_threads = []
+            self.calibration_options = None
+            self.calibration_result = None
+            self.blur_level_thread = None
+            self.noise_filter_thread = None
 
             # GUI-related settings selection variables (used in calibration
             # TODO: Figure out why I made all of these StringVars instead of IntVar or DoubleVar
@@ -47,7 +59,7 @@ class Calculations:
             self.cell_number_x.set("0")
             self.cell_number_y = tkinter.StringVar()
             self.cell_number_y.set("0")
-            self.channel_options = ("Red", "Green", "Blue", "White")
+            self.channel_options = tuple(Engine.CHANNEL_OPTIONS)
             self.channel_selection = tkinter.StringVar()
             self.image_compression = tkinter.StringVar()
             self.image_compression.set("512")
@@ -61,82 +73,151 @@ class Calculations:
             self.noise_filter.set("0.1")
             self.line_number = tkinter.StringVar()
             self.line_number.set("10")
+            self.fast_ingest = tkinter.BooleanVar()
+            self.fast_ingest.set(True)
+            self.fast_blur = tkinter.BooleanVar()
+            self.fast_blur.set(False)
+            self.bit_depth = tkinter.StringVar()
+            self.bit_depth.set("8")
+            self.tile_size = tkinter.StringVar()
+            self.tile_size.set("0")
             self.results_blur_radius = tkinter.StringVar()
             self.results_noise_filter = tkinter.StringVar()
 
         # Variables used for only analysis
         else:
-            self.IJOQ_list = []
+            self.results = []
             self.has_uploaded_settings = False
-            self.channel_selection = 0
-            self.image_compression = 0
-            self.blur_radius = 0
-            self.section_number = 0
-            self.pixel_number = 0
-            self.normal_threshold = 0
-            self.noise_filter = 0
-            self.line_number = 0
-
-    def calculate_threshold(self, x, y, section_count, threshold_array, section_width, section_height):
-        """
-        Calculates the threshold value for a given pixel
-        :param x: x-coordinate of the pixel (left to right)
-        :param y: y-coordinate of the pixel (top to bottom)
-        :param section_count: The number of sections that the image is split into along a single axis
-        :param threshold_array: A 2D array containing the calculated thresholds for each bin
-        :param section_width: Width (in pixels) of a bin
-        :param section_height: Height (in pixels) of a bin
-        :return: Brightness (out of 255) of the threshold
-        """
-        # Calculate a pixel's upper left section, as well as its relative position to the next section
-        x_percent = round(((x - section_width / 2) % section_width) / section_width, 2)
-        y_percent = round(((y - section_height / 2) % section_height) / section_height, 2)
-        left_section = floor((x / section_width) - 0.5)
-        top_section = floor((y / section_height) - 0.5)
-
-        # If pixel is not near a border, find the normalization thresholds of the 4 closest sections
-        if 0 <= left_section <= (section_count - 2) and 0 <= top_section <= (section_count - 2):
-            top_left_threshold = threshold_array[left_section][top_section]
-            top_right_threshold = threshold_array[left_section + 1][top_section]
-            bottom_left_threshold = threshold_array[left_section][top_section + 1]
-            bottom_right_threshold = threshold_array[left_section + 1][top_section + 1]
-        # If pixel is less than half a grid away from the border, copy teh normalization threshold value
-        else:
-            top_left_value = (left_section, top_section)
-            top_right_value = (left_section + 1, top_section)
-            bottom_left_value = (left_section, top_section + 1)
-            bottom_right_value = (left_section + 1, top_section + 1)
-
-            # Pixel is on the left border
-            if left_section < 0:
-                top_left_value = top_right_value
-                bottom_left_value = bottom_right_value
-            # Pixel is on the right border
-            elif left_section >= section_count - 1:
-                top_right_value = top_left_value
-                bottom_right_value = bottom_left_value
-
-            # Pixel is on top border
-            if top_section < 0:
-                top_left_value = bottom_left_value
-                top_right_value = bottom_right_value
-            # Pixel is on bottom border
-            elif top_section >= section_count - 1:
-                bottom_left_value = top_left_value
-                bottom_right_value = top_right_value
-
-            top_left_threshold = threshold_array[top_left_value[0]][top_left_value[1]]
-            top_right_threshold = threshold_array[top_right_value[0]][top_right_value[1]]
-            bottom_left_threshold = threshold_array[bottom_left_value[0]][bottom_left_value[1]]
-            bottom_right_threshold = threshold_array[bottom_right_value[0]][bottom_right_value[1]]
-
-        # Calculate the weighted average of the normalization cutoff value
-        threshold_top = ((1 - x_percent) * top_left_threshold) + (x_percent * top_right_threshold)
-        threshold_bottom = ((1 - x_percent) * bottom_left_threshold) + (x_percent * bottom_right_threshold)
-
-        threshold_final = round(((1 - y_percent) * threshold_top) + (y_percent * threshold_bottom))
-
-        return threshold_final
+            self.uploaded_settings = Engine.Settings()
+            self.confirmed_dense_lines = False
+            self.dense_lines = tkinter.BooleanVar()
+            self.dense_lines.set(False)
+            self.results_path = None  # Output folder that results are saved to during the analysis, if streaming
+            self.stream_results = tkinter.BooleanVar()
+            self.stream_results.set(False)
+            self.confirmed_analyze_frames = False
+            self.analyze_frames = tkinter.BooleanVar()
+            self.analyze_frames.set(False)
+            self.use_cache = tkinter.BooleanVar()
+            self.use_cache.set(False)
+            self.cache_size = tkinter.StringVar()
+            self.cache_size.set(str(Engine.RESULT_CACHE_SIZE // 1024 ** 2))
+            self.confirmed_cache_size = 0  # Maximum size (in MB) of the result cache, or 0 if results are not cached
+            self.result_cache = None
+
+    def settings_text(self, settings):
+        """
+        Formats settings for the settings value labels (one value per line)
+        :param settings: Settings to format
+        :return: String containing the settings values
+        """
+
+        return "\n".join(str(value) for value in astuple(settings))
+
+    def get_processed_file(self, image_number):
+        """
+        Gets a processed image. Images saved during the analysis are loaded from the output folder
+        :param image_number: Index of the processed image
+        :return: Image object
+        """
+
+        processed_file = self.processed_files[image_number]
+        if isinstance(processed_file, str):
+            return Image.open(processed_file)
+
+        return processed_file
+
+    def get_processed_file_name(self, image_number):
+        """
+        Gets the name shown above a processed image
+        :param image_number: Index of the processed image
+        :return: File name of the image, followed by the frame number when analyzing by frame
+        """
+
+        if self.type == "calibration":
+            return self.confirmed_file_names[image_number]
+
+        return Engine.result_label(self.results[image_number])
+
+    def report_progress(self, message=None, steps=0):
+        """
+        Progress callback for the calculation engine. Safe to call from any thread. Sends a progress event, which the
+        GUI uses to write the message to the calculation textbox and advance the progress bar
+        :param message: Text to add to the textbox, or None
+        :param steps: Number of steps to advance the progress bar by
+        :return: None
+        """
+
+        self.events.put(("progress", message, steps))
+
+    def call_in_gui(self, function, *arguments):
+        """
+        Sends an event that runs a function on the GUI thread, after all events sent before it. Safe to call from any
+        thread. Used by the calculation threads for every change to the GUI
+        :param function: Function to run
+        :param arguments: Arguments of the function
+        :return: None
+        """
+
+        self.events.put(("call", function, arguments))
+
+    def take_events(self):
+        """
+        Removes every event sent so far from the event queue
+        :return: List of events, in the order they were sent. Progress events are ("progress", message, steps) and
+            function calls are ("call", function, arguments)
+        """
+
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except Empty:
+                return events
+
+    def end_calculation(self, completed):
+        """
+        Re-enables the tabs and buttons that were disabled while the calibration or analysis was running. Must be run on
+        the GUI thread (see call_in_gui)
+        :param completed: If True, also enable the results page and the confirm button
+        :return: None
+        """
+
+        tab = self.parent.calibration_tab if self.type == "calibration" else self.parent.analysis_tab
+
+        tab.sub_tabs.tab(0, state="normal")
+        tab.sub_tabs.tab(1, state="normal")
+        tab.calculation_previous_button["state"] = "normal"
+        if completed:
+            tab.sub_tabs.tab(3, state="normal")
+            tab.calculation_confirm_button["state"] = "normal"
+
+    def add_progress_steps(self, steps):
+        """
+        Raises the maximum of the analysis progress bar. Must be run on the GUI thread (see call_in_gui)
+        :param steps: Number of steps to add
+        :return: None
+        """
+
+        progress_bar = self.parent.analysis_tab.calculation_progress_bar
+        progress_bar.config(maximum=progress_bar["maximum"] + steps)
+
+    def stop_calibration_threads(self):
+        """
+        Stops the background threads of the current calibration result
+        :return: None
+        """
+
+        # Check for an existing noise filter calculation thread. If it exists, stop it and wait for it to finish
+        if self.noise_filter_thread is not None:
+            self.noise_filter_thread.halt()
+            self.noise_filter_thread.join()
+            self.noise_filter_thread = None
+
+        # Stop computing the blur levels of the previous calibration
+        if self.blur_level_thread is not None:
+            self.blur_level_thread.halt()
+            self.blur_level_thread = None
 
     def go_to_calibration(self):
         """
@@ -144,62 +225,34 @@ class Calculations:
         :return: None
         """
 
-        # Check for existing noise filter calculation threads. If previous threads exist, prompt them to stop
-        if self.noise_filter_threads:
-            for thread in self.noise_filter_threads:
-                thread.stop = True
-
-            # Wait for threads to stop before continuing
-            for thread in self.noise_filter_threads:
-                thread.join()
+        self.stop_calibration_threads()
 
         # Determine settings
         # If using basic settings
         if self.parent.calibration_tab.cal_settings_options_tabs.index("current") == 0:
-            average_cell_count = (int(self.cell_number_x.get()) + int(self.cell_number_y.get())) / 2
-            if average_cell_count > 50:
-                self.confirmed_image_compression = 1024
-                self.confirmed_section_number = 6
-            else:
-                self.confirmed_image_compression = 512
-                self.confirmed_section_number = 4
-
-            if self.channel_selection.get() == "Red":
-                self.confirmed_channel = 0
-            elif self.channel_selection.get() == "Green":
-                self.confirmed_channel = 1
-            elif self.channel_selection.get() == "Blue":
-                self.confirmed_channel = 2
-            elif self.channel_selection.get() == "White":
-                self.confirmed_channel = 1
-
-            # TODO: Why is blur radius set to negative average cell count?
-            self.confirmed_blur_radius = -average_cell_count
-            self.confirmed_pixel_number = 8
-            self.confirmed_noise_filter = -1
-            self.confirmed_line_number = max(10, int(round(average_cell_count, -1)))
+            self.calibration_options = Engine.CalibrationOptions.basic(
+                int(self.cell_number_x.get()),
+                int(self.cell_number_y.get()),
+                self.channel_selection.get())
         else:  # If using advanced settings
-            self.confirmed_image_compression = int(self.image_compression.get())
-            if self.channel_selection.get() == "Red":
-                self.confirmed_channel = 0
-            elif self.channel_selection.get() == "Green":
-                self.confirmed_channel = 1
-            elif self.channel_selection.get() == "Blue":
-                self.confirmed_channel = 2
-            elif self.channel_selection.get() == "White":
-                self.confirmed_channel = 1
-            self.confirmed_blur_radius = int(self.blur_radius.get())
-            self.confirmed_section_number = int(self.section_number.get())
-            self.confirmed_pixel_number = int(self.pixel_number.get())
-            self.confirmed_noise_filter = float(self.noise_filter.get())
-            self.confirmed_line_number = int(self.line_number.get())
+            self.calibration_options = Engine.CalibrationOptions.advanced(Engine.Settings(
+                compressed_image_size=int(self.image_compression.get()),
+                channel=Engine.CHANNEL_OPTIONS[self.channel_selection.get()],
+                blur_radius=int(self.blur_radius.get()),
+                section_size=int(self.section_number.get()),
+                pixels_sampled=int(self.pixel_number.get()),
+                noise_cutoff=float(self.noise_filter.get()),
+                lines=int(self.line_number.get()),
+                fast_ingest=int(self.fast_ingest.get()),
+                fast_blur=int(self.fast_blur.get()),
+                tile_size=int(self.tile_size.get()),
+                bit_depth=int(self.bit_depth.get())))
+        self.settings = self.calibration_options.settings
 
         # Set progress bar to 0, delete text in textbox, and clear results
-        self.blurred_images = []
-        self.normalization_thresholds = []
-        self.brightness_maps = []
+        self.calibration_result = None
         self.processed_files = []
-        progress_bar_maximum = (len(self.confirmed_files) * (13 + (12 * (self.confirmed_section_number ** 2)))) + 6
+        progress_bar_maximum = Engine.calibration_steps(len(self.confirmed_files), self.settings.section_size)
         self.parent.calibration_tab.calculation_progress_bar.config(maximum=progress_bar_maximum)
         self.parent.calibration_tab.calculation_progress_bar["value"] = 0
         self.parent.calibration_tab.calculation_textbox.delete(1.0, tkinter.END)
@@ -220,349 +273,92 @@ class Calculations:
 
     def run_calibration(self):
         """
-        Runs the calibration. Should be run as a thread, otherwise the GUI won't update properly
+        Runs the calibration on a pool of worker processes. Should be run as a thread, otherwise the GUI won't update
+        properly. Progress is reported in the original file order as the results come in. Results are shown as soon as
+        the calibrated blur level is ready, and the other blur levels are computed afterward
         :return: None
         """
 
-        # Run calibration
-        self.parent.calibration_tab.calculation_textbox.insert(tkinter.END, "Determining ideal normalization threshold value...")
-        self.parent.calibration_tab.calculation_textbox.see(tkinter.END)
+        # Spread the per-image work across all cores. Worker processes are spawned rather than forked, since forking a
+        # process that is running the GUI threads is unsafe
+        workers = cpu_count() or 1
+        executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+        self.timer = Engine.StageTimer(workers)
+        try:
+            self.calibration_result = Engine.calibrate(
+                self.confirmed_files, self.calibration_options, self.report_progress, executor, self.timer)
+
+        # Stop on any error (such as a missing or unreadable image), so that the GUI is not left waiting
+        except Exception as error:
+            executor.shutdown(cancel_futures=True)
+
+            # Print warning, re-enable file selection and settings, then stop function
+            if isinstance(error, FileNotFoundError):
+                self.report_progress(f"\n\nWARNING! Unable to find file for {path.basename(str(error.filename))}!")
+            else:
+                self.report_progress(f"\n\nWARNING! The calibration failed: {error_text(error)}")
+            self.call_in_gui(self.end_calculation, False)
 
-        # Run the following code for each file
-        brightness_deviation_list = []
-        threshold_list = []
-        for file_number in range(len(self.confirmed_files)):
-            image_name = self.confirmed_file_names[file_number]
-            try:
-                image = Image.open(self.confirmed_files[file_number])
-                width, height = image.size
-                compression_amount = (self.confirmed_image_compression / 2) * (width + height) / (width * height)
-                image = image.resize((round(compression_amount * width), round(compression_amount * height)))
-                width, height = image.size
-
-                # Take the RGB values from all the pixels in the image as an array
-                image_array = numpy.array(image.convert("RGB"))
-
-                # Extract channel
-                self.parent.calibration_tab.calculation_textbox.insert(tkinter.END, f"\n\nExtracting channel from {image_name}...")
-                self.parent.calibration_tab.calculation_textbox.see(tkinter.END)
-                for x in range(width):
-                    for y in range(height):
-                        image_array[y][x] = [image_array[y][x][self.confirmed_channel]] * 3
-
-                if self.confirmed_blur_radius < 0:
-                    # Calculate deviation in brightness of neighboring pixels
-                    brightness_deviation = []
-                    for y in range(1, height):
-                        brightness_deviation.append(int(image_array[y][round(width / 2)][2]) -
-                                                    int(image_array[y - 1][round(width / 2)][2]))
-                    for x in range(1, width):
-                        brightness_deviation.append(int(image_array[round(height / 2)][x][2]) -
-                                                    int(image_array[round(height / 2)][x - 1][2]))
-
-                    brightness_deviation.sort()
-                    IQR = brightness_deviation[round(3 * len(brightness_deviation) / 4)] - \
-                          brightness_deviation[round(len(brightness_deviation) / 4)]
-                    brightness_deviation_list.append(IQR)
-
-                # Apply blur
-                self.parent.calibration_tab.calculation_textbox.insert(tkinter.END, f"\nApplying blur to {image_name}...")
-                self.parent.calibration_tab.calculation_textbox.see(tkinter.END)
-                image = Image.fromarray(image_array.astype("uint8"))
-                blur_radius_values = (0, 1, 2, 3, 4, 5)
-                current_blurred_image_list = []
-                for blur_radius_value in blur_radius_values:
-                    blurred_image = image.filter(ImageFilter.GaussianBlur(radius=blur_radius_value))
-                    current_blurred_image_list.append(blurred_image)
-                    self.parent.calibration_tab.calculation_progress_bar["value"] += 1
-                self.blurred_images.append(current_blurred_image_list)
-
-                # Calculate threshold value for each individual blurred image
-                self.parent.calibration_tab.calculation_textbox.insert(tkinter.END, f"\nCalculating threshold values for {image_name}...")
-                self.parent.calibration_tab.calculation_textbox.see(tkinter.END)
-                current_threshold_list = []
-                for blurred_image in current_blurred_image_list:
-                    image_array = numpy.array(blurred_image.convert("HSV"))
-
-                    # Split the picture into sections
-                    section_width = width / self.confirmed_section_number
-                    section_height = height / self.confirmed_section_number
-
-                    white_pixel_counter = 0
-                    for section_x in range(self.confirmed_section_number):
-                        for section_y in range(self.confirmed_section_number):
-                            # Take a histogram of the current section
-                            histogram = [0] * 256
-                            for x in range(round(section_x * section_width),
-                                           round((section_x + 1) * section_width)):
-                                for y in range(round(section_y * section_height),
-                                               round((section_y + 1) * section_height)):
-                                    histogram[image_array[y][x][2]] += 1
-
-                            # Use Otsu's Method to determine threshold for current section
-                            maximum_variance_threshold = 0
-                            maximum_variance = 0
-                            # Try different thresholds until a maximum variance is found
-                            for i in range(256):
-                                prob_zero = sum(histogram[:i])
-                                prob_one = sum(histogram[i:])
-
-                                if prob_zero > 0 and prob_one > 0:  # Must have at least 1 pixel in both classes
-                                    # Calculate mean zero and mean one
-                                    mean_zero = 0
-                                    mean_one = 0
-                                    for j in range(256):
-                                        if j < i:
-                                            mean_zero += j * histogram[j]
-                                        else:
-                                            mean_one += j * histogram[j]
-                                    mean_zero /= prob_zero
-                                    mean_one /= prob_one
-
-                                    # Calculate variance
-                                    variance = prob_zero * prob_one * ((mean_zero - mean_one) ** 2)
-
-                                    if variance >= maximum_variance:
-                                        maximum_variance_threshold = i
-                                        maximum_variance = variance
-
-                            # Use the determined threshold to set current section to black and white
-                            for x in range(round(section_x * section_width),
-                                           round((section_x + 1) * section_width)):
-                                for y in range(round(section_y * section_height),
-                                               round((section_y + 1) * section_height)):
-                                    if image_array[y][x][2] > maximum_variance_threshold:
-                                        white_pixel_counter += 1
-
-                            # Increment progress bar
-                            self.parent.calibration_tab.calculation_progress_bar["value"] += 1
-
-                    # Determine normalization threshold
-                    white_percent = white_pixel_counter / (width * height)
-
-                    threshold = numpy.ceil((1 - white_percent) * (self.confirmed_pixel_number ** 2))
-                    current_threshold_list.append(threshold)
-
-                threshold_list.append(current_threshold_list)
-
-            # File could not be opened
-            except FileNotFoundError:
-                # Print warning, re-enable file selection and settings, then stop function
-                self.parent.calibration_tab.calculation_textbox.insert(
-                    tkinter.END, f"\n\nWARNING! Unable to find file for {image_name}!")
-                self.parent.calibration_tab.calculation_textbox.see(tkinter.END)
-
-                self.parent.calibration_tab.sub_tabs.tab(0, state="normal")
-                self.parent.calibration_tab.sub_tabs.tab(1, state="normal")
-                self.parent.calibration_tab.calculation_previous_button["state"] = "normal"
+            return
 
-                return
+        self.timer.stop()
+        self.report_progress(f"\n\n{self.timer.summary()}")
 
-        # Take geometric mean of thresholds
-        for i in range(6):
-            product = 1
-            for j in range(len(threshold_list)):
-                product *= threshold_list[j][i]
-
-            average_threshold = round(product ** (1 / len(threshold_list)))
-            self.normalization_thresholds.append(average_threshold)
-
-            self.parent.calibration_tab.calculation_progress_bar["value"] += 1
-
-        self.parent.calibration_tab.calculation_textbox.insert(tkinter.END, f"\n\nPreparing brightness maps...\n")
-        self.parent.calibration_tab.calculation_textbox.see(tkinter.END)
-        for i in range(len(self.confirmed_files)):
-            image_name = self.confirmed_file_names[i]
-
-            self.parent.calibration_tab.calculation_textbox.insert(tkinter.END, f"\nCalculating brightness map for {image_name}...")
-            self.parent.calibration_tab.calculation_textbox.see(tkinter.END)
-            current_brightness_map_list = []
-            for j in range(len(self.blurred_images[i])):
-                width, height = self.blurred_images[i][j].size
-                image_array = numpy.array(self.blurred_images[i][j].convert("HSV"))
-
-                # Split the picture into sections
-                section_width = width / self.confirmed_section_number
-                section_height = height / self.confirmed_section_number
-                normalization_threshold_array = numpy.zeros(
-                    (self.confirmed_section_number, self.confirmed_section_number))
-
-                # For each section, sample pixels, then find the normalization threshold
-                for section_x in range(self.confirmed_section_number):
-                    for section_y in range(self.confirmed_section_number):
-
-                        sampled_values = []
-                        for x in range(self.confirmed_pixel_number):
-                            for y in range(self.confirmed_pixel_number):
-                                pixel_x = round(
-                                    section_width * (section_x + ((x + 0.5) / self.confirmed_pixel_number)))
-                                pixel_y = round(
-                                    section_height * (section_y + ((y + 0.5) / self.confirmed_pixel_number)))
-
-                                sampled_values.append(image_array[pixel_y][pixel_x][2])
-
-                        sampled_values.sort()
-                        normalization_threshold_array[section_x][section_y] = \
-                            sampled_values[self.normalization_thresholds[j] - 1]
-                        self.parent.calibration_tab.calculation_progress_bar["value"] += 1
-
-                # Parse through the image array and calculate brightness map
-                brightness_map = numpy.zeros((height, width))
-                for x in range(width):
-                    for y in range(height):
-                        brightness_map[y][x] = self.calculate_threshold(
-                            x, y,
-                            self.confirmed_section_number,
-                            normalization_threshold_array,
-                            section_width, section_height)
-                current_brightness_map_list.append(brightness_map)
-                self.parent.calibration_tab.calculation_progress_bar["value"] += 1
-
-            self.brightness_maps.append(current_brightness_map_list)
-
-        # Take average of brightness deviations and set as blur radius
-        if self.confirmed_blur_radius < 0:
-            average_brightness_deviation = sum(brightness_deviation_list) / len(brightness_deviation_list)
-            self.confirmed_blur_radius = \
-                max(min(round(25 * average_brightness_deviation / ((-self.confirmed_blur_radius) ** 2.5)), 5), 1)
-
-        # Calculate noise filter
-
-        current_blur_number = self.confirmed_blur_radius
-        if self.confirmed_noise_filter == -1:
-            brightness_deviation_list = []
-            for i in range(len(self.confirmed_files)):
-
-                width, height = self.blurred_images[i][current_blur_number].size
-                image_array = numpy.array(self.blurred_images[i][current_blur_number].convert("HSV"))
-
-                # Calculate difference in brightness between local minima/maxima
-                # TODO: Dividing local maxima by local minima seems funky and can lead to divide-by-zero errors. Check if this is really the intention
-                # Currently doing workaround to set local minimum to 1 if it's 0
-                brightness_deviation = []
-                local_minimum = -1
-                local_maximum = 0
-                increasing = True
-                for y in range(1, height):
-                    if increasing:
-                        if image_array[y][round(width / 2)][2] < 0.95 * local_maximum:
-                            increasing = False
-                            if local_minimum != -1:
-                                difference = (local_maximum / local_minimum) - 1
-                                brightness_deviation.append(difference)
-                            local_minimum = max(int(image_array[y][round(width / 2)][2]), 1)
-                        else:
-                            local_maximum = image_array[y][round(width / 2)][2]
-                    else:
-                        if image_array[y][round(width / 2)][2] > 1.05 * local_minimum:
-                            increasing = True
-                            difference = (local_maximum / local_minimum) - 1
-                            brightness_deviation.append(difference)
-                            local_maximum = image_array[y][round(width / 2)][2]
-                        else:
-                            local_minimum = max(int(image_array[y][round(width / 2)][2]), 1)
-
-                local_minimum = -1
-                local_maximum = 0
-                increasing = True
-                for x in range(1, width):
-                    if increasing:
-                        if image_array[round(height / 2)][x][2] < 0.95 * local_maximum:
-                            increasing = False
-                            if local_minimum != -1:
-                                difference = (local_maximum / local_minimum) - 1
-                                brightness_deviation.append(difference)
-                            local_minimum = max(int(image_array[round(height / 2)][x][2]), 1)
-                        else:
-                            local_maximum = image_array[round(height / 2)][x][2]
-                    else:
-                        if image_array[round(height / 2)][x][2] > 1.05 * local_minimum:
-                            increasing = True
-                            difference = (local_maximum / local_minimum) - 1
-                            brightness_deviation.append(difference)
-                            local_maximum = image_array[round(height / 2)][x][2]
-                        else:
-                            local_minimum = max(int(image_array[round(height / 2)][x][2]), 1)
+        # Only the calibrated blur level has been computed. Compute the others in the background using the same pool
+        self.call_in_gui(self.show_calibration_result, executor)
 
-                if brightness_deviation:
-                    brightness_deviation.sort()
-                    median = brightness_deviation[round(len(brightness_deviation) / 2)]
-                    brightness_deviation_list.append(median)
-                else:
-                    brightness_deviation_list.append(0)
-
-            average_brightness_deviation = sum(brightness_deviation_list) / len(brightness_deviation_list)
-            self.confirmed_noise_filter = \
-                max(min(round(round((average_brightness_deviation / 10) / 0.05) * 0.05, 2), 0.5), 0)
-
-        self.parent.calibration_tab.calculation_textbox.insert(tkinter.END, f"\n\nPreparing output images...\n")
-        self.parent.calibration_tab.calculation_textbox.see(tkinter.END)
-        for i in range(len(self.confirmed_files)):
-            image_name = self.confirmed_file_names[i]
-
-            self.parent.calibration_tab.calculation_textbox.insert(tkinter.END, f"\nNormalizing {image_name}...")
-            self.parent.calibration_tab.calculation_textbox.see(tkinter.END)
-            width, height = self.blurred_images[i][current_blur_number].size
-            image_array = numpy.array(self.blurred_images[i][current_blur_number].convert("HSV"))
-
-            # Normalize image using calculated brightness map
-            normalized_image_array = self.normalize_image(
-                image_array,
-                self.brightness_maps[i][current_blur_number],
-                width, height,
-                self.confirmed_noise_filter)
-
-            normalized_image = Image.fromarray(normalized_image_array.astype("uint8"), "HSV").convert("RGB")
-            self.processed_files.append(normalized_image)
-            self.parent.calibration_tab.calculation_progress_bar["value"] += 1
-
-        self.parent.calibration_tab.calculation_textbox.insert(
-            tkinter.END,
-            "\n\nCalibration complete! Press the \"Show result\" button to view calibration results.")
-        self.parent.calibration_tab.calculation_textbox.see(tkinter.END)
+        # Re-enable tabs at the conclusion of calibration, then enable the next and previous buttons
+        self.call_in_gui(self.end_calculation, True)
+
+    def show_calibration_result(self, executor):
+        """
+        Shows the calibration result on the results page, then computes its missing blur levels in the background. Must
+        be run on the GUI thread
+        :param executor: Executor used to compute the blur levels. Shut down once they are all computed
+        :return: None
+        """
+
+        self.blur_level_thread = BlurLevelThread(self.calibration_result, executor)
+        self.blur_level_thread.start()
+
+        self.settings = self.calibration_result.settings
+        self.processed_files = [Image.fromarray(processed_image)
+                                for processed_image in self.calibration_result.processed_images]
 
         # Update results tab with new results
-        self.confirmed_normal_threshold = self.normalization_thresholds[current_blur_number]
         self.parent.calibration_tab.results_go_to_picture(0)
-        self.parent.calibration_tab.cal_results_settings_value_label.config(
-            text=f"{self.confirmed_image_compression}\n"
-                 f"{self.confirmed_channel}\n"
-                 f"{self.confirmed_blur_radius}\n"
-                 f"{self.confirmed_section_number}\n"
-                 f"{self.confirmed_pixel_number}\n"
-                 f"{self.confirmed_normal_threshold}\n"
-                 f"{self.confirmed_noise_filter}\n"
-                 f"{self.confirmed_line_number}")
-        self.results_blur_radius.set(str(self.confirmed_blur_radius))
-        self.results_noise_filter.set(str(self.confirmed_noise_filter))
+        self.parent.calibration_tab.cal_results_settings_value_label.config(text=self.settings_text(self.settings))
+        self.results_blur_radius.set(str(self.settings.blur_radius))
+        self.results_noise_filter.set(str(self.settings.noise_cutoff))
 
-        # Re-enable tabs at the conclusion of calibration, then enable the next and previous buttons
-        self.parent.calibration_tab.sub_tabs.tab(0, state="normal")
-        self.parent.calibration_tab.sub_tabs.tab(1, state="normal")
-        self.parent.calibration_tab.sub_tabs.tab(3, state="normal")
-        self.parent.calibration_tab.calculation_previous_button["state"] = "normal"
-        self.parent.calibration_tab.calculation_confirm_button["state"] = "normal"
-
-    def normalize_image(self, pixel_array, brightness_map, width, height, noise_threshold):
+    def load_calibration_session(self, file_path):
         """
-        Passes an image through a threshold to produce the final processed image
-        :param pixel_array: 3D array containing the HSV values of the pixels in a pre-blurred image
-        :param brightness_map: 2D array containing all pixel threshold values
-        :param width: Width (in pixels) of the image
-        :param height: Height (in pixels) of the image
-        :param noise_threshold: Arbitrary value added on top of the brightness threshold value to account for noise
-        :return: 3D array containing the HSV values of the pixels after thresholding
+        Loads a calibration session saved from the results page and shows it on the results page. The original images
+        are not needed
+        :param file_path: Path of the session file
+        :return: None
+        :raises OSError: If the session file cannot be read
+        :raises ValueError: If the file is not a valid session file. The current session is kept
         """
-        for x in range(width):
-            for y in range(height):
-                pixel_brightness = pixel_array[y][x][2]
 
-                if pixel_brightness > max(brightness_map[y][x] * (1 + noise_threshold), 20):
-                    pixel_array[y][x][2] = 255
-                else:
-                    pixel_array[y][x][2] = 0
+        # Corrupt or unrelated files can fail in many ways while the session is read and its images are processed
+        try:
+            calibration_result = Engine.CalibrationResult.load(file_path)
+        except (OSError, ValueError):
+            raise
+        except Exception as error:
+            raise ValueError(f"Invalid calibration session file: {error_text(error)}") from error
+
+        self.stop_calibration_threads()
+        self.calibration_result = calibration_result
+        self.confirmed_file_names = tuple(calibration_result.names)
+        self.timer = None
 
-        return pixel_array
+        # Any blur levels that were not computed when the session was saved are computed in the background
+        self.show_calibration_result(ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn")))
+
+        self.parent.calibration_tab.sub_tabs.tab(3, state="normal")
+        self.parent.calibration_tab.sub_tabs.select(3)
 
     def go_to_analysis(self):
         """
@@ -570,20 +366,24 @@ class Calculations:
         :return: None
         """
 
+        # If streaming results, choose the output folder before starting. Stop if the user pressed cancel
+        self.results_path = None
+        if self.stream_results.get():
+            folder_path = filedialog.askdirectory()
+            if not folder_path:
+                return
+            self.results_path = Engine.create_output_folder(folder_path, "Analysis_Output")
+
         # Determine settings
-        self.confirmed_image_compression = self.image_compression
-        self.confirmed_channel = self.channel_selection
-        self.confirmed_blur_radius = self.blur_radius
-        self.confirmed_section_number = self.section_number
-        self.confirmed_pixel_number = self.pixel_number
-        self.confirmed_normal_threshold = self.normal_threshold
-        self.confirmed_noise_filter = self.noise_filter
-        self.confirmed_line_number = self.line_number
+        self.settings = replace(self.uploaded_settings)
+        self.confirmed_dense_lines = self.dense_lines.get()
+        self.confirmed_analyze_frames = self.analyze_frames.get()
+        self.confirmed_cache_size = int(self.cache_size.get()) if self.use_cache.get() else 0
 
         # Set progress bar to 0, delete text in textbox, and clear results
         self.processed_files = []
-        self.IJOQ_list = []
-        progress_bar_maximum = len(self.confirmed_files) * (6 + (self.confirmed_section_number ** 2))
+        self.results = []
+        progress_bar_maximum = len(self.confirmed_files) * (6 + (self.settings.section_size ** 2))
         self.parent.analysis_tab.calculation_progress_bar.config(maximum=progress_bar_maximum)
         self.parent.analysis_tab.calculation_progress_bar["value"] = 0
         self.parent.analysis_tab.calculation_textbox.delete(1.0, tkinter.END)
@@ -608,234 +408,340 @@ class Calculations:
         :return: None
         """
 
-        # Run analysis
-        for file in self.confirmed_files:
-            # Determine the image name
-            image_name = file.split("/")[-1]
+        executor = None
+        result_writer = None
+        file = None
+        try:
+            # If caching, images that have not changed since they were last analyzed with the same settings are not
+            # analyzed again
+            self.result_cache = None
+            if self.confirmed_cache_size:
+                self.result_cache = Engine.ResultCache(self.result_cache_path(),
+                                                       self.confirmed_cache_size * 1024 ** 2)
+
+            # Spread the tiles of images analyzed in tiles, or else the frames of multi-page images, across all cores
+            workers = 1
+            if self.settings.tile_size > 0 or self.confirmed_analyze_frames:
+                workers = cpu_count() or 1
+                executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+            self.timer = Engine.StageTimer(workers)
+
+            # If streaming, save each result as soon as it is done, and only keep the path of its processed image
+            if self.results_path is not None:
+                result_writer = Engine.ResultWriter(self.results_path, self.parent.current_version,
+                                                    self.confirmed_dense_lines, frames=self.confirmed_analyze_frames,
+                                                    summary=self.confirmed_analyze_frames)
+
+            # Run analysis
+            for file in self.confirmed_files:
+                # When analyzing by frame, every frame of a multi-page image is analyzed separately
+                frames = [None]
+                if self.confirmed_analyze_frames:
+                    frames = range(1, Engine.frame_count(file) + 1)
+                    self.call_in_gui(self.add_progress_steps,
+                                     (len(frames) - 1) * (6 + (self.settings.section_size ** 2)))
+
+                # Frames are analyzed in the worker processes, unless their tiles are
+                if self.confirmed_analyze_frames and self.settings.tile_size == 0:
+                    results = self.analyze_frames_in_workers(file, frames, executor, 2 * workers)
+                else:
+                    results = (self.analyze_file(file, frame, executor) for frame in frames)
 
-            try:
-                self.parent.analysis_tab.calculation_textbox.insert(tkinter.END, f"Analyzing {image_name}...")
-                self.parent.analysis_tab.calculation_textbox.see(tkinter.END)
-
-                image = Image.open(file)
-                width, height = image.size
-                compression_amount = (self.confirmed_image_compression / 2) * (width + height) / (width * height)
-                image = image.resize((round(compression_amount * width), round(compression_amount * height)))
-                width, height = image.size
-
-                # Take the RGB values from all the pixels in the image as an array
-                image_array = numpy.array(image.convert("RGB"))
-
-                # Extract channel
-                self.parent.analysis_tab.calculation_textbox.insert(tkinter.END, f"\nExtracting channel from {image_name}...")
-                self.parent.analysis_tab.calculation_textbox.see(tkinter.END)
-                for x in range(width):
-                    for y in range(height):
-                        image_array[y][x] = [image_array[y][x][self.confirmed_channel]] * 3
-
-                # Apply blur
-                self.parent.analysis_tab.calculation_textbox.insert(tkinter.END, f"\nApplying blur to {image_name}...")
-                self.parent.analysis_tab.calculation_textbox.see(tkinter.END)
-                image = Image.fromarray(image_array.astype("uint8"))
-                blurred_image = image.filter(ImageFilter.GaussianBlur(radius=self.confirmed_blur_radius))
-                image_array = numpy.array(blurred_image.convert("HSV"))
-                self.parent.analysis_tab.calculation_progress_bar["value"] += 1
-
-                # Split the picture into sections
-                self.parent.analysis_tab.calculation_textbox.insert(tkinter.END, f"\nCalculating threshold values for {image_name}...")
-                self.parent.analysis_tab.calculation_textbox.see(tkinter.END)
-                section_width = width / self.confirmed_section_number
-                section_height = height / self.confirmed_section_number
-                normalization_threshold_array = numpy.zeros(
-                    (self.confirmed_section_number, self.confirmed_section_number))
-
-                # For each section, sample pixels, then find the normalization threshold
-                for section_x in range(self.confirmed_section_number):
-                    for section_y in range(self.confirmed_section_number):
-
-                        sampled_values = []
-                        for x in range(self.confirmed_pixel_number):
-                            for y in range(self.confirmed_pixel_number):
-                                pixel_x = round(
-                                    section_width * (section_x + ((x + 0.5) / self.confirmed_pixel_number)))
-                                pixel_y = round(
-                                    section_height * (section_y + ((y + 0.5) / self.confirmed_pixel_number)))
-
-                                sampled_values.append(image_array[pixel_y][pixel_x][2])
-
-                        sampled_values.sort()
-                        normalization_threshold_array[section_x][section_y] = \
-                            sampled_values[self.confirmed_normal_threshold - 1]
-                        self.parent.analysis_tab.calculation_progress_bar["value"] += 1
-
-                # Parse through the image array and calculate brightness map
-                self.parent.analysis_tab.calculation_textbox.insert(tkinter.END, f"\nCalculating brightness map for {image_name}...")
-                self.parent.analysis_tab.calculation_textbox.see(tkinter.END)
-                brightness_map = numpy.zeros((height, width))
-                for x in range(width):
-                    for y in range(height):
-                        brightness_map[y][x] = self.calculate_threshold(
-                            x, y,
-                            self.confirmed_section_number,
-                            normalization_threshold_array,
-                            section_width, section_height)
-                self.parent.analysis_tab.calculation_progress_bar["value"] += 1
-
-                # Normalize image using calculated brightness map
-                normalized_image_array = self.normalize_image(
-                    image_array,
-                    brightness_map,
-                    width, height,
-                    self.confirmed_noise_filter)
-                normalized_image = Image.fromarray(normalized_image_array.astype("uint8"), "HSV").convert("RGB")
-                self.processed_files.append(normalized_image)
-                self.parent.analysis_tab.calculation_progress_bar["value"] += 1
-
-                # Draw horizontal lines
-                self.parent.analysis_tab.calculation_textbox.insert(tkinter.END, f"\nCalculating IJOQ for {image_name}...")
-                self.parent.analysis_tab.calculation_textbox.see(tkinter.END)
-                cell_border_frequency = 0
-                for y in range(self.confirmed_line_number):
-                    pixel_y = round((y + 0.5) * height / self.confirmed_line_number)
-
-                    previous_pixel = image_array[pixel_y][0][2]
-                    for x in range(1, width):
-                        current_pixel = image_array[pixel_y][x][2]
-                        # If the line detects a color change (i.e. black to white or white to black)
-                        if not previous_pixel == current_pixel:
-                            cell_border_frequency += 0.5 / width
-
-                        # Set current pixel as the previous pixel before moving to the next pixel
-                        previous_pixel = current_pixel
-
-                # Increment progress bar
-                self.parent.analysis_tab.calculation_progress_bar["value"] += 1
-
-                # Repeat the same steps vertical lines
-                for x in range(self.confirmed_line_number):
-                    pixel_x = round((x + 0.5) * width / self.confirmed_line_number)
-
-                    previous_pixel = image_array[0][pixel_x][2]
-                    for y in range(1, height):
-                        current_pixel = image_array[y][pixel_x][2]
-                        if not previous_pixel == current_pixel:
-                            cell_border_frequency += 0.5 / height
-
-                        # Set current pixel as the previous pixel before moving to the next pixel
-                        previous_pixel = current_pixel
-
-                # Increment progress bar
-                self.parent.analysis_tab.calculation_progress_bar["value"] += 1
-
-                # Take average of all lines
-                IJOQ = round(cell_border_frequency / (2 * self.confirmed_line_number), 4)
-                self.parent.analysis_tab.calculation_textbox.insert(tkinter.END, f"\n{image_name} has an IJOQ value of {IJOQ}.\n\n")
-                self.parent.analysis_tab.calculation_textbox.see(tkinter.END)
-                self.IJOQ_list.append(IJOQ)
-                self.parent.analysis_tab.calculation_progress_bar["value"] += 1
-
-            # File could not be opened
-            except FileNotFoundError:
-                # Print warning, re-enable file selection and settings, then stop function
-                self.parent.analysis_tab.calculation_textbox.insert(
-                    tkinter.END, f"WARNING! Unable to find file for {image_name}!")
-                self.parent.analysis_tab.calculation_textbox.see(tkinter.END)
-
-                self.parent.analysis_tab.sub_tabs.tab(0, state="normal")
-                self.parent.analysis_tab.sub_tabs.tab(1, state="normal")
-                self.parent.analysis_tab.calculation_previous_button["state"] = "normal"
+                for result, seconds in results:
+                    with self.timer.stage("save"):
+                        if result_writer is not None:
+                            self.processed_files.append(result_writer.write(result))
+                        else:
+                            self.processed_files.append(Image.fromarray(result.processed_image))
+                    self.results.append(result)
+                    self.timer.add_image(Engine.result_label(result), seconds)
+
+            # Errors from here on are not caused by an image
+            file = None
+
+            # The stage timings are saved next to the results
+            self.timer.stop()
+            if self.results_path is not None:
+                self.timer.write(self.results_path + "IJOQ Timings " + self.parent.current_version + ".json")
+
+        # Stop on any error (such as a missing or unreadable image), so that the GUI is not left waiting
+        except Exception as error:
+            # Print warning, re-enable file selection and settings, then stop function
+            if isinstance(error, FileNotFoundError) and file is not None:
+                self.report_progress(f"WARNING! Unable to find file for {Engine.source_name(file)}!")
+            elif file is not None:
+                self.report_progress(f"WARNING! Unable to analyze {Engine.source_name(file)}: {error_text(error)}")
+            else:
+                self.report_progress(f"WARNING! The analysis failed: {error_text(error)}")
+            self.call_in_gui(self.end_calculation, False)
 
-                return
+            return
+        finally:
+            if result_writer is not None:
+                result_writer.close()
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
 
-        self.parent.analysis_tab.calculation_textbox.insert(
-            tkinter.END,
-            "Analysis complete! Press the \"Show result\" button to view analysis results.")
-        self.parent.analysis_tab.calculation_textbox.see(tkinter.END)
+        self.report_progress("Analysis complete! Press the \"Show result\" button to view analysis results.")
+        self.report_progress(f"\n\n{self.timer.summary()}")
 
         # Update results tab with new results
-        self.parent.analysis_tab.results_go_to_picture(0)
+        self.call_in_gui(self.parent.analysis_tab.results_go_to_picture, 0)
 
         # Re-enable tabs at the conclusion of calibration, then enable the next and previous buttons
-        self.parent.analysis_tab.sub_tabs.tab(0, state="normal")
-        self.parent.analysis_tab.sub_tabs.tab(1, state="normal")
-        self.parent.analysis_tab.sub_tabs.tab(3, state="normal")
-        self.parent.analysis_tab.calculation_previous_button["state"] = "normal"
-        self.parent.analysis_tab.calculation_confirm_button["state"] = "normal"
+        self.call_in_gui(self.end_calculation, True)
+
+    def result_cache_path(self):
+        """
+        :return: Path to the folder that the analysis results are cached in
+        """
+
+        return path.join(self.parent.working_directory, "Result_Cache")
+
+    def clear_result_cache(self):
+        """
+        Removes every cached analysis result
+        :return: None
+        """
+
+        if path.isdir(self.result_cache_path()):
+            Engine.ResultCache(self.result_cache_path()).clear()
+
+    def lookup_result(self, file, frame):
+        """
+        :param file: Path to the image file
+        :param frame: Number of the analyzed frame (see Engine.analyze_frame), or None for the whole image
+        :return: Tuple of the cached AnalysisResult (None if not cached) and the key to cache a new result under (None
+            if results are not cached)
+        """
+
+        if self.result_cache is None:
+            return None, None
+
+        with self.timer.stage("cache lookup"):
+            return self.result_cache.lookup(file, self.settings, self.confirmed_dense_lines, frame)
+
+    def report_result(self, result, cached):
+        """
+        Reports the IJOQ of a result whose analysis did not report its progress, and completes its progress steps
+        :param result: AnalysisResult
+        :param cached: True if the result was taken from the result cache
+        :return: None
+        """
+
+        details = ([f"dense IJOQ: {result.dense_IJOQ}"] if result.dense_IJOQ is not None else []) + \
+            (["cached"] if cached else [])
+        self.report_progress(f"{Engine.result_label(result)} has an IJOQ value of {result.IJOQ}"
+                             f"{' (' + ', '.join(details) + ')' if details else ''}.\n\n",
+                             6 + self.settings.section_size ** 2)
+
+    def analyze_file(self, file, frame, executor):
+        """
+        Analyzes an image or a single frame of it, unless its result is cached
+        :param file: Path to the image file
+        :param frame: Number of the frame to analyze (see Engine.analyze_frame), or None to analyze the whole image
+        :param executor: Executor that the tiles of the image are spread across, or None
+        :return: Tuple of the AnalysisResult and the time spent on it
+        """
+
+        start = perf_counter()
+        result, cache_key = self.lookup_result(file, frame)
+        if result is None:
+            if frame is None:
+                result = Engine.analyze_image(file, self.settings, self.confirmed_dense_lines, self.report_progress,
+                                              executor, timer=self.timer)
+            else:
+                self.report_progress(f"Frame {frame}:\n")
+                result = Engine.analyze_frame(file, frame, self.settings, self.confirmed_dense_lines,
+                                              self.report_progress, executor, timer=self.timer)
+            if self.result_cache is not None:
+                self.result_cache.put(cache_key, result)
+        else:
+            self.report_result(result, True)
+
+        return result, perf_counter() - start
+
+    def analyze_frames_in_workers(self, file, frames, executor, max_pending):
+        """
+        Analyzes the frames of a multi-page image in worker processes, except the frames whose results are cached
+        :param file: Path to the image file
+        :param frames: Numbers of the frames to analyze (see Engine.analyze_frame)
+        :param executor: Process pool that the frames are spread across
+        :param max_pending: Maximum number of frames submitted to the executor but not yet returned
+        :return: Generator yielding the AnalysisResult of each frame and the time spent on it, in the order of the
+            frames. The time of a frame analyzed in a worker process is the sum of its stage times
+        """
+
+        cached_results = [self.lookup_result(file, frame) for frame in frames]
+        jobs = ((Engine.analyze_frame, file, frame, self.settings, self.confirmed_dense_lines)
+                for frame, (result, _) in zip(frames, cached_results) if result is None)
+        analyzed_results = Engine.map_jobs(Engine.timed_job, jobs, executor, max_pending)
+        for result, cache_key in cached_results:
+            if result is not None:
+                self.report_result(result, True)
+                yield result, None
+                continue
+
+            result, stage_times = next(analyzed_results)
+            self.timer.add_times(stage_times)
+            if self.result_cache is not None:
+                self.result_cache.put(cache_key, result)
+            self.report_result(result, False)
+
+            yield result, sum(seconds for seconds, _ in stage_times.values())
+
+class BlurLevelThread(Thread):
+    """
+    Starts a thread that computes the remaining blur levels of a calibration, starting with the levels closest to the
+    blur radius selected in the results tab
+    """
+
+    def __init__(self, calibration_result, executor):
+        Thread.__init__(self, daemon=True)
+        self.calibration_result = calibration_result
+        self.executor = executor
+        self.stop = False
+
+    def halt(self):
+        """
+        Prompts the thread to stop after the blur level it is computing
+        :return: None
+        """
+
+        self.stop = True
+
+    def run(self):
+        """
+        Computes blur levels until all of them are available, then shuts down the executor. If a blur level cannot be
+        computed, the error is recorded on the calibration result, so that threads waiting for a blur level stop waiting
+        :return: None
+        """
+
+        try:
+            while not self.stop:
+                # Picked again after every level, so that a newly selected blur radius jumps to the front of the queue
+                blur_number = self.calibration_result.next_blur_level()
+                if blur_number is None:
+                    break
+                self.calibration_result.compute_blur_level(blur_number, self.executor)
+        except Exception as error:
+            self.calibration_result.fail_blur_levels(error_text(error))
+        finally:
+            self.executor.shutdown(cancel_futures=True)
 
 class NoiseCalculationThread(Thread):
     """
-    Starts a thread for updating the calibration results when the blur/noise options are changed
+    Starts a thread for updating the calibration results when the blur/noise options are changed. The thread runs until
+    halted. Rapid changes are coalesced: only the most recently requested settings are computed
     """
 
     def __init__(self, parent, calibration):
-        Thread.__init__(self)
+        Thread.__init__(self, daemon=True)
         self.parent = parent
         self.calibration = calibration
         self.stop = False
-        self.current_file = 0 # TODO: Set as self.parent.cal_current_viewed_picture?
-        self.update_order = []
+        self.requested_settings = None  # (blur radius, noise cutoff) waiting to be computed
+        self.condition = Condition()
+
+    def request_update(self, blur_radius, noise_cutoff):
+        """
+        Requests an update of the processed images. Replaces any request that has not been started yet, and interrupts
+        an update that is in progress
+        :param blur_radius: New blur radius
+        :param noise_cutoff: New noise cutoff
+        :return: None
+        """
+
+        with self.condition:
+            self.requested_settings = (blur_radius, noise_cutoff)
+            self.condition.notify()
+
+    def halt(self):
+        """
+        Prompts the thread to stop
+        :return: None
+        """
+
+        with self.condition:
+            self.stop = True
+            self.condition.notify()
 
     def run(self):
         """
-        Updates the images in the cal_processed_files list according to the current blur/noise settings
+        Waits for update requests and updates the processed images with the latest requested settings
+        :return: None
+        """
+
+        while True:
+            with self.condition:
+                while self.requested_settings is None and not self.stop:
+                    self.condition.wait()
+                if self.stop:
+                    return
+
+                blur_radius, noise_cutoff = self.requested_settings
+                self.requested_settings = None
+
+            self.update_images(blur_radius, noise_cutoff)
+
+    def update_images(self, blur_radius, noise_cutoff):
+        """
+        Updates the images in the processed_files list according to the given blur/noise settings. Stops early if the
+        thread is halted or newer settings are requested
+        :param blur_radius: Blur radius
+        :param noise_cutoff: Noise cutoff
         :return: None
         """
 
+        # Wait for the blur level to be computed by the blur level thread, unless newer settings are requested or the
+        # blur level thread failed
+        calibration_result = self.calibration.calibration_result
+        while not calibration_result.wait_for_blur_level(blur_radius, timeout=0.1):
+            if calibration_result.blur_level_error is not None:
+                self.calibration.call_in_gui(self.parent.cal_show_blur_level_error, calibration_result.blur_level_error)
+                return
+            if self.stop or self.requested_settings is not None:
+                return
+        self.calibration.call_in_gui(self.parent.cal_update_settings_label)
+
         # Save current image number
-        self.current_file = self.calibration.current_viewed_picture
-        blur_number = self.calibration.confirmed_blur_radius
+        current_file = self.calibration.current_viewed_picture
 
         # Determine update order (current image first, then nearby images, etc.)
-        above_images_count = len(self.calibration.processed_files) - self.current_file - 1
-        below_images_count = self.current_file
+        update_order = []
+        above_images_count = len(self.calibration.processed_files) - current_file - 1
+        below_images_count = current_file
 
         for i in range(1, max(above_images_count, below_images_count) + 1):
             if i <= below_images_count:
-                self.update_order.append(self.current_file - i)
+                update_order.append(current_file - i)
             if i <= above_images_count:
-                self.update_order.append(self.current_file + i)
+                update_order.append(current_file + i)
 
         # Calculate current image first
-        blurred_image = self.calibration.blurred_images[self.current_file][blur_number]
-        brightness_map = self.calibration.brightness_maps[self.current_file][blur_number]
-        width, height = blurred_image.size
-
-        image_array = numpy.array(blurred_image.convert("HSV"))
-        normalized_image_array = self.calibration.normalize_image(
-            image_array,
-            brightness_map,
-            width, height,
-            self.calibration.confirmed_noise_filter)
-        normalized_image = Image.fromarray(normalized_image_array.astype("uint8"), "HSV").convert("RGB")
-        self.calibration.processed_files[self.current_file] = normalized_image
-
-        self.parent.draw_results_image(self.current_file)
-
-        # Re-enable slider and spinbox
-        self.parent.cal_results_settings_blur_slider["state"] = "normal"
-        self.parent.cal_results_settings_blur_spinbox["state"] = "normal"
-        self.parent.cal_results_settings_noise_slider["state"] = "normal"
-        self.parent.cal_results_settings_noise_spinbox["state"] = "normal"
+        self.update_image(current_file, blur_radius, noise_cutoff)
+
+        self.calibration.call_in_gui(self.parent.draw_results_image, current_file)
 
         # Calculate remaining images in the background
-        for i in self.update_order:
-            if self.stop:
+        for i in update_order:
+            if self.stop or self.requested_settings is not None:
                 break
-            elif i is not self.current_file:
-                blur_number = self.calibration.confirmed_blur_radius
-                blurred_image = self.calibration.blurred_images[i][blur_number]
-                brightness_map = self.calibration.brightness_maps[i][blur_number]
-                width, height = blurred_image.size
-
-                image_array = numpy.array(blurred_image.convert("HSV"))
-                normalized_image_array = self.calibration.normalize_image(
-                    image_array,
-                    brightness_map,
-                    width, height,
-                    self.calibration.confirmed_noise_filter)
-                normalized_image = Image.fromarray(normalized_image_array.astype("uint8"), "HSV").convert("RGB")
-                self.calibration.processed_files[i] = normalized_image
-
-                # Update image if current image is the currently-viewed image (if user changes picture mid-thread)
-                if i == self.calibration.current_viewed_picture:
-                    self.parent.draw_results_image(i)
+
+            self.update_image(i, blur_radius, noise_cutoff)
+
+            # Update image if current image is the currently-viewed image (if user changes picture mid-thread)
+            if i == self.calibration.current_viewed_picture:
+                self.calibration.call_in_gui(self.parent.draw_results_image, i)
+
+    def update_image(self, image_number, blur_radius, noise_cutoff):
+        """
+        Re-normalizes a single calibration image with the given blur radius and noise cutoff
+        :param image_number: Index of the calibration image
+        :param blur_radius: Blur radius
+        :param noise_cutoff: Noise cutoff
+        :return: None
+        """
+
+        processed_image = self.calibration.calibration_result.process_image(image_number, blur_radius, noise_cutoff)
+        self.calibration.processed_files[image_number] = Image.fromarray(processed_image)
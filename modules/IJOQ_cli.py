@@ -0,0 +1,300 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from os import cpu_count
+import sys
+from time import perf_counter
+from PIL import Image
+import modules.IJOQ_engine as Engine
+
+def create_executor(workers):
+    """
+    Creates the executor used to spread work across worker processes
+    :param workers: Number of worker processes
+    :return: ProcessPoolExecutor, or a context with no executor if only 1 worker is used (work is run in this process)
+    """
+
+    return ProcessPoolExecutor(max_workers=workers) if workers > 1 else nullcontext()
+
+def error_message(error):
+    """
+    :param error: Exception raised for an image
+    :return: Name of the exception type, followed by its message
+    """
+
+    return f"{type(error).__name__}: {error}" if str(error) else type(error).__name__
+
+def analyze_file(file, frame, settings, dense, keep_image, cache=None, executor=None):
+    """
+    Analyzes a single image, unless its result is cached. Runs inside a worker process, unless the image is analyzed
+    in tiles
+    :param file: Path to the image file
+    :param frame: Number of the frame to analyze (see Engine.analyze_frame), or None to analyze the image as a whole
+    :param settings: Settings obtained from calibration
+    :param dense: If True, also calculate the dense IJOQ
+    :param keep_image: If False, the processed image is dropped so that it is not sent back to the main process
+    :param cache: Optional ResultCache. Only looked up here. New results are added by the main process
+    :param executor: Optional executor that the tiles of the image are spread across (see Engine.analyze_tiled_image)
+    :return: Tuple of the AnalysisResult, the message of the error raised while analyzing the image (one of them is
+        None), the cache key under which the result should be cached (None if it was already cached), the stage times of
+        the analysis (see Engine.StageTimer), and the total time spent on the image
+    """
+
+    start = perf_counter()
+    timer = Engine.StageTimer()
+    try:
+        with timer.stage("cache lookup"):
+            result, key = cache.lookup(file, settings, dense, frame) if cache is not None else (None, None)
+        if result is None and frame is not None:
+            result = Engine.analyze_frame(file, frame, settings, dense, executor=executor, keep_image=keep_image,
+                                          timer=timer)
+        elif result is None:
+            result = Engine.analyze_image(file, settings, dense, executor=executor, keep_image=keep_image, timer=timer)
+    # Any error (such as an unreadable image, an image above Pillow's size limit or a missing frame) only skips the
+    # image. The message is sent back instead of the error, which may not be picklable
+    except Exception as error:
+        return None, error_message(error), None, timer.stage_times, perf_counter() - start
+
+    if not keep_image:
+        result.processed_image = None
+
+    return result, None, key, timer.stage_times, perf_counter() - start
+
+def analyze(arguments, image_types, version):
+    """
+    Runs the IJOQ analysis on a batch of images and saves the results to an Analysis_Output folder
+    :param arguments: Parsed command-line arguments
+    :param image_types: Tuple of accepted file extensions
+    :param version: Current IJOQ version, used in the results file name
+    :return: Exit code
+    """
+
+    settings = Engine.Settings.read(arguments.settings)
+    files = Engine.find_images(arguments.inputs, image_types)
+    if not files:
+        print("No images found!", file=sys.stderr)
+        return 1
+
+    cache = None
+    if arguments.cache:
+        cache = Engine.ResultCache(arguments.cache, arguments.cache_size * 1024 ** 2, arguments.save_images)
+
+    # When analyzing by frame, every frame of a multi-page image is a separate job
+    errors = []
+    if arguments.frames:
+        sources = []
+        for file in files:
+            try:
+                sources += [(file, frame) for frame in range(1, Engine.frame_count(file) + 1)]
+            except Exception as error:
+                print(f"WARNING! Unable to analyze {Engine.source_name(file)}: {error_message(error)}", file=sys.stderr)
+                errors.append((file, None, error_message(error)))
+    else:
+        sources = [(file, None) for file in files]
+
+    # Images analyzed in tiles are analyzed one at a time, with their tiles spread across the worker processes
+    tiled = settings.tile_size > 0
+    workers = arguments.workers if tiled else min(arguments.workers, len(sources))
+    if arguments.frames:
+        print(f"Analyzing {len(sources)} frames of {len(files)} images with {workers} worker process(es)...")
+    else:
+        print(f"Analyzing {len(files)} images with {workers} worker process(es)...")
+    save_path = Engine.create_output_folder(arguments.output, "Analysis_Output")
+
+    # Each result is saved as soon as it comes in, and at most a few results per worker are held in memory
+    timer = Engine.StageTimer(workers)
+    jobs = ((file, frame, settings, arguments.dense, arguments.save_images, cache) for file, frame in sources)
+    with create_executor(workers) as executor, \
+            Engine.ResultWriter(save_path, version, arguments.dense, arguments.save_images, arguments.frames,
+                                arguments.frames and arguments.stack_summary) as result_writer:
+        if tiled:
+            outputs = (analyze_file(*job, executor) for job in jobs)
+        else:
+            outputs = Engine.map_jobs(analyze_file, jobs, executor, 4 * workers)
+        for (file, frame), (result, error, key, stage_times, seconds) in zip(sources, outputs):
+            timer.add_times(stage_times)
+            if error is not None:
+                label = Engine.source_name(file) if frame is None else f"{Engine.source_name(file)} (frame {frame})"
+                print(f"WARNING! Unable to analyze {label}: {error}", file=sys.stderr)
+                errors.append((file, frame, error))
+                continue
+
+            if cache is not None:
+                cache.put(key, result)
+
+            if result.dense_IJOQ is None:
+                print(f"{Engine.result_label(result)} has an IJOQ value of {result.IJOQ}.")
+            else:
+                print(f"{Engine.result_label(result)} has an IJOQ value of {result.IJOQ} "
+                      f"(dense IJOQ: {result.dense_IJOQ}).")
+
+            label = Engine.result_label(result)
+            with timer.stage("save"):
+                result_writer.write(result)
+            timer.add_image(label, seconds)
+
+    # The stage timings, and the images that could not be analyzed, are saved next to the results
+    timer.stop()
+    timer.write(save_path + "IJOQ Timings " + version + ".json")
+    print(timer.summary())
+    if errors:
+        Engine.write_errors(save_path + "IJOQ Errors " + version + ".csv", errors)
+        print(f"WARNING! {len(errors)} image(s) could not be analyzed (see IJOQ Errors {version}.csv).",
+              file=sys.stderr)
+    print(f"The analysis results have been saved to {save_path}")
+
+    return 0 if not errors else 1
+
+def calibrate(arguments, image_types, version):
+    """
+    Runs the calibration on a set of negative control images and saves the settings to a Settings_Output folder
+    :param arguments: Parsed command-line arguments
+    :param image_types: Tuple of accepted file extensions
+    :param version: Current IJOQ version, used in the settings file name
+    :return: Exit code
+    """
+
+    files = Engine.find_images(arguments.inputs, image_types)
+    if not files:
+        print("No images found!", file=sys.stderr)
+        return 1
+    if len(files) < 3:
+        print("WARNING! At least 3 negative control images are recommended for calibration.", file=sys.stderr)
+
+    # Basic settings are estimated from the cell counts. Otherwise, the advanced settings are used as they are
+    if arguments.cells:
+        options = Engine.CalibrationOptions.basic(arguments.cells[0], arguments.cells[1], arguments.channel)
+    else:
+        options = Engine.CalibrationOptions.advanced(Engine.Settings(
+            compressed_image_size=arguments.compression,
+            channel=Engine.CHANNEL_OPTIONS[arguments.channel],
+            blur_radius=arguments.blur_radius,
+            section_size=arguments.sections,
+            pixels_sampled=arguments.pixels,
+            noise_cutoff=arguments.noise_cutoff,
+            lines=arguments.lines))
+    options.settings.fast_ingest = int(not arguments.exact_ingest)
+    options.settings.fast_blur = int(arguments.fast_blur)
+    options.settings.tile_size = arguments.tile_size
+    options.settings.bit_depth = arguments.bit_depth
+
+    print(f"Calibrating with {len(files)} images and {arguments.workers} worker process(es)...")
+    timer = Engine.StageTimer(arguments.workers)
+    try:
+        with create_executor(arguments.workers) as executor:
+            result = Engine.calibrate(files, options, executor=executor, timer=timer)
+    except Exception as error:
+        print(f"WARNING! Unable to calibrate: {error_message(error)}", file=sys.stderr)
+        return 1
+
+    timer.stop()
+
+    save_path = Engine.create_output_folder(arguments.output, "Settings_Output")
+    result.settings.write(save_path + "Settings " + version + ".txt")
+    timer.write(save_path + "Calibration Timings " + version + ".json")
+    if arguments.save_images:
+        for name, image_array in zip(result.names, result.processed_images):
+            Image.fromarray(image_array).save(save_path + Engine.processed_image_name(name))
+
+    print(result.settings.to_text())
+    print(timer.summary())
+    print(f"The settings have been saved to {save_path}")
+
+    return 0
+
+def worker_count(value):
+    """
+    Parses the number of worker processes
+    :param value: Command-line value
+    :return: Number of worker processes (at least 1)
+    """
+
+    workers = int(value)
+    if workers < 1:
+        raise argparse.ArgumentTypeError("must be at least 1")
+
+    return workers
+
+def main(argv, image_types, version):
+    """
+    Runs IJOQ from the command line
+    :param argv: Command-line arguments, excluding the program name
+    :param image_types: Tuple of accepted file extensions
+    :param version: Current IJOQ version
+    :return: Exit code
+    """
+
+    parser = argparse.ArgumentParser(prog="IJOQ.py", description=f"IJOQ {version}. Run without arguments to open the GUI.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    analyze_parser = commands.add_parser("analyze", help="run the IJOQ analysis on a batch of images")
+    analyze_parser.add_argument("settings", help="settings file saved by the calibration")
+    analyze_parser.add_argument("inputs", nargs="+",
+                                help="image files, folders, or glob patterns. Folders containing \"Output\" are skipped")
+    analyze_parser.add_argument("-o", "--output", default=".",
+                                help="folder in which the Analysis_Output folder is created (default: current folder)")
+    analyze_parser.add_argument("-w", "--workers", type=worker_count, default=cpu_count() or 1,
+                                help="number of worker processes (default: number of CPU cores)")
+    analyze_parser.add_argument("--dense", action="store_true",
+                                help="also calculate the dense IJOQ using every row and column")
+    analyze_parser.add_argument("--save-images", action="store_true", help="save the processed images")
+    analyze_parser.add_argument("--frames", action="store_true",
+                                help="analyze every frame (page) of multi-page TIFF images, such as z-stacks and "
+                                     "time-lapses, instead of only the first. Adds a frame column to the results")
+    analyze_parser.add_argument("--stack-summary", action="store_true",
+                                help="with --frames, also save the mean, minimum and maximum IJOQ of each image")
+    analyze_parser.add_argument("--cache", metavar="FOLDER",
+                                help="reuse the results of images analyzed before with the same settings, and cache new "
+                                     "results in this folder")
+    analyze_parser.add_argument("--cache-size", type=int, default=Engine.RESULT_CACHE_SIZE // 1024 ** 2, metavar="MB",
+                                help="maximum size of the cache folder. The least recently used results are removed "
+                                     "first (default: %(default)s)")
+
+    defaults = Engine.Settings()
+    calibrate_parser = commands.add_parser(
+        "calibrate", help="calibrate the analysis settings using negative control images",
+        description="Uses the basic settings if --cells is given. Otherwise, the advanced settings are used.")
+    calibrate_parser.add_argument("inputs", nargs="+",
+                                  help="image files, folders, or glob patterns. Folders containing \"Output\" are "
+                                       "skipped")
+    calibrate_parser.add_argument("-o", "--output", default=".",
+                                  help="folder in which the Settings_Output folder is created (default: current folder)")
+    calibrate_parser.add_argument("-w", "--workers", type=worker_count, default=cpu_count() or 1,
+                                  help="number of worker processes (default: number of CPU cores)")
+    calibrate_parser.add_argument("--save-images", action="store_true", help="save the processed images")
+    calibrate_parser.add_argument("--exact-ingest", action="store_true",
+                                  help="resize the full-resolution images instead of downscaling them while decoding. "
+                                       "Saved in the settings, so the analysis uses the same image loading")
+    calibrate_parser.add_argument("--fast-blur", action="store_true",
+                                  help="approximate blur radii above 1 with a cascade of box blurs (see README). "
+                                       "Saved in the settings, so the analysis uses the same blur")
+    calibrate_parser.add_argument("--tile-size", type=int, default=0, metavar="PIXELS",
+                                  help="analyze images at full resolution in tiles of this size instead of compressing "
+                                       "them (see README). The calibration images are used at full resolution too")
+    calibrate_parser.add_argument("--bit-depth", type=int, choices=range(8, 17), default=8, metavar="BITS",
+                                  help="brightness resolution of the analysis, from 8 to 16 bits. Above 8, the values "
+                                       "of 16-bit grayscale images are used without reducing them to 8 bits (see "
+                                       "README). Saved in the settings (default: %(default)s)")
+    calibrate_parser.add_argument("--channel", choices=tuple(Engine.CHANNEL_OPTIONS), default="Red",
+                                  help="channel to analyze (default: Red)")
+    calibrate_parser.add_argument("--cells", nargs=2, type=int, metavar=("X", "Y"),
+                                  help="basic settings: estimated number of cells along the image width and height")
+    calibrate_parser.add_argument("--compression", type=int, default=defaults.compressed_image_size,
+                                  help="advanced settings: image compression size")
+    calibrate_parser.add_argument("--blur-radius", type=int, choices=Engine.BLUR_RADIUS_VALUES,
+                                  default=defaults.blur_radius, help="advanced settings: blur radius")
+    calibrate_parser.add_argument("--sections", type=int, default=defaults.section_size,
+                                  help="advanced settings: number of sections along each image axis")
+    calibrate_parser.add_argument("--pixels", type=int, default=defaults.pixels_sampled,
+                                  help="advanced settings: number of pixels sampled along each section axis")
+    calibrate_parser.add_argument("--noise-cutoff", type=float, default=defaults.noise_cutoff,
+                                  help="advanced settings: noise filter")
+    calibrate_parser.add_argument("--lines", type=int, default=defaults.lines,
+                                  help="advanced settings: number of lines")
+
+    arguments = parser.parse_args(argv)
+
+    if arguments.command == "analyze":
+        return analyze(arguments, image_types, version)
+    elif arguments.command == "calibrate":
+        return calibrate(arguments, image_types, version)
@@ -0,0 +1,2402 @@
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+import csv
+from dataclasses import dataclass, fields, replace
+from functools import lru_cache
+from glob import glob
+import hashlib
+import json
+from math import ceil, floor, sqrt
+from os import cpu_count, path, makedirs, mkdir, remove, replace as replace_file, scandir, stat, utime, walk
+from threading import Condition, RLock
+from time import perf_counter
+from PIL import Image, ImageFilter
+import numpy
+
+# Maps the channel names shown in the GUI to the index of the RGB channel that is analyzed
+CHANNEL_OPTIONS = {"Red": 0, "Green": 1, "Blue": 2, "White": 1}
+
+# Blur radii that are tried during calibration
+BLUR_RADIUS_VALUES = (0, 1, 2, 3, 4, 5)
+
+# Number of box blurs that each step of the fast blur cascade is split into (see blur_image). A single box blur per step
+# moves too many pixels across the threshold at blur radii 2 and 3
+FAST_BLUR_PASSES = 2
+
+# When loading images with fast ingest, JPEG draft decoding and integer-factor reduction shrink an image to no less than
+# this many times the compressed size before the final resample
+INGEST_REDUCING_GAP = 3.0
+
+# Single-channel image modes that hold more than 8 bits per pixel. Their pixel values are used as they are when
+# analyzing at a bit depth above 8
+HIGH_BIT_DEPTH_MODES = ("I;16", "I;16L", "I;16B", "I;16N", "I", "F")
+
+# Values of settings that are missing from settings files written before the settings were added. These reproduce
+# how those files were calibrated. Settings not listed here use the defaults of Settings
+LEGACY_SETTINGS = {"fast_ingest": 0}
+
+# Version of the analysis engine. Increase whenever a change alters the analysis results, so that results cached by
+# earlier versions are not reused (see ResultCache)
+ENGINE_VERSION = 2
+
+# Default maximum size (in bytes) of a result cache folder
+RESULT_CACHE_SIZE = 256 * 1024 ** 2
+
+# Largest width or height (in pixels) of the processed image returned by the tiled analysis. Larger images are shrunk by
+# a whole factor (see reduce_tile), so the processed image of a whole-slide image fits in memory
+TILED_IMAGE_SIZE = 4096
+
+# Held while Pillow's decompression bomb limit is lifted for the tiled analysis (see unlimited_image_size)
+IMAGE_SIZE_LIMIT_LOCK = RLock()
+
+# Number of threshold key planes (see threshold_keys) and rendered calibration images kept when reviewing a calibration
+KEY_PLANE_CACHE_SIZE = 12
+RENDERED_IMAGE_CACHE_SIZE = 32
+
+@dataclass
+class Settings:
+    """
+    Settings used for IJOQ analysis. Field names match the keys of the settings file written by calibration
+    """
+
+    compressed_image_size: int = 512
+    channel: int = 0
+    blur_radius: int = 4
+    section_size: int = 4
+    pixels_sampled: int = 8
+    normalization_cutoff: int = 0
+    noise_cutoff: float = 0.1
+    lines: int = 10
+    fast_ingest: int = 1  # If 1, images are downscaled while decoding (see load_image). If 0, the full image is resized
+    fast_blur: int = 0  # If 1, blur levels are approximated by a cascade of box blurs (see blur_image)
+    tile_size: int = 0  # If above 0, images are not compressed and are analyzed in tiles (see analyze_tiled_image)
+    bit_depth: int = 8  # Brightness resolution of the analysis, from 8 to 16 bits (see load_image)
+
+    def to_text(self):
+        """
+        Formats the settings in the settings file format
+        :return: String containing one "key = value" line per setting
+        """
+
+        return "\n".join(f"{field.name} = {getattr(self, field.name)}" for field in fields(self))
+
+    def write(self, file_path):
+        """
+        Writes the settings to a settings file
+        :param file_path: Path of the settings file
+        :return: None
+        """
+
+        with open(file_path, mode="w") as settings_file:
+            settings_file.write(self.to_text())
+
+    @classmethod
+    def from_text(cls, text):
+        """
+        Parses settings in the settings file format. Unknown keys are ignored. Missing keys listed in LEGACY_SETTINGS
+        take their legacy value, so that settings files from earlier versions are analyzed the way they were calibrated
+        :param text: String containing one "key = value" line per setting
+        :return: Settings
+        """
+
+        field_types = {field.name: field.type for field in fields(cls)}
+        values = dict(LEGACY_SETTINGS)
+        for setting in text.splitlines():
+            if "=" in setting:
+                key, value = (part.strip() for part in setting.split("=", 1))
+                if key in field_types:
+                    values[key] = float(value) if field_types[key] in (float, "float") else int(value)
+
+        return cls(**values)
+
+    @classmethod
+    def read(cls, file_path):
+        """
+        Reads a settings file written by calibration. Unknown keys are ignored
+        :param file_path: Path of the settings file
+        :return: Settings
+        """
+
+        with open(file_path, mode="r") as settings_file:
+            return cls.from_text(settings_file.read())
+
+@dataclass
+class CalibrationOptions:
+    """
+    Inputs of a calibration. The normalization cutoff of the settings is determined by the calibration
+    """
+
+    settings: Settings
+    cell_count: float = 0  # Average number of cells along an image axis. If above 0, the blur radius is estimated
+    estimate_noise: bool = False  # Estimate the noise cutoff instead of using the one in the settings
+
+    @classmethod
+    def basic(cls, cell_number_x, cell_number_y, channel_name):
+        """
+        Estimates the calibration inputs from the number of cells along the image width and height
+        :param cell_number_x: Estimated number of cells along the image width
+        :param cell_number_y: Estimated number of cells along the image height
+        :param channel_name: "Red", "Green", "Blue" or "White"
+        :return: CalibrationOptions
+        """
+
+        average_cell_count = (cell_number_x + cell_number_y) / 2
+        if average_cell_count > 50:
+            compressed_image_size = 1024
+            section_size = 6
+        else:
+            compressed_image_size = 512
+            section_size = 4
+
+        settings = Settings(
+            compressed_image_size=compressed_image_size,
+            channel=CHANNEL_OPTIONS[channel_name],
+            blur_radius=0,
+            section_size=section_size,
+            pixels_sampled=8,
+            normalization_cutoff=0,
+            noise_cutoff=0,
+            lines=max(10, int(round(average_cell_count, -1))))
+
+        return cls(settings, cell_count=average_cell_count, estimate_noise=True)
+
+    @classmethod
+    def advanced(cls, settings):
+        """
+        Uses the given settings as they are
+        :param settings: Settings (the normalization cutoff is ignored)
+        :return: CalibrationOptions
+        """
+
+        return cls(settings)
+
+@lru_cache(maxsize=16)
+def interpolation_weights(width, height, section_count):
+    """
+    Calculates (and caches) the interpolation weights used to turn a grid of section thresholds into a brightness map.
+    Mirrors the rounding and border-copy behaviour of the original per-pixel threshold calculation
+    :param width: Width (in pixels) of the image
+    :param height: Height (in pixels) of the image
+    :param section_count: The number of sections that the image is split into along a single axis
+    :return: Tuple of (left sections, right sections, x weights, top sections, bottom sections, y weights)
+    """
+
+    def axis_weights(length):
+        section_length = length / section_count
+
+        lower_sections = numpy.zeros(length, dtype=numpy.intp)
+        upper_sections = numpy.zeros(length, dtype=numpy.intp)
+        percents = numpy.zeros(length)
+        for i in range(length):
+            # Calculate a pixel's upper left section, as well as its relative position to the next section
+            percents[i] = round(((i - section_length / 2) % section_length) / section_length, 2)
+            lower_section = floor((i / section_length) - 0.5)
+            upper_section = lower_section + 1
+
+            # If pixel is less than half a grid away from the border, copy the normalization threshold value
+            if lower_section < 0:
+                lower_section = upper_section
+            elif lower_section >= section_count - 1:
+                upper_section = lower_section
+
+            lower_sections[i] = lower_section
+            upper_sections[i] = upper_section
+
+        for array in (lower_sections, upper_sections, percents):
+            array.flags.writeable = False
+
+        return lower_sections, upper_sections, percents
+
+    return axis_weights(width) + axis_weights(height)
+
+def calculate_brightness_map(threshold_array, width, height, box=None):
+    """
+    Calculates the threshold value for every pixel by bilinear interpolation between the section thresholds
+    :param threshold_array: A 2D array containing the calculated thresholds for each section (indexed [x][y])
+    :param width: Width (in pixels) of the image
+    :param height: Height (in pixels) of the image
+    :param box: Optional (left, top, right, bottom) part of the image to calculate the brightness map of. Gives the same
+        values as the same part of the whole brightness map
+    :return: 2D array (height x width, or the height x width of the box) containing the brightness (out of 255) of the
+        threshold for each pixel
+    """
+
+    threshold_array = numpy.asarray(threshold_array, dtype=numpy.float64)
+    left, right, x_percent, top, bottom, y_percent = interpolation_weights(width, height, len(threshold_array))
+    if box is not None:
+        x_part, y_part = slice(box[0], box[2]), slice(box[1], box[3])
+        left, right, x_percent = left[x_part], right[x_part], x_percent[x_part]
+        top, bottom, y_percent = top[y_part], bottom[y_part], y_percent[y_part]
+
+    # Interpolate along x once per row of sections, then interpolate between those rows along y
+    section_rows = threshold_array.T
+    row_thresholds = ((1 - x_percent) * section_rows[:, left]) + (x_percent * section_rows[:, right])
+
+    y_percent = y_percent[:, numpy.newaxis]
+    brightness_map = ((1 - y_percent) * row_thresholds[top]) + (y_percent * row_thresholds[bottom])
+
+    return numpy.rint(brightness_map, out=brightness_map)
+
+@lru_cache(maxsize=16)
+def section_labels(width, height, section_count, bins=256):
+    """
+    Labels every pixel with the histogram offset of the section it belongs to, so that all section histograms can be
+    taken with a single bincount
+    :param width: Width (in pixels) of the image
+    :param height: Height (in pixels) of the image
+    :param section_count: The number of sections that the image is split into along a single axis
+    :param bins: Number of histogram bins per section
+    :return: 2D array (height x width) containing (section index * bins) for each pixel
+    """
+
+    def axis_sections(length):
+        section_length = length / section_count
+
+        sections = numpy.zeros(length, dtype=numpy.intp)
+        for section in range(section_count):
+            sections[round(section * section_length):round((section + 1) * section_length)] = section
+
+        return sections
+
+    labels = (axis_sections(width)[numpy.newaxis, :] * section_count + axis_sections(height)[:, numpy.newaxis]) * bins
+    labels.flags.writeable = False
+
+    return labels
+
+def section_histograms(brightness_values, section_count, bins=256):
+    """
+    Takes a brightness histogram of each section of an image
+    :param brightness_values: 2D array containing the brightness values of the pixels
+    :param section_count: The number of sections that the image is split into along a single axis
+    :param bins: Number of histogram bins per section
+    :return: 2D array (section_count ** 2 x bins) containing one histogram per section
+    """
+
+    height, width = brightness_values.shape
+    labels = section_labels(width, height, section_count, bins)
+
+    histograms = numpy.bincount((labels + brightness_values).ravel(), minlength=(section_count ** 2) * bins)
+
+    return histograms.reshape(section_count ** 2, bins)
+
+def otsu_thresholds(histograms):
+    """
+    Uses Otsu's Method to determine the threshold of one or more histograms. Every candidate threshold is scored from
+    cumulative sums, so the cost is linear in the number of bins
+    :param histograms: 2D array containing one histogram per row
+    :return: 1D array containing the threshold for each histogram (0 if no threshold splits the histogram in two)
+    """
+
+    histograms = numpy.asarray(histograms, dtype=numpy.int64)
+    bin_values = numpy.arange(histograms.shape[1], dtype=numpy.int64)
+
+    # Pixel count and brightness sum of the pixels below each candidate threshold (class zero), and above it (class one)
+    prob_zero = numpy.cumsum(histograms, axis=1) - histograms
+    prob_one = histograms.sum(axis=1, keepdims=True) - prob_zero
+    sum_zero = numpy.cumsum(histograms * bin_values, axis=1) - histograms * bin_values
+    sum_one = (histograms * bin_values).sum(axis=1, keepdims=True) - sum_zero
+
+    # Must have at least 1 pixel in both classes
+    valid = (prob_zero > 0) & (prob_one > 0)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        mean_zero = sum_zero / prob_zero
+        mean_one = sum_one / prob_one
+        variance = prob_zero * prob_one * ((mean_zero - mean_one) ** 2)
+    variance[~valid] = -1
+
+    # Ties go to the highest threshold
+    last_maximum = (histograms.shape[1] - 1) - numpy.argmax(variance[:, ::-1], axis=1)
+
+    return numpy.where(valid.any(axis=1), last_maximum, 0)
+
+def count_pixels_above(histograms, thresholds):
+    """
+    Counts the pixels that are brighter than the threshold of their section
+    :param histograms: 2D array containing one histogram per section
+    :param thresholds: 1D array containing the threshold of each section
+    :return: Total number of pixels above their section's threshold
+    """
+
+    cumulative_histograms = numpy.cumsum(histograms, axis=1)
+    pixels_at_or_below = cumulative_histograms[numpy.arange(len(thresholds)), thresholds]
+
+    return int((cumulative_histograms[:, -1] - pixels_at_or_below).sum())
+
+def extract_channel(image, channel):
+    """
+    Extracts a single color channel from an image
+    :param image: Image object
+    :param channel: Index of the channel to extract (0 = red, 1 = green, 2 = blue)
+    :return: Single-band (L) image containing the channel
+    """
+
+    if image.mode == "L":
+        return image
+    elif image.mode in ("RGB", "RGBA", "RGBX"):
+        # Same as converting to RGB first, without copying the other channels
+        return image.getchannel(channel)
+
+    return image.convert("RGB").getchannel(channel)
+
+def max_brightness(bit_depth):
+    """
+    :param bit_depth: Bit depth of the analysis
+    :return: Highest brightness value at the bit depth (255 for 8 bits)
+    """
+
+    return 2 ** bit_depth - 1
+
+def section_sample_coordinates(width, height, section_count, pixel_number):
+    """
+    Determines the pixels sampled by sample_section_thresholds: an evenly spaced grid of pixels in each section
+    :param width: Width (in pixels) of the image
+    :param height: Height (in pixels) of the image
+    :param section_count: The number of sections that the image is split into along a single axis
+    :param pixel_number: The number of pixels sampled along a single axis of each section
+    :return: Tuple of (x coordinates, y coordinates), each a 2D array indexed [section][sample]
+    """
+
+    section_width = width / section_count
+    section_height = height / section_count
+
+    pixel_x = [[round(section_width * (section_x + ((x + 0.5) / pixel_number))) for x in range(pixel_number)]
+               for section_x in range(section_count)]
+    pixel_y = [[round(section_height * (section_y + ((y + 0.5) / pixel_number))) for y in range(pixel_number)]
+               for section_y in range(section_count)]
+
+    return numpy.array(pixel_x), numpy.array(pixel_y)
+
+def rank_section_samples(sampled_values, normal_threshold):
+    """
+    Takes the normalization threshold of each section from its sampled pixels
+    :param sampled_values: 4D array of sampled brightness values, indexed [section_x][section_y][sample_x][sample_y]
+    :param normal_threshold: Rank (starting from 1) of the sampled pixel that is used as the section's threshold
+    :return: 2D array (indexed [section_x][section_y]) containing the normalization threshold of each section
+    """
+
+    section_count, pixel_number = sampled_values.shape[1], sampled_values.shape[3]
+    sampled_values = sampled_values.reshape(section_count, section_count, pixel_number ** 2)
+    sampled_values = numpy.sort(sampled_values, axis=2)
+
+    return sampled_values[:, :, normal_threshold - 1].astype(numpy.float64)
+
+def sample_section_thresholds(brightness_values, section_count, pixel_number, normal_threshold):
+    """
+    Samples an evenly spaced grid of pixels in each section and takes the normalization threshold of each section
+    :param brightness_values: 2D array containing the brightness values of the pixels in a pre-blurred image
+    :param section_count: The number of sections that the image is split into along a single axis
+    :param pixel_number: The number of pixels sampled along a single axis of each section
+    :param normal_threshold: Rank (starting from 1) of the sampled pixel that is used as the section's threshold
+    :return: 2D array (indexed [section_x][section_y]) containing the normalization threshold of each section
+    """
+
+    height, width = brightness_values.shape
+    pixel_x, pixel_y = section_sample_coordinates(width, height, section_count, pixel_number)
+    pixel_x = pixel_x[:, numpy.newaxis, :, numpy.newaxis]
+    pixel_y = pixel_y[numpy.newaxis, :, numpy.newaxis, :]
+
+    return rank_section_samples(brightness_values[pixel_y, pixel_x], normal_threshold)
+
+def normalize_image(brightness_values, brightness_map, noise_threshold, output=None, bit_depth=8):
+    """
+    Passes an image through a threshold to produce the final processed image
+    :param brightness_values: 2D array containing the brightness values of the pixels in a pre-blurred image
+    :param brightness_map: 2D array containing all pixel threshold values
+    :param noise_threshold: Arbitrary value added on top of the brightness threshold value to account for noise
+    :param output: Optional preallocated 2D uint8 array that the processed image is written into
+    :param bit_depth: Bit depth of the brightness values. The lowest threshold (20 out of 255) is scaled to match
+    :return: 2D uint8 array where pixels above the threshold are 255 and all other pixels are 0
+    """
+
+    if output is None:
+        output = numpy.empty(brightness_map.shape, dtype=numpy.uint8)
+
+    threshold = brightness_map * (1 + noise_threshold)
+    numpy.maximum(threshold, 20 * max_brightness(bit_depth) / 255, out=threshold)
+
+    numpy.greater(brightness_values, threshold, out=output)
+    numpy.multiply(output, 255, out=output)
+
+    return output
+
+def threshold_keys(brightness_values, brightness_map):
+    """
+    Combines the brightness of every pixel with its (integer) brightness map value into a single key, so that an image
+    can be re-normalized with any noise threshold using a lookup table (see threshold_table)
+    :param brightness_values: 2D uint8 array containing the brightness values of the pixels in a pre-blurred image
+    :param brightness_map: 2D array containing all pixel threshold values (whole numbers from 0 to 255)
+    :return: 2D uint16 array containing brightness_map * 256 + brightness_values
+    """
+
+    keys = brightness_map.astype(numpy.uint16)
+    numpy.left_shift(keys, 8, out=keys)
+    numpy.bitwise_or(keys, brightness_values, out=keys)
+
+    return keys
+
+@lru_cache(maxsize=64)
+def threshold_table(noise_threshold):
+    """
+    Calculates (and caches) the result of normalize_image for every combination of brightness map value and pixel
+    brightness
+    :param noise_threshold: Arbitrary value added on top of the brightness threshold value to account for noise
+    :return: Read-only uint8 array of 65536 entries (255 or 0), indexed by threshold key (see threshold_keys)
+    """
+
+    brightness_map_values = numpy.repeat(numpy.arange(256, dtype=numpy.float64), 256).reshape(256, 256)
+    brightness_values = numpy.tile(numpy.arange(256, dtype=numpy.uint8), (256, 1))
+    table = normalize_image(brightness_values, brightness_map_values, noise_threshold).reshape(-1)
+    table.flags.writeable = False
+
+    return table
+
+def count_crossings(normalized_image_array, rows=None, columns=None):
+    """
+    Counts the junction crossings (changes from black to white or white to black) along horizontal and vertical lines
+    :param normalized_image_array: 2D array containing the thresholded image
+    :param rows: Indices of the rows to scan (all rows if None)
+    :param columns: Indices of the columns to scan (all columns if None)
+    :return: Tuple of (crossings along the rows, crossings along the columns)
+    """
+
+    horizontal_lines = normalized_image_array if rows is None else normalized_image_array[rows, :]
+    vertical_lines = normalized_image_array if columns is None else normalized_image_array[:, columns]
+
+    horizontal_crossings = numpy.count_nonzero(horizontal_lines[:, 1:] != horizontal_lines[:, :-1])
+    vertical_crossings = numpy.count_nonzero(vertical_lines[1:, :] != vertical_lines[:-1, :])
+
+    return int(horizontal_crossings), int(vertical_crossings)
+
+def IJOQ_lines(width, height, line_number):
+    """
+    Determines the positions of the evenly spaced lines used to calculate the IJOQ value
+    :param width: Width (in pixels) of the image
+    :param height: Height (in pixels) of the image
+    :param line_number: Number of lines drawn along each axis
+    :return: Tuple of (indices of the horizontal lines, indices of the vertical lines)
+    """
+
+    rows = [round((y + 0.5) * height / line_number) for y in range(line_number)]
+    columns = [round((x + 0.5) * width / line_number) for x in range(line_number)]
+
+    return rows, columns
+
+def junction_frequency(horizontal_crossings, vertical_crossings, width, height, line_count):
+    """
+    Turns the junction crossings counted along a set of lines into an IJOQ value
+    :param horizontal_crossings: Crossings counted along the horizontal lines
+    :param vertical_crossings: Crossings counted along the vertical lines
+    :param width: Width (in pixels) of the image
+    :param height: Height (in pixels) of the image
+    :param line_count: Total number of lines along both axes
+    :return: IJOQ value (rounded to 4 decimal places)
+    """
+
+    # Each crossing is half of a junction. Take average of all lines
+    cell_border_frequency = (horizontal_crossings * 0.5 / width) + (vertical_crossings * 0.5 / height)
+
+    return round(cell_border_frequency / line_count, 4)
+
+def calculate_IJOQ(normalized_image_array, line_number):
+    """
+    Calculates the IJOQ value of a thresholded image by drawing evenly spaced horizontal and vertical lines across it
+    :param normalized_image_array: 2D array containing the thresholded image
+    :param line_number: Number of lines drawn along each axis
+    :return: IJOQ value (rounded to 4 decimal places)
+    """
+
+    height, width = normalized_image_array.shape
+    rows, columns = IJOQ_lines(width, height, line_number)
+    horizontal_crossings, vertical_crossings = count_crossings(normalized_image_array, rows, columns)
+
+    return junction_frequency(horizontal_crossings, vertical_crossings, width, height, 2 * line_number)
+
+def calculate_dense_IJOQ(normalized_image_array):
+    """
+    Calculates the IJOQ value of a thresholded image using every row and every column as a line
+    :param normalized_image_array: 2D array containing the thresholded image
+    :return: IJOQ value (rounded to 4 decimal places)
+    """
+
+    height, width = normalized_image_array.shape
+    horizontal_crossings, vertical_crossings = count_crossings(normalized_image_array)
+
+    return junction_frequency(horizontal_crossings, vertical_crossings, width, height, width + height)
+
+def source_name(source):
+    """
+    Determines the name of an image source, used in progress messages and results
+    :param source: Path to an image file, or an Image object
+    :return: File name of the source
+    """
+
+    if isinstance(source, str):
+        return path.basename(source)
+
+    return path.basename(getattr(source, "filename", "") or "") or "image"
+
+def report(progress, message=None, steps=0):
+    """
+    Sends a progress update to the progress callback, if there is one
+    :param progress: Callback taking (message, steps), or None
+    :param message: Text describing the current step, or None
+    :param steps: Number of progress steps completed since the last update
+    :return: None
+    """
+
+    if progress is not None:
+        progress(message, steps)
+
+class StageTimer:
+    """
+    Adds up how long each stage of a calibration or analysis takes (image opening, resizing, blurring, etc.), so that
+    slow stages can be found on real data sets. Stages run in worker processes are timed there and added with
+    add_times, so with several workers the stage times can add up to more than the elapsed time
+    """
+
+    def __init__(self, workers=1):
+        """
+        :param workers: Number of worker processes used, recorded in the timing report
+        """
+
+        self.workers = workers
+        self.stage_times = {}  # [total seconds, number of times run], keyed by stage in the order the stages first ran
+        self.image_count = 0
+        self.image_times = []  # (image name, seconds) of every image timed as a whole
+        self.start_time = perf_counter()
+        self.elapsed_time = None  # Set when the timer is stopped
+
+    @contextmanager
+    def stage(self, stage, count=1):
+        """
+        Times a block of code as a run of a stage
+        :param stage: Name of the stage
+        :param count: Number of runs of the stage that the block counts as (0 if it continues a run timed before)
+        :return: Context manager
+        """
+
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, perf_counter() - start, count)
+
+    def add_time(self, stage, seconds, count=1):
+        """
+        :param stage: Name of the stage
+        :param seconds: Time spent in the stage
+        :param count: Number of runs of the stage that took this time
+        :return: None
+        """
+
+        stage_time = self.stage_times.setdefault(stage, [0.0, 0])
+        stage_time[0] += seconds
+        stage_time[1] += count
+
+    def add_times(self, stage_times):
+        """
+        Adds the stage times measured by another timer, such as one run in a worker process
+        :param stage_times: StageTimer.stage_times of the other timer
+        :return: None
+        """
+
+        for stage, (seconds, count) in stage_times.items():
+            self.add_time(stage, seconds, count)
+
+    def add_image(self, name, seconds=None):
+        """
+        Counts a processed image
+        :param name: Name of the image
+        :param seconds: Total time spent on the image, or None if it was not timed as a whole
+        :return: None
+        """
+
+        self.image_count += 1
+        if seconds is not None:
+            self.image_times.append((name, seconds))
+
+    def stop(self):
+        """
+        Stops the timer. The elapsed time is measured from the creation of the timer
+        :return: None
+        """
+
+        self.elapsed_time = perf_counter() - self.start_time
+
+    def elapsed(self):
+        """
+        :return: Seconds since the timer was created, or until it was stopped
+        """
+
+        return self.elapsed_time if self.elapsed_time is not None else perf_counter() - self.start_time
+
+    def images_per_second(self):
+        """
+        :return: Number of images processed per second of elapsed time
+        """
+
+        return self.image_count / self.elapsed() if self.elapsed() > 0 else 0.0
+
+    def to_dict(self):
+        """
+        :return: Dictionary containing the timing report
+        """
+
+        return {"workers": self.workers,
+                "images": self.image_count,
+                "elapsed_seconds": round(self.elapsed(), 4),
+                "images_per_second": round(self.images_per_second(), 4),
+                "stages": {stage: {"seconds": round(seconds, 4), "count": count,
+                                   "mean_seconds": round(seconds / count, 6) if count else 0.0}
+                           for stage, (seconds, count) in self.stage_times.items()},
+                "image_seconds": [{"name": name, "seconds": round(seconds, 4)} for name, seconds in self.image_times]}
+
+    def write(self, file_path):
+        """
+        Saves the timing report to a JSON file
+        :param file_path: Path of the JSON file
+        :return: None
+        """
+
+        with open(file_path, mode="w") as timing_file:
+            json.dump(self.to_dict(), timing_file, indent=2)
+
+    def summary(self):
+        """
+        :return: One line summarizing the timing report, with the stages from slowest to fastest
+        """
+
+        total = sum(seconds for seconds, _ in self.stage_times.values())
+        stages = sorted(self.stage_times.items(), key=lambda item: item[1][0], reverse=True)
+        stage_text = ", ".join(f"{stage} {seconds:.2f} s ({100 * seconds / total:.0f}%)"
+                               for stage, (seconds, _) in stages) if total > 0 else "no stages timed"
+
+        return f"Timing: {self.image_count} images in {self.elapsed():.2f} s ({self.images_per_second():.2f} " \
+               f"images/s, {self.workers} worker process(es)). Stages: {stage_text}"
+
+def timed(timer, stage, count=1):
+    """
+    Times a block of code with a StageTimer, if there is one
+    :param timer: StageTimer, or None
+    :param stage: Name of the stage
+    :param count: Number of runs of the stage that the block counts as (see StageTimer.stage)
+    :return: Context manager
+    """
+
+    return timer.stage(stage, count) if timer is not None else nullcontext()
+
+@contextmanager
+def unlimited_image_size():
+    """
+    Lifts Pillow's decompression bomb limit (Image.MAX_IMAGE_PIXELS) within a block of code, then restores it. Pillow
+    warns about images above the limit and refuses images above twice the limit (about 179 megapixels). Used by the
+    tiled analysis, which is meant for whole-slide images of that size and reads them one region at a time
+    :return: Context manager
+    """
+
+    with IMAGE_SIZE_LIMIT_LOCK:
+        max_image_pixels = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = None
+        try:
+            yield
+        finally:
+            Image.MAX_IMAGE_PIXELS = max_image_pixels
+
+def load_image(source, compressed_image_size, channel, fast=True, bit_depth=8, timer=None):
+    """
+    Opens an image, compresses it, and extracts the analyzed channel
+    :param source: Path to an image file, or an Image object
+    :param compressed_image_size: Target size of the average of the image width and height, or 0 to keep the full
+        resolution
+    :param channel: Index of the channel to extract (0 = red, 1 = green, 2 = blue)
+    :param fast: If True, JPEG images are downscaled while decoding, the channel is extracted before resizing, and the
+        image is shrunk by an integer factor before the final bicubic resample (see INGEST_REDUCING_GAP). Pixels differ
+        from the full-resolution resize by at most a few brightness levels. If False, the full image is resized first
+    :param bit_depth: Bit depth of the returned brightness values. Above 8, single-channel images with more than 8 bits
+        per pixel (see HIGH_BIT_DEPTH_MODES) are resized without reducing them to 8 bits, and their pixel values are
+        kept, clipped to the highest value at the bit depth (e.g. 4095 for 12-bit camera images saved as 16-bit TIFF
+        files). Other images are loaded as usual, then rescaled from 8 bits to the bit depth
+    :param timer: Optional StageTimer. Decoding is timed as the "open" stage, followed by the "resize" and "channel"
+        stages
+    :return: 2D array containing the channel (uint8 for a bit depth of 8, otherwise uint16)
+    """
+
+    with timed(timer, "open"):
+        image = source if isinstance(source, Image.Image) else Image.open(source)
+    if bit_depth > 8:
+        return load_high_bit_depth_image(image, compressed_image_size, channel, fast, bit_depth, timer)
+
+    if not compressed_image_size:
+        with timed(timer, "open", 0):
+            image.load()
+        with timed(timer, "channel"):
+            return numpy.array(extract_channel(image, channel))
+
+    width, height = image.size
+    compression_amount = (compressed_image_size / 2) * (width + height) / (width * height)
+    size = (round(compression_amount * width), round(compression_amount * height))
+
+    if not fast:
+        with timed(timer, "open", 0):
+            image.load()
+        with timed(timer, "resize"):
+            image = image.resize(size)
+        with timed(timer, "channel"):
+            return numpy.array(extract_channel(image, channel))
+
+    # Only has an effect on JPEG images that have not been loaded yet
+    with timed(timer, "open", 0):
+        image.draft(image.mode, (round(size[0] * INGEST_REDUCING_GAP), round(size[1] * INGEST_REDUCING_GAP)))
+        image.load()
+    with timed(timer, "channel"):
+        image = extract_channel(image, channel)
+
+    with timed(timer, "resize"):
+        return numpy.array(image.resize(size, Image.Resampling.BICUBIC, reducing_gap=INGEST_REDUCING_GAP))
+
+def load_high_bit_depth_image(image, compressed_image_size, channel, fast, bit_depth, timer=None):
+    """
+    Loads an image at a bit depth above 8 (see load_image)
+    :param image: Image object
+    :param compressed_image_size: Target size of the average of the image width and height, or 0 to keep the full
+        resolution
+    :param channel: Index of the channel to extract
+    :param fast: If True, use the fast image loading path
+    :param bit_depth: Bit depth of the returned brightness values (9 to 16)
+    :param timer: Optional StageTimer (see load_image)
+    :return: 2D uint16 array containing the channel
+    """
+
+    if image.mode not in HIGH_BIT_DEPTH_MODES:
+        image_array = load_image(image, compressed_image_size, channel, fast, timer=timer).astype(numpy.float64)
+        image_array *= max_brightness(bit_depth) / 255
+    else:
+        # Resize as 32-bit floats, which Pillow resamples without reducing the brightness resolution
+        with timed(timer, "open", 0):
+            image.load()
+        with timed(timer, "channel"):
+            image = image.convert("F")
+        if compressed_image_size:
+            width, height = image.size
+            compression_amount = (compressed_image_size / 2) * (width + height) / (width * height)
+            size = (round(compression_amount * width), round(compression_amount * height))
+            with timed(timer, "resize"):
+                image = image.resize(size, Image.Resampling.BICUBIC,
+                                     reducing_gap=INGEST_REDUCING_GAP if fast else None)
+        image_array = numpy.array(image, dtype=numpy.float64)
+
+    # Bicubic resampling overshoots at sharp edges
+    numpy.clip(image_array, 0, max_brightness(bit_depth), out=image_array)
+
+    return numpy.rint(image_array, out=image_array).astype(numpy.uint16)
+
+def box_blur_radius(variance):
+    """
+    Calculates the radius of a single-pass (extended) box blur with the given variance along each axis. Uses the same
+    formula as Pillow's GaussianBlur, which splits a Gaussian into several such box blurs
+    :param variance: Variance of the box blur
+    :return: Radius of the box blur
+    """
+
+    ideal_width = sqrt(12 * variance + 1)
+    whole_radius = floor((ideal_width - 1) / 2)
+    fraction = (2 * whole_radius + 1) * (whole_radius * (whole_radius + 1) - 3 * variance)
+    fraction /= 6 * (variance - (whole_radius + 1) ** 2)
+
+    return whole_radius + fraction
+
+class BoxBlurPasses(ImageFilter.MultibandFilter):
+    """
+    Pillow's BoxBlur, applied several times along each axis in a single filter, the way Pillow's GaussianBlur applies
+    its three box blurs. Faster than applying BoxBlur several times
+    """
+
+    name = "BoxBlurPasses"
+
+    def __init__(self, radius, passes):
+        """
+        :param radius: Radius of each box blur
+        :param passes: Number of box blurs applied along each axis
+        """
+
+        self.radius = radius
+        self.passes = passes
+
+    def filter(self, image):
+        """
+        :param image: Pillow core image
+        :return: Blurred core image
+        """
+
+        return image.box_blur((self.radius, self.radius), self.passes)
+
+def box_blur(image_array, radius, passes=1):
+    """
+    Applies (extended) box blurs to an image the way Pillow's BoxBlur does: every pass averages the 2 * radius + 1
+    nearest pixels along a row, with fractional weight for the outermost pixels and the border pixels repeated past
+    the edge. All passes along the rows are applied before the passes along the columns. Used for images that Pillow
+    cannot blur, such as 16-bit images. Intermediate passes are not rounded
+    :param image_array: 2D array
+    :param radius: Radius of each box blur
+    :param passes: Number of box blurs applied along each axis
+    :return: 2D array of the same type containing the blurred image
+    """
+
+    if radius == 0:
+        return image_array.copy()
+
+    # The blur radii used by IJOQ are small, so each pass adds up a few shifted copies of the image. Every pixel is
+    # computed from its neighbours in the same order, so a tile gives the same values as the same part of the image
+    whole_radius = floor(radius)
+    fraction = radius - whole_radius
+    values = image_array.astype(numpy.float32)
+    for _ in range(2):
+        for _ in range(passes):
+            padded = numpy.pad(values, ((0, 0), (whole_radius + 1, whole_radius + 1)), mode="edge")
+            width = values.shape[1]
+            values = fraction * (padded[:, :width] + padded[:, 2 * whole_radius + 2:])
+            for offset in range(1, 2 * whole_radius + 2):
+                values += padded[:, offset:offset + width]
+            values *= 1 / (2 * radius + 1)
+        values = values.T
+
+    return numpy.rint(values, out=values).astype(image_array.dtype)
+
+def blur_image(image_array, blur_radius, fast=False, base_array=None, base_radius=0):
+    """
+    Applies a Gaussian blur to a single-channel image
+    :param image_array: 2D uint8 array, or a 2D uint16 array which is blurred in numpy with the same box blurs that
+        Pillow would use (see box_blur)
+    :param blur_radius: Radius (standard deviation) of the Gaussian blur. Must be a whole number if fast is True
+    :param fast: If True, approximate the blur with a cascade of box blurs. Radius 1 uses Pillow's GaussianBlur, then
+        radius r is built from radius r - 1 by adding FAST_BLUR_PASSES box blurs with a total variance of
+        r ** 2 - (r - 1) ** 2, so each further radius costs FAST_BLUR_PASSES passes instead of the three passes of
+        GaussianBlur. Only faster when several radii of an image are needed, as in calibration. Differs from
+        GaussianBlur by at most a few brightness levels away from the image border (see README)
+    :param base_array: Fast mode only. An already blurred level of the cascade (radius 1 or above) to continue from
+    :param base_radius: Fast mode only. Blur radius of base_array
+    :return: 2D array of the same type containing the blurred image
+    """
+
+    # Pillow's GaussianBlur is 3 box blurs along each axis, each with a third of the variance
+    if image_array.dtype != numpy.uint8:
+        if not fast or blur_radius <= 1:
+            return box_blur(image_array, box_blur_radius(blur_radius ** 2 / 3), 3)
+        if base_array is None or base_radius < 1:
+            base_array, base_radius = box_blur(image_array, box_blur_radius(1 / 3), 3), 1
+        for radius in range(base_radius + 1, blur_radius + 1):
+            base_array = box_blur(base_array, box_blur_radius((radius ** 2 - (radius - 1) ** 2) / FAST_BLUR_PASSES),
+                                  FAST_BLUR_PASSES)
+
+        return base_array
+
+    if not fast or blur_radius <= 1:
+        image = Image.fromarray(image_array)
+
+        return numpy.array(image.filter(ImageFilter.GaussianBlur(radius=blur_radius)))
+
+    if base_array is None or base_radius < 1:
+        image, base_radius = Image.fromarray(image_array).filter(ImageFilter.GaussianBlur(radius=1)), 1
+    else:
+        image = Image.fromarray(base_array)
+    for radius in range(base_radius + 1, blur_radius + 1):
+        image = image.filter(BoxBlurPasses(box_blur_radius((radius ** 2 - (radius - 1) ** 2) / FAST_BLUR_PASSES),
+                                           FAST_BLUR_PASSES))
+
+    return numpy.array(image)
+
+def pixel_deviation(image_array):
+    """
+    Calculates the interquartile range of the brightness difference between neighboring pixels along the center lines
+    of an image. Used to estimate the blur radius during calibration
+    :param image_array: 2D uint8 or uint16 array
+    :return: Interquartile range of the brightness deviation
+    """
+
+    height, width = image_array.shape
+    center_column = image_array[:, round(width / 2)].astype(numpy.int64)
+    center_row = image_array[round(height / 2), :].astype(numpy.int64)
+
+    brightness_deviation = numpy.sort(numpy.concatenate((numpy.diff(center_column), numpy.diff(center_row))))
+    IQR = brightness_deviation[round(3 * len(brightness_deviation) / 4)] - \
+          brightness_deviation[round(len(brightness_deviation) / 4)]
+
+    return int(IQR)
+
+def peak_deviation(image_array):
+    """
+    Calculates the median relative difference in brightness between local maxima and minima along the center lines
+    of an image. Used to estimate the noise cutoff during calibration
+    :param image_array: 2D uint8 or uint16 array
+    :return: Median brightness deviation (0 if no peaks were found)
+    """
+
+    height, width = image_array.shape
+
+    # Calculate difference in brightness between local minima/maxima
+    # TODO: Dividing local maxima by local minima seems funky and can lead to divide-by-zero errors. Check if this is really the intention
+    # Currently doing workaround to set local minimum to 1 if it's 0
+    brightness_deviation = []
+    for line in (image_array[1:, round(width / 2)], image_array[round(height / 2), 1:]):
+        local_minimum = -1
+        local_maximum = 0
+        increasing = True
+        for pixel in line:
+            if increasing:
+                if pixel < 0.95 * local_maximum:
+                    increasing = False
+                    if local_minimum != -1:
+                        difference = (local_maximum / local_minimum) - 1
+                        brightness_deviation.append(difference)
+                    local_minimum = max(int(pixel), 1)
+                else:
+                    local_maximum = pixel
+            else:
+                if pixel > 1.05 * local_minimum:
+                    increasing = True
+                    difference = (local_maximum / local_minimum) - 1
+                    brightness_deviation.append(difference)
+                    local_maximum = pixel
+                else:
+                    local_minimum = max(int(pixel), 1)
+
+    if brightness_deviation:
+        brightness_deviation.sort()
+        return brightness_deviation[round(len(brightness_deviation) / 2)]
+
+    return 0
+
+@dataclass
+class AnalysisResult:
+    """
+    Result of the IJOQ analysis of a single image
+    """
+
+    name: str
+    IJOQ: float
+    dense_IJOQ: float = None  # Only calculated if requested
+    processed_image: numpy.ndarray = None  # 2D uint8 array containing the thresholded image (see TILED_IMAGE_SIZE)
+    frame: int = None  # Number (starting from 1) of the analyzed frame of a multi-page image, if analyzed by frame
+
+def analyze_image(source, settings, dense=False, progress=None, executor=None, keep_image=True, timer=None):
+    """
+    Runs the IJOQ analysis on a single image
+    :param source: Path to an image file, or an Image object
+    :param settings: Settings obtained from calibration
+    :param dense: If True, also calculate the dense IJOQ using every row and column of the image
+    :param progress: Optional callback taking (message, steps). A single image takes 6 + section_size ** 2 steps
+    :param executor: Optional concurrent.futures executor. Only used if the settings have a tile size, to spread the
+        tiles across cores (see analyze_tiled_image)
+    :param keep_image: If False, the processed image is not kept in the result
+    :param timer: Optional StageTimer that the time of each stage is added to
+    :return: AnalysisResult
+    """
+
+    if settings.tile_size > 0:
+        return analyze_tiled_image(source, settings, dense, progress, executor, keep_image, timer)
+
+    image_name = source_name(source)
+    report(progress, f"Analyzing {image_name}...")
+    image_array = load_image(source, settings.compressed_image_size, settings.channel, settings.fast_ingest,
+                             settings.bit_depth, timer)
+    height, width = image_array.shape
+
+    # Extract channel and apply blur
+    report(progress, f"\nExtracting channel from {image_name}...")
+    report(progress, f"\nApplying blur to {image_name}...")
+    with timed(timer, "blur"):
+        blurred_image_array = blur_image(image_array, settings.blur_radius, settings.fast_blur)
+    report(progress, steps=1)
+
+    # Split the picture into sections. For each section, sample pixels, then find the normalization threshold
+    report(progress, f"\nCalculating threshold values for {image_name}...")
+    with timed(timer, "section sampling"):
+        normalization_threshold_array = sample_section_thresholds(
+            blurred_image_array,
+            settings.section_size,
+            settings.pixels_sampled,
+            settings.normalization_cutoff)
+    report(progress, steps=settings.section_size ** 2)
+
+    # Interpolate the section thresholds into a brightness map
+    report(progress, f"\nCalculating brightness map for {image_name}...")
+    with timed(timer, "brightness map"):
+        brightness_map = calculate_brightness_map(normalization_threshold_array, width, height)
+    report(progress, steps=1)
+
+    # Normalize image using calculated brightness map
+    with timed(timer, "normalize"):
+        normalized_image_array = normalize_image(blurred_image_array, brightness_map, settings.noise_cutoff,
+                                                 bit_depth=settings.bit_depth)
+    report(progress, steps=1)
+
+    # Count the junctions crossed by the horizontal and vertical lines
+    report(progress, f"\nCalculating IJOQ for {image_name}...")
+    with timed(timer, "crossing count"):
+        result = AnalysisResult(image_name, calculate_IJOQ(normalized_image_array, settings.lines),
+                                processed_image=normalized_image_array)
+    report(progress, steps=2)
+
+    if dense:
+        with timed(timer, "crossing count"):
+            result.dense_IJOQ = calculate_dense_IJOQ(normalized_image_array)
+        report(progress, f"\n{image_name} has an IJOQ value of {result.IJOQ} (dense IJOQ: {result.dense_IJOQ}).\n\n", 1)
+    else:
+        report(progress, f"\n{image_name} has an IJOQ value of {result.IJOQ}.\n\n", 1)
+
+    if not keep_image:
+        result.processed_image = None
+
+    return result
+
+def frame_count(source):
+    """
+    Counts the frames (pages) of an image file, such as the planes of a multi-page TIFF z-stack or time-lapse. Only
+    the file headers are read, so images of any size are accepted
+    :param source: Path to an image file
+    :return: Number of frames (1 for single-frame images)
+    """
+
+    with unlimited_image_size(), Image.open(source) as image:
+        return getattr(image, "n_frames", 1)
+
+def analyze_frame(source, frame, settings, dense=False, progress=None, executor=None, keep_image=True, timer=None):
+    """
+    Runs the IJOQ analysis on a single frame of a multi-page image. Only that frame is decoded
+    :param source: Path to an image file
+    :param frame: Number of the frame, starting from 1
+    :param settings: Settings obtained from calibration
+    :param dense: If True, also calculate the dense IJOQ using every row and column of the frame
+    :param progress: Optional callback taking (message, steps). A single frame takes 6 + section_size ** 2 steps
+    :param executor: Optional concurrent.futures executor (see analyze_image)
+    :param keep_image: If False, the processed image is not kept in the result
+    :param timer: Optional StageTimer (see analyze_image). Seeking the frame is timed as part of the "open" stage
+    :return: AnalysisResult
+    """
+
+    with unlimited_image_size() if settings.tile_size > 0 else nullcontext():
+        image = Image.open(source)
+    with image:
+        with timed(timer, "open", 0):
+            image.seek(frame - 1)
+        result = analyze_image(image, settings, dense, progress, executor, keep_image, timer)
+    result.frame = frame
+
+    return result
+
+def result_label(result):
+    """
+    :param result: AnalysisResult
+    :return: Name of the analyzed image, followed by the frame number if a single frame was analyzed
+    """
+
+    return result.name if result.frame is None else f"{result.name} (frame {result.frame})"
+
+def blur_halo(blur_radius):
+    """
+    Determines how far the blur (and the junction crossing between neighbouring pixels) reaches, so that a tile blurred
+    with this many extra pixels around it matches the same part of the whole blurred image. A box blur reaches its
+    radius rounded up, GaussianBlur is 3 box blurs, and the fast blur cascade adds FAST_BLUR_PASSES box blurs per radius
+    (see blur_image)
+    :param blur_radius: Blur radius
+    :return: Width (in pixels) of the border added around each tile
+    """
+
+    gaussian_reach = 3 * ceil(box_blur_radius(blur_radius ** 2 / 3))
+    cascade_reach = 3 * ceil(box_blur_radius(1 / 3))
+    for radius in range(2, blur_radius + 1):
+        cascade_reach += FAST_BLUR_PASSES * ceil(box_blur_radius((radius ** 2 - (radius - 1) ** 2) / FAST_BLUR_PASSES))
+
+    return max(gaussian_reach, cascade_reach) + 1
+
+def tile_boxes(width, height, tile_size, halo):
+    """
+    Splits an image into tiles
+    :param width: Width (in pixels) of the image
+    :param height: Height (in pixels) of the image
+    :param tile_size: Maximum width and height of a tile
+    :param halo: Width of the border added around each tile (see blur_halo)
+    :return: List of (tile box, outer box) tuples. A box is (left, top, right, bottom). The outer box is the tile box
+        with the border added, cropped to the image
+    """
+
+    boxes = []
+    for top in range(0, height, tile_size):
+        for left in range(0, width, tile_size):
+            right, bottom = min(left + tile_size, width), min(top + tile_size, height)
+            outer_box = (max(left - halo, 0), max(top - halo, 0), min(right + halo, width), min(bottom + halo, height))
+            boxes.append(((left, top, right, bottom), outer_box))
+
+    return boxes
+
+def raw_region_tiles(image, box):
+    """
+    Determines the decoder tiles that read a single region of an uncompressed TIFF image. The strips or tiles of such
+    files store the pixels row by row, so the rows and columns of the region can be read from the file on their own
+    :param image: Image object that has not been loaded yet
+    :param box: (left, top, right, bottom) of the region
+    :return: List of decoder tiles whose extents are relative to the region, or None if the image cannot be read by
+        region (e.g. compressed or non-TIFF images)
+    """
+
+    if image.format != "TIFF" or not image.tile or image.tag_v2.get(274, 1) != 1:
+        return None
+
+    # Bits of a pixel within one strip or tile (of one plane, for planar images)
+    bits_per_sample = image.tag_v2.get(258, (1,))
+    pixel_bits = bits_per_sample[0] * (image.tag_v2.get(277, 1) if image.tag_v2.get(284, 1) == 1 else 1)
+    if pixel_bits % 8:
+        return None
+    pixel_bytes = pixel_bits // 8
+
+    region_tiles = []
+    for tile in image.tile:
+        if tile.codec_name != "raw" or len(tile.args) != 3 or tile.args[2] != 1:
+            return None
+        x0, y0, x1, y1 = tile.extents
+        row_bytes = tile.args[1] or (x1 - x0) * pixel_bytes
+        left, top, right, bottom = max(x0, box[0]), max(y0, box[1]), min(x1, box[2]), min(y1, box[3])
+        if left < right and top < bottom:
+            region_tiles.append(tile._replace(extents=(left - box[0], top - box[1], right - box[0], bottom - box[1]),
+                                              offset=tile.offset + (top - y0) * row_bytes + (left - x0) * pixel_bytes,
+                                              args=(tile.args[0], row_bytes, 1)))
+
+    return region_tiles
+
+def region_source(source):
+    """
+    Checks whether the regions of an image can be read from its file one at a time (see raw_region_tiles)
+    :param source: Path to an image file, or an Image object that has not been loaded yet
+    :return: Tuple of (path to the image file, frame index, image width, image height), or None if the image has to be
+        decoded whole
+    """
+
+    image = source if isinstance(source, Image.Image) else Image.open(source)
+    try:
+        file_path = getattr(image, "filename", None)
+        if not file_path or raw_region_tiles(image, (0, 0) + image.size) is None:
+            return None
+        return file_path, image.tell(), image.width, image.height
+    finally:
+        if image is not source:
+            image.close()
+
+def read_region(file_path, frame, box, channel, bit_depth=8, timer=None):
+    """
+    Reads the analyzed channel of a single region of an image, decoding only that region if the file allows it (see
+    raw_region_tiles)
+    :param file_path: Path to the image file
+    :param frame: Index of the frame to read
+    :param box: (left, top, right, bottom) of the region
+    :param channel: Index of the channel to extract (0 = red, 1 = green, 2 = blue)
+    :param bit_depth: Bit depth of the returned brightness values (see load_image)
+    :param timer: Optional StageTimer
+    :return: 2D array containing the channel of the region
+    """
+
+    with timed(timer, "open", 0), unlimited_image_size():
+        image = Image.open(file_path)
+    with image:
+        with timed(timer, "open", 0):
+            image.seek(frame)
+            region_tiles = raw_region_tiles(image, box)
+        if region_tiles is None:
+            with timed(timer, "open", 0), unlimited_image_size():
+                image.load()
+            return load_image(image.crop(box), 0, channel, bit_depth=bit_depth, timer=timer)
+
+        # The TIFF plugin allocates the decoded image at its tile size
+        image.tile = region_tiles
+        image._size = image._tile_size = (box[2] - box[0], box[3] - box[1])
+        return load_image(image, 0, channel, bit_depth=bit_depth, timer=timer)
+
+def tile_job_source(region, image_array, box):
+    """
+    :param region: Result of region_source, or None
+    :param image_array: 2D array containing the analyzed channel of the whole image if region is None
+    :param box: (left, top, right, bottom) of the region
+    :return: Source of the region for read_tile
+    """
+
+    return region[:2] if region is not None else image_array[box[1]:box[3], box[0]:box[2]]
+
+def read_tile(tile_source, box, channel, bit_depth=8, timer=None):
+    """
+    :param tile_source: 2D array already containing the analyzed channel of the box, or a (path to the image file,
+        frame index) tuple to read it from
+    :param box: (left, top, right, bottom) of the region
+    :param channel: Index of the channel to extract (0 = red, 1 = green, 2 = blue)
+    :param bit_depth: Bit depth of the returned brightness values (see load_image)
+    :param timer: Optional StageTimer
+    :return: 2D array containing the channel of the region
+    """
+
+    if isinstance(tile_source, numpy.ndarray):
+        return tile_source
+
+    return read_region(*tile_source, box, channel, bit_depth, timer)
+
+def reduce_tile(tile_array, box, factor):
+    """
+    Shrinks a processed tile by a whole factor, keeping a pixel white if any of the pixels it covers is white. The
+    pixels are grouped by their position in the whole image, so the shrunk tiles of an image fit together
+    :param tile_array: 2D array containing the processed tile
+    :param box: (left, top, right, bottom) of the tile
+    :param factor: Width and height (in pixels) of the groups of pixels combined into one
+    :return: 2D array containing the shrunk tile, whose top left pixel is at (left // factor, top // factor)
+    """
+
+    if factor == 1:
+        return tile_array
+
+    top, left = box[1] % factor, box[0] % factor
+    height, width = tile_array.shape
+    padded_array = numpy.zeros((-(-(top + height) // factor) * factor, -(-(left + width) // factor) * factor),
+                               dtype=tile_array.dtype)
+    padded_array[top:top + height, left:left + width] = tile_array
+
+    return padded_array.reshape(padded_array.shape[0] // factor, factor,
+                                padded_array.shape[1] // factor, factor).max(axis=(1, 3))
+
+def sample_band(tile_source, band_box, row, settings, pixel_x, timer=None):
+    """
+    Blurs a band of full image rows, then takes the brightness of the section sample pixels (see
+    section_sample_coordinates) in its middle row
+    :param tile_source: Source of the band (see read_tile)
+    :param band_box: (left, top, right, bottom) of the band, spanning the whole image width
+    :param row: y coordinate of the sampled row
+    :param settings: Settings used for the analysis
+    :param pixel_x: 1D array of the x coordinates of all sampled pixels
+    :param timer: Optional StageTimer
+    :return: 1D array of the sampled brightness values
+    """
+
+    band_array = read_tile(tile_source, band_box, settings.channel, settings.bit_depth, timer)
+    with timed(timer, "blur"):
+        blurred_band_array = blur_image(band_array, settings.blur_radius, settings.fast_blur)
+
+    with timed(timer, "section sampling"):
+        return blurred_band_array[row - band_box[1], pixel_x]
+
+def process_tile(tile_source, box, outer_box, settings, section_thresholds, width, height, dense, reduction,
+                 timer=None):
+    """
+    Blurs and thresholds a tile, then counts the junction crossings inside it. Crossings between the tile and the
+    pixels to its left and above it are counted with the tile, so every crossing of the image is counted once
+    :param tile_source: Source of the outer box of the tile (see read_tile)
+    :param box: (left, top, right, bottom) of the tile
+    :param outer_box: (left, top, right, bottom) of the tile with its border
+    :param settings: Settings used for the analysis
+    :param section_thresholds: Section thresholds of the whole image (see sample_section_thresholds)
+    :param width: Width (in pixels) of the whole image
+    :param height: Height (in pixels) of the whole image
+    :param dense: If True, also count the crossings along every row and column
+    :param reduction: If above 0, also return the processed tile, shrunk by this factor (see reduce_tile)
+    :param timer: Optional StageTimer
+    :return: Tuple of (crossings along the IJOQ rows, crossings along the IJOQ columns, dense row crossings, dense
+        column crossings, processed tile or None). Dense crossings are 0 if dense is False
+    """
+
+    tile_array = read_tile(tile_source, outer_box, settings.channel, settings.bit_depth, timer)
+
+    # Include the column to the left and the row above the tile
+    left, top = max(box[0] - 1, 0), max(box[1] - 1, 0)
+    with timed(timer, "blur"):
+        blurred_tile_array = blur_image(tile_array, settings.blur_radius, settings.fast_blur)
+    blurred_tile_array = blurred_tile_array[top - outer_box[1]:box[3] - outer_box[1],
+                                            left - outer_box[0]:box[2] - outer_box[0]]
+    with timed(timer, "brightness map"):
+        brightness_map = calculate_brightness_map(section_thresholds, width, height, (left, top, box[2], box[3]))
+    with timed(timer, "normalize"):
+        normalized_tile_array = normalize_image(blurred_tile_array, brightness_map, settings.noise_cutoff,
+                                                bit_depth=settings.bit_depth)
+
+    # Only count along the lines that pass through the tile itself
+    rows, columns = IJOQ_lines(width, height, settings.lines)
+    rows = [row - top for row in rows if box[1] <= row < box[3]]
+    columns = [column - left for column in columns if box[0] <= column < box[2]]
+    with timed(timer, "crossing count"):
+        horizontal_crossings, vertical_crossings = count_crossings(normalized_tile_array, rows, columns)
+
+        dense_horizontal_crossings, dense_vertical_crossings = 0, 0
+        if dense:
+            dense_horizontal_crossings, dense_vertical_crossings = count_crossings(
+                normalized_tile_array, slice(box[1] - top, None), slice(box[0] - left, None))
+
+    processed_tile = None
+    if reduction:
+        processed_tile = reduce_tile(normalized_tile_array[box[1] - top:, box[0] - left:], box, reduction)
+
+    return (horizontal_crossings, vertical_crossings, dense_horizontal_crossings, dense_vertical_crossings,
+            processed_tile)
+
+def analyze_tiled_image(source, settings, dense=False, progress=None, executor=None, keep_image=True, timer=None):
+    """
+    Runs the IJOQ analysis on a single image at full resolution. The image is blurred, thresholded and scanned for
+    junctions one tile at a time, so the blurred image, brightness map and thresholds of the whole image are never held
+    in memory. Gives the same result as analyze_image would give for the full-resolution image. Each job reads only its
+    own tile (with its border) from uncompressed TIFF files (see raw_region_tiles). Other images are decoded whole once.
+    Images above Pillow's decompression bomb limit are accepted (see unlimited_image_size)
+    :param source: Path to an image file, or an Image object that has not been loaded yet
+    :param settings: Settings obtained from calibration, with a tile size above 0
+    :param dense: If True, also calculate the dense IJOQ using every row and column of the image
+    :param progress: Optional callback taking (message, steps). A single image takes 6 + section_size ** 2 steps
+    :param executor: Optional concurrent.futures executor. Each tile is an independent job, so a process pool spreads
+        the tiles across cores
+    :param keep_image: If True, also return the processed image. Images larger than TILED_IMAGE_SIZE are shrunk to
+        about that size (see reduce_tile). If False, only a few tiles are held in memory at a time
+    :param timer: Optional StageTimer. The stages of every tile are timed in the process that runs the tile, and the
+        blur also covers the border of each tile
+    :return: AnalysisResult
+    """
+
+    image_name = source_name(source)
+    report(progress, f"Analyzing {image_name}...")
+    with timed(timer, "open", 0), unlimited_image_size():
+        region = region_source(source)
+    image_array = None
+    if region is None:
+        with unlimited_image_size():
+            image_array = load_image(source, 0, settings.channel, bit_depth=settings.bit_depth, timer=timer)
+        height, width = image_array.shape
+    else:
+        width, height = region[2:]
+
+    # Each tile is sent to a worker process with a border wide enough for the blur. Limit the number of tiles in flight
+    halo = blur_halo(settings.blur_radius)
+    boxes = tile_boxes(width, height, settings.tile_size, halo)
+    max_pending = 2 * (cpu_count() or 1)
+
+    # Sample the section pixels of each row that holds them, blurred within a band of rows as tall as the tile border,
+    # then find the normalization threshold of each section
+    report(progress, f"\nApplying blur to {image_name} and calculating threshold values ({len(boxes)} tiles)...")
+    pixel_x, pixel_y = section_sample_coordinates(width, height, settings.section_size, settings.pixels_sampled)
+    section_count, pixel_number = pixel_x.shape
+    sampled_rows = numpy.unique(pixel_y).tolist()
+    band_boxes = [(0, max(row - halo, 0), width, min(row + halo + 1, height)) for row in sampled_rows]
+    jobs = ((tile_job_source(region, image_array, band_box), band_box, row, settings, pixel_x.ravel())
+            for band_box, row in zip(band_boxes, sampled_rows))
+    row_values = dict(zip(sampled_rows, map_timed_jobs(sample_band, jobs, timer, executor, max_pending)))
+
+    # Rows of sampled_values are indexed [section_y][sample_y] and columns [section_x][sample_x]
+    with timed(timer, "section sampling"):
+        sampled_values = numpy.array([row_values[row] for row in pixel_y.ravel()])
+        sampled_values = sampled_values.reshape(section_count, pixel_number, section_count, pixel_number)
+        section_thresholds = rank_section_samples(sampled_values.transpose(2, 0, 3, 1),
+                                                  settings.normalization_cutoff)
+    report(progress, steps=1 + settings.section_size ** 2)
+
+    # Threshold each tile using the brightness map interpolated across the whole image, and add up the crossings
+    report(progress, f"\nCalculating IJOQ for {image_name}...")
+    reduction = -(-max(width, height) // TILED_IMAGE_SIZE) if keep_image else 0
+    processed_image = None
+    if keep_image:
+        processed_image = numpy.zeros((-(-height // reduction), -(-width // reduction)), dtype=numpy.uint8)
+    crossings = [0, 0, 0, 0]
+    jobs = ((tile_job_source(region, image_array, outer_box), box, outer_box, settings, section_thresholds, width,
+             height, dense, reduction)
+            for box, outer_box in boxes)
+    for (box, _), tile_result in zip(boxes, map_timed_jobs(process_tile, jobs, timer, executor, max_pending)):
+        for i in range(4):
+            crossings[i] += tile_result[i]
+        if keep_image:
+            top, left = box[1] // reduction, box[0] // reduction
+            image_part = processed_image[top:top + tile_result[4].shape[0], left:left + tile_result[4].shape[1]]
+            numpy.maximum(image_part, tile_result[4], out=image_part)
+    report(progress, steps=4)
+
+    result = AnalysisResult(image_name,
+                            junction_frequency(crossings[0], crossings[1], width, height, 2 * settings.lines),
+                            processed_image=processed_image)
+    if dense:
+        result.dense_IJOQ = junction_frequency(crossings[2], crossings[3], width, height, width + height)
+        report(progress, f"\n{image_name} has an IJOQ value of {result.IJOQ} (dense IJOQ: {result.dense_IJOQ}).\n\n", 1)
+    else:
+        report(progress, f"\n{image_name} has an IJOQ value of {result.IJOQ}.\n\n", 1)
+
+    return result
+
+class CalibrationResult:
+    """
+    Intermediate data of a calibration, used to review and fine-tune the calibrated settings. Blur levels are computed
+    on demand (see compute_blur_level). For each blur level, only the blurred images and the section thresholds are
+    kept. Brightness maps are rebuilt from the section thresholds when needed. Rendering is not thread-safe, so images
+    should be processed from a single thread at a time
+    """
+
+    def __init__(self, settings, names, image_arrays):
+        """
+        :param settings: Calibrated settings
+        :param names: Names of the calibration images
+        :param image_arrays: Compressed calibration images (2D uint8 arrays, or uint16 above a bit depth of 8)
+        """
+
+        self.settings = settings
+        self.names = names
+        self.image_arrays = image_arrays
+        self.processed_images = [None] * len(names)
+
+        # Normalization cutoff of each blur level, blurred images (2D arrays) indexed [image][blur level], and
+        # section thresholds (2D float arrays indexed [x][y]) indexed [image][blur level]. None until computed
+        self.normalization_thresholds = [None] * len(BLUR_RADIUS_VALUES)
+        self.blurred_images = [[None] * len(BLUR_RADIUS_VALUES) for _ in names]
+        self.section_thresholds = [[None] * len(BLUR_RADIUS_VALUES) for _ in names]
+        self.blur_level_condition = Condition()
+        self.blur_level_error = None  # Message of the error that stopped the missing blur levels from being computed
+
+        # Least recently used caches of threshold key planes, keyed by (image, blur level), and of rendered images,
+        # keyed by (image, blur level, noise cutoff)
+        self.key_planes = OrderedDict()
+        self.rendered_images = OrderedDict()
+
+    def has_blur_level(self, blur_number):
+        """
+        :param blur_number: Index of the blur level
+        :return: True if the blur level has been computed
+        """
+
+        return self.normalization_thresholds[blur_number] is not None
+
+    def next_blur_level(self):
+        """
+        Determines which blur level to compute next: the missing level closest to the current blur radius, so that
+        a level selected by the user is computed first
+        :return: Index of the blur level, or None if all blur levels have been computed
+        """
+
+        missing_levels = [i for i in range(len(BLUR_RADIUS_VALUES)) if not self.has_blur_level(i)]
+        if not missing_levels:
+            return None
+
+        return min(missing_levels, key=lambda i: abs(i - self.settings.blur_radius))
+
+    def compute_blur_level(self, blur_number, executor=None, progress=None, timer=None):
+        """
+        Blurs every calibration image with one blur radius, then determines the normalization cutoff and the section
+        thresholds of that blur level. Does nothing if the blur level has already been computed
+        :param blur_number: Index of the blur level
+        :param executor: Optional concurrent.futures executor (see calibrate)
+        :param progress: Optional callback taking (message, steps).
+            A blur level takes len(names) * (2 + 2 * section_size ** 2) + 1 steps
+        :param timer: Optional StageTimer that the time of each stage is added to
+        :return: None
+        """
+
+        if self.has_blur_level(blur_number):
+            return
+
+        section_count = self.settings.section_size
+        pixels_sampled = self.settings.pixels_sampled
+
+        # Blur every image, then calculate the threshold value for each blurred image. With fast blur, continue the box
+        # blur cascade from the largest blur radius below this one that has already been computed
+        base_number = 0
+        if self.settings.fast_blur:
+            base_number = max((i for i in range(1, blur_number) if self.has_blur_level(i)), default=0)
+        jobs = [(self.image_arrays[i], BLUR_RADIUS_VALUES[blur_number], section_count, pixels_sampled,
+                 self.settings.fast_blur, self.blurred_images[i][base_number] if base_number else None,
+                 BLUR_RADIUS_VALUES[base_number])
+                for i in range(len(self.names))]
+        threshold_list = []
+        blurred_images = []
+        for image_name, (blurred_image_array, threshold) in zip(
+                self.names, map_timed_jobs(calibration_threshold, jobs, timer, executor)):
+            report(progress, f"\n\nApplying blur to {image_name} and calculating threshold values...")
+            blurred_images.append(blurred_image_array)
+            threshold_list.append(threshold)
+            report(progress, steps=1 + section_count ** 2)
+
+        # A blur radius of 0 leaves the image unchanged, so share the compressed image instead of keeping a copy
+        if BLUR_RADIUS_VALUES[blur_number] == 0:
+            blurred_images = self.image_arrays
+
+        # Take geometric mean of thresholds
+        product = 1
+        for threshold in threshold_list:
+            product *= threshold
+        normalization_threshold = round(product ** (1 / len(threshold_list)))
+        report(progress, steps=1)
+
+        # For each section of each blurred image, sample pixels, then find the normalization threshold. Only these
+        # section thresholds are kept. The brightness maps are interpolated from them when the images are normalized
+        report(progress, f"\n\nPreparing brightness maps...\n")
+        jobs = [(blurred_image_array, section_count, pixels_sampled, normalization_threshold)
+                for blurred_image_array in blurred_images]
+        section_thresholds = []
+        for image_name, image_section_thresholds in zip(
+                self.names, map_timed_jobs(calibration_section_thresholds, jobs, timer, executor)):
+            report(progress, f"\nCalculating brightness map for {image_name}...")
+            section_thresholds.append(image_section_thresholds)
+            report(progress, steps=section_count ** 2 + 1)
+
+        with self.blur_level_condition:
+            for i in range(len(self.names)):
+                self.blurred_images[i][blur_number] = blurred_images[i]
+                self.section_thresholds[i][blur_number] = section_thresholds[i]
+            self.normalization_thresholds[blur_number] = normalization_threshold
+            if blur_number == self.settings.blur_radius:
+                self.settings.normalization_cutoff = normalization_threshold
+            self.blur_level_condition.notify_all()
+
+    def fail_blur_levels(self, message):
+        """
+        Records that the missing blur levels cannot be computed, and wakes up the threads waiting for them
+        :param message: Description of the error
+        :return: None
+        """
+
+        with self.blur_level_condition:
+            self.blur_level_error = message
+            self.blur_level_condition.notify_all()
+
+    def wait_for_blur_level(self, blur_number, timeout=None):
+        """
+        Waits until a blur level has been computed by another thread. Stops waiting if the missing blur levels cannot
+        be computed (see fail_blur_levels)
+        :param blur_number: Index of the blur level
+        :param timeout: Maximum number of seconds to wait, or None to wait indefinitely
+        :return: True if the blur level is available
+        """
+
+        with self.blur_level_condition:
+            return self.blur_level_condition.wait_for(
+                lambda: self.has_blur_level(blur_number) or self.blur_level_error is not None, timeout) and \
+                self.has_blur_level(blur_number)
+
+    def set_blur_radius(self, blur_radius):
+        """
+        Selects a different blur level, along with its normalization cutoff. If the blur level has not been computed
+        yet, the normalization cutoff is updated once it is
+        :param blur_radius: Index of the blur level
+        :return: None
+        """
+
+        with self.blur_level_condition:
+            self.settings.blur_radius = blur_radius
+            if self.has_blur_level(blur_radius):
+                self.settings.normalization_cutoff = self.normalization_thresholds[blur_radius]
+
+    def brightness_map(self, image_number, blur_number):
+        """
+        Builds the brightness map of a calibration image from its section thresholds
+        :param image_number: Index of the calibration image
+        :param blur_number: Index of the blur level
+        :return: 2D float array containing the brightness map
+        """
+
+        height, width = self.blurred_images[image_number][blur_number].shape
+
+        return calculate_brightness_map(self.section_thresholds[image_number][blur_number], width, height)
+
+    def key_plane(self, image_number, blur_number):
+        """
+        Gets the threshold key plane of a calibration image (see threshold_keys), building it if it is not cached
+        :param image_number: Index of the calibration image
+        :param blur_number: Index of the blur level
+        :return: 2D uint16 array
+        """
+
+        key = (image_number, blur_number)
+        if key in self.key_planes:
+            self.key_planes.move_to_end(key)
+        else:
+            self.key_planes[key] = threshold_keys(
+                self.blurred_images[image_number][blur_number], self.brightness_map(image_number, blur_number))
+            if len(self.key_planes) > KEY_PLANE_CACHE_SIZE:
+                self.key_planes.popitem(last=False)
+
+        return self.key_planes[key]
+
+    def render(self, image_number, blur_number, noise_cutoff):
+        """
+        Thresholds a calibration image with the given blur level and noise cutoff. Gives the same result as
+        normalize_image. Rendered images are cached and must not be modified
+        :param image_number: Index of the calibration image
+        :param blur_number: Index of the blur level
+        :param noise_cutoff: Noise cutoff
+        :return: Read-only 2D uint8 array containing the processed image
+        """
+
+        key = (image_number, blur_number, noise_cutoff)
+        if key in self.rendered_images:
+            self.rendered_images.move_to_end(key)
+        else:
+            if self.blurred_images[image_number][blur_number].dtype == numpy.uint8:
+                rendered_image = threshold_table(noise_cutoff).take(self.key_plane(image_number, blur_number))
+            else:
+                # The threshold table only covers 8-bit brightness values
+                rendered_image = normalize_image(self.blurred_images[image_number][blur_number],
+                                                 self.brightness_map(image_number, blur_number), noise_cutoff,
+                                                 bit_depth=self.settings.bit_depth)
+            rendered_image.flags.writeable = False
+            self.rendered_images[key] = rendered_image
+            if len(self.rendered_images) > RENDERED_IMAGE_CACHE_SIZE:
+                self.rendered_images.popitem(last=False)
+
+        return self.rendered_images[key]
+
+    def process_image(self, image_number, blur_number=None, noise_cutoff=None):
+        """
+        Thresholds a calibration image and stores it as the processed image
+        :param image_number: Index of the calibration image
+        :param blur_number: Index of the blur level. Defaults to the blur radius of the settings
+        :param noise_cutoff: Noise cutoff. Defaults to the noise cutoff of the settings
+        :return: Read-only 2D uint8 array containing the processed image
+        """
+
+        if blur_number is None:
+            blur_number = self.settings.blur_radius
+        if noise_cutoff is None:
+            noise_cutoff = self.settings.noise_cutoff
+        self.processed_images[image_number] = self.render(image_number, blur_number, noise_cutoff)
+
+        return self.processed_images[image_number]
+
+    def save(self, file_path):
+        """
+        Saves the calibration to a compressed session file, so that it can be reviewed again later without the original
+        images. Stores the compressed images and, for every blur level computed so far, the normalization cutoff, the
+        blurred images and the section thresholds
+        :param file_path: Path of the session file. ".npz" is added if the path does not end with it
+        :return: None
+        """
+
+        with self.blur_level_condition:
+            settings_text = self.settings.to_text()
+            normalization_thresholds = [-1 if threshold is None else threshold
+                                        for threshold in self.normalization_thresholds]
+            arrays = {}
+            for i in range(len(self.names)):
+                arrays[f"image_{i}"] = self.image_arrays[i]
+                for b in range(len(BLUR_RADIUS_VALUES)):
+                    if self.has_blur_level(b):
+                        # A blur radius of 0 leaves the image unchanged (see compute_blur_level)
+                        if BLUR_RADIUS_VALUES[b] != 0:
+                            arrays[f"blurred_{i}_{b}"] = self.blurred_images[i][b]
+                        arrays[f"section_thresholds_{i}_{b}"] = self.section_thresholds[i][b]
+
+        numpy.savez_compressed(file_path, settings=numpy.array(settings_text), names=numpy.array(self.names),
+                               normalization_thresholds=numpy.array(normalization_thresholds), **arrays)
+
+    @classmethod
+    def load(cls, file_path):
+        """
+        Loads a calibration saved with save, then processes the images with the saved settings. Blur levels that had
+        not been computed when the session was saved can be computed with compute_blur_level as usual
+        :param file_path: Path of the session file
+        :return: CalibrationResult
+        :raises ValueError: If the arrays of the session file do not fit together
+        """
+
+        def checked_array(key, shape=None, dtype=None):
+            array = session[key]
+            if (array.shape != shape if shape is not None else array.ndim != 2) or \
+                    (dtype is not None and array.dtype != dtype):
+                raise ValueError(f"The session file has an invalid {key} array")
+            return array
+
+        with numpy.load(file_path, allow_pickle=False) as session:
+            settings = Settings.from_text(str(session["settings"]))
+            names = [str(name) for name in session["names"]]
+
+            # Images are loaded as uint16 above a bit depth of 8 (see load_image), and blurring keeps their type
+            image_type = numpy.uint16 if settings.bit_depth > 8 else numpy.uint8
+            image_arrays = [checked_array(f"image_{i}", dtype=image_type) for i in range(len(names))]
+            result = cls(settings, names, image_arrays)
+
+            normalization_thresholds = checked_array("normalization_thresholds", (len(BLUR_RADIUS_VALUES),))
+            for b, threshold in enumerate(normalization_thresholds.tolist()):
+                if threshold < 0:
+                    continue
+
+                for i in range(len(names)):
+                    result.blurred_images[i][b] = result.image_arrays[i] if BLUR_RADIUS_VALUES[b] == 0 \
+                        else checked_array(f"blurred_{i}_{b}", image_arrays[i].shape, image_type)
+                    result.section_thresholds[i][b] = checked_array(f"section_thresholds_{i}_{b}",
+                                                                    (settings.section_size, settings.section_size))
+                result.normalization_thresholds[b] = threshold
+
+        if not result.has_blur_level(settings.blur_radius):
+            raise ValueError("The session file does not contain the blur level of its settings")
+        for i in range(len(names)):
+            result.process_image(i)
+
+        return result
+
+def map_jobs(function, jobs, executor=None, max_pending=None):
+    """
+    Runs a function over a list of jobs, either in this process or on an executor
+    :param function: Module-level function to run (must be picklable when using a process pool)
+    :param jobs: Iterable of argument tuples, one per job
+    :param executor: Optional concurrent.futures executor. If None, the jobs are run one at a time in this process
+    :param max_pending: Optional maximum number of jobs submitted to the executor but not yet yielded. Limits the
+        memory held by finished results for long job lists
+    :return: Generator yielding the result of each job in the order of the jobs. Exceptions are re-raised
+    """
+
+    if executor is None:
+        for job in jobs:
+            yield function(*job)
+    else:
+        futures = deque()
+        try:
+            for job in jobs:
+                futures.append(executor.submit(function, *job))
+                if max_pending is not None and len(futures) >= max_pending:
+                    yield futures.popleft().result()
+            while futures:
+                yield futures.popleft().result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+def timed_job(function, *arguments):
+    """
+    Runs a job with its own StageTimer. Safe to run in a worker process
+    :param function: Module-level function taking a timer keyword argument
+    :param arguments: Arguments of the function
+    :return: Tuple of the return value of the function and the stage times of the timer (see StageTimer.stage_times)
+    """
+
+    timer = StageTimer()
+
+    return function(*arguments, timer=timer), timer.stage_times
+
+def map_timed_jobs(function, jobs, timer=None, executor=None, max_pending=None):
+    """
+    Runs a function over a list of jobs like map_jobs, and adds the stage times measured by each job to a timer
+    :param function: Module-level function taking a timer keyword argument
+    :param jobs: Iterable of argument tuples, one per job
+    :param timer: StageTimer, or None to run the jobs without timing them
+    :param executor: Optional concurrent.futures executor (see map_jobs)
+    :param max_pending: Optional maximum number of pending jobs (see map_jobs)
+    :return: Generator yielding the result of each job in the order of the jobs
+    """
+
+    if timer is None:
+        yield from map_jobs(function, jobs, executor, max_pending)
+    else:
+        for value, stage_times in map_jobs(timed_job, ((function, *job) for job in jobs), executor, max_pending):
+            timer.add_times(stage_times)
+            yield value
+
+def load_calibration_image(source, compressed_image_size, channel, fast_ingest, measure_deviation, bit_depth=8,
+                           timer=None):
+    """
+    Loads a calibration image. Calibration job, safe to run in a worker process
+    :param source: Path to an image file, or an Image object
+    :param compressed_image_size: Target size of the average of the image width and height
+    :param channel: Index of the channel to extract
+    :param fast_ingest: If True, use the fast image loading path (see load_image)
+    :param measure_deviation: If True, also measure the pixel deviation used to estimate the blur radius
+    :param bit_depth: Bit depth of the image array (see load_image)
+    :param timer: Optional StageTimer
+    :return: Tuple of the 2D image array and the pixel deviation (None if not measured)
+    """
+
+    image_array = load_image(source, compressed_image_size, channel, fast_ingest, bit_depth, timer)
+    if not measure_deviation:
+        return image_array, None
+
+    with timed(timer, "blur estimate"):
+        return image_array, pixel_deviation(image_array)
+
+def calibration_threshold(image_array, blur_radius, section_count, pixels_sampled, fast_blur=False, base_array=None,
+                          base_radius=0, timer=None):
+    """
+    Blurs a calibration image and determines its normalization threshold. Calibration job, safe to run in a worker
+    process
+    :param image_array: 2D uint8 or uint16 array
+    :param blur_radius: Radius of the Gaussian blur
+    :param section_count: Number of sections along each image axis
+    :param pixels_sampled: Number of pixels sampled along each section axis
+    :param fast_blur: If True, use the box blur cascade (see blur_image)
+    :param base_array: Fast blur only. An already blurred level to continue the cascade from
+    :param base_radius: Fast blur only. Blur radius of base_array
+    :param timer: Optional StageTimer. The threshold search is timed as the "otsu" stage
+    :return: Tuple of the blurred 2D array and the normalization threshold of the image
+    """
+
+    with timed(timer, "blur"):
+        blurred_image_array = blur_image(image_array, blur_radius, fast_blur, base_array, base_radius)
+
+    with timed(timer, "otsu"):
+        return blurred_image_array, otsu_normalization_threshold(blurred_image_array, section_count, pixels_sampled)
+
+def otsu_normalization_threshold(blurred_image_array, section_count, pixels_sampled):
+    """
+    Determines the normalization threshold of a blurred calibration image, from the share of its pixels that Otsu's
+    Method sets to white in each section
+    :param blurred_image_array: 2D uint8 or uint16 array
+    :param section_count: Number of sections along each image axis
+    :param pixels_sampled: Number of pixels sampled along each section axis
+    :return: Normalization threshold of the image
+    """
+
+    height, width = blurred_image_array.shape
+
+    # Take a histogram of every section at once, then use Otsu's Method to determine the threshold for each section.
+    # Above 8 bits, the histograms only span the brightness range present in the image. Shifting every brightness value
+    # by the same amount does not change which pixels are above the thresholds
+    if blurred_image_array.dtype == numpy.uint8:
+        histograms = section_histograms(blurred_image_array, section_count)
+    else:
+        lowest = blurred_image_array.min()
+        histograms = section_histograms(blurred_image_array - lowest, section_count,
+                                        int(blurred_image_array.max()) - int(lowest) + 1)
+    section_thresholds = otsu_thresholds(histograms)
+
+    # Count the pixels that the determined thresholds would set to white
+    white_pixel_counter = count_pixels_above(histograms, section_thresholds)
+
+    # Determine normalization threshold
+    white_percent = white_pixel_counter / (width * height)
+
+    return numpy.ceil((1 - white_percent) * (pixels_sampled ** 2))
+
+def calibration_section_thresholds(blurred_image_array, section_count, pixels_sampled, normalization_threshold,
+                                   timer=None):
+    """
+    Determines the section thresholds of a blurred calibration image (see sample_section_thresholds). Calibration job,
+    safe to run in a worker process
+    :param blurred_image_array: 2D uint8 or uint16 array
+    :param section_count: Number of sections along each image axis
+    :param pixels_sampled: Number of pixels sampled along each section axis
+    :param normalization_threshold: Normalization threshold of the blur level
+    :param timer: Optional StageTimer
+    :return: 2D float array of the section thresholds
+    """
+
+    with timed(timer, "section sampling"):
+        return sample_section_thresholds(blurred_image_array, section_count, pixels_sampled, normalization_threshold)
+
+def calibration_steps(image_count, section_count, blur_level_count=1):
+    """
+    Calculates the number of progress steps of a calibration
+    :param image_count: Number of calibration images
+    :param section_count: Number of sections along each image axis
+    :param blur_level_count: Number of blur levels computed
+    :return: Number of progress steps
+    """
+
+    return image_count * (1 + blur_level_count * (2 + 2 * section_count ** 2)) + blur_level_count
+
+def calibrate(sources, options, progress=None, executor=None, timer=None):
+    """
+    Runs the calibration on a set of negative control images. Only the blur level of the calibrated blur radius is
+    computed. The other blur levels can be computed afterward with CalibrationResult.compute_blur_level
+    :param sources: Paths to image files, or Image objects
+    :param options: CalibrationOptions
+    :param progress: Optional callback taking (message, steps). The calibration takes
+        calibration_steps(len(sources), section_size) steps
+    :param executor: Optional concurrent.futures executor. Each image is an independent job, so a process pool spreads
+        the calibration across cores. Results do not depend on the executor
+    :param timer: Optional StageTimer that the time of each stage is added to. Stages run in worker processes are timed
+        there. The final thresholding of the images (including their brightness maps) is timed as "normalize"
+    :return: CalibrationResult containing the calibrated settings
+    """
+
+    settings = replace(options.settings)
+    names = [source_name(source) for source in sources]
+
+    # Run calibration
+    report(progress, "Determining ideal normalization threshold value...")
+
+    # Load every image. Images analyzed in tiles are analyzed at full resolution, so they are calibrated at full
+    # resolution too
+    compressed_image_size = 0 if settings.tile_size > 0 else settings.compressed_image_size
+    jobs = [(source, compressed_image_size, settings.channel, settings.fast_ingest, options.cell_count > 0,
+             settings.bit_depth) for source in sources]
+    image_arrays = []
+    brightness_deviation_list = []
+    for image_name, (image_array, brightness_deviation) in zip(
+            names, map_timed_jobs(load_calibration_image, jobs, timer, executor)):
+        report(progress, f"\n\nExtracting channel from {image_name}...")
+        if timer is not None:
+            timer.add_image(image_name)
+        image_arrays.append(image_array)
+        brightness_deviation_list.append(brightness_deviation)
+
+    # Take average of brightness deviations (out of 255) and set as blur radius
+    if options.cell_count > 0:
+        average_brightness_deviation = sum(brightness_deviation_list) / len(brightness_deviation_list)
+        if settings.bit_depth > 8:
+            average_brightness_deviation *= 255 / max_brightness(settings.bit_depth)
+        settings.blur_radius = \
+            max(min(round(25 * average_brightness_deviation / (options.cell_count ** 2.5)), 5), 1)
+
+    # Compute the blur level of the calibrated blur radius
+    result = CalibrationResult(settings, names, image_arrays)
+    result.compute_blur_level(settings.blur_radius, executor, progress, timer)
+    blurred_images = result.blurred_images
+
+    # Calculate noise filter
+    if options.estimate_noise:
+        with timed(timer, "noise estimate"):
+            brightness_deviation_list = [peak_deviation(blurred_images[i][settings.blur_radius])
+                                         for i in range(len(sources))]
+
+        average_brightness_deviation = sum(brightness_deviation_list) / len(brightness_deviation_list)
+        settings.noise_cutoff = \
+            max(min(round(round((average_brightness_deviation / 10) / 0.05) * 0.05, 2), 0.5), 0)
+
+    result.set_blur_radius(settings.blur_radius)
+
+    report(progress, f"\n\nPreparing output images...\n")
+    for i in range(len(sources)):
+        report(progress, f"\nNormalizing {names[i]}...")
+
+        # Normalize image using calculated brightness map
+        with timed(timer, "normalize"):
+            result.process_image(i)
+        report(progress, steps=1)
+
+    report(progress, "\n\nCalibration complete! Press the \"Show result\" button to view calibration results.")
+
+    return result
+
+def find_images(inputs, image_types):
+    """
+    Collects the image files from a list of files, folders, and glob patterns. Folders are searched recursively, and
+    images in any folder containing "Output" in its name are ignored
+    :param inputs: Paths to files or folders, or glob patterns
+    :param image_types: Tuple of accepted (lowercase) file extensions
+    :return: List of image file paths, in the order they were found
+    """
+
+    image_files = []
+    for input_path in inputs:
+        # Expand glob patterns. Paths without wildcards match themselves if they exist
+        for match in sorted(glob(input_path, recursive=True)) or [input_path]:
+            if path.isdir(match):
+                for (dirpath, dirnames, filenames) in walk(match):
+                    dirnames.sort()
+                    if "Output" not in dirpath:
+                        for file in sorted(filenames):
+                            if file.lower().endswith(image_types):
+                                image_files.append(dirpath + "/" + file)
+            elif "Output" not in path.dirname(match) and match.lower().endswith(image_types):
+                image_files.append(match)
+
+    return image_files
+
+def create_output_folder(folder_path, folder_name):
+    """
+    Creates an output folder. If the folder already exists, a number is added until an available name is found
+    :param folder_path: Folder in which the output folder is created
+    :param folder_name: Name of the output folder (e.g. "Analysis_Output")
+    :return: Path to the created folder, ending with "/"
+    """
+
+    save_path = folder_path + "/" + folder_name + "/"
+    if path.isdir(save_path):
+        folder_number = 2
+        while path.isdir(save_path[:-1] + " (" + str(folder_number) + ")/"):
+            folder_number += 1
+        save_path = save_path[:-1] + " (" + str(folder_number) + ")/"
+    mkdir(save_path)
+
+    return save_path
+
+def processed_image_name(name, frame=None):
+    """
+    Determines the file name that the processed version of an image is saved under
+    :param name: File name of the original image
+    :param frame: Number of the analyzed frame of a multi-page image, or None
+    :return: File name ending in "_processed.png"
+    """
+
+    base_name = ".".join(name.split(".")[:-1])
+    if frame is not None:
+        base_name += f"_frame{frame}"
+
+    return base_name + "_processed.png"
+
+def results_header(dense=False, frames=False):
+    """
+    :param dense: If True, include the dense IJOQ column
+    :param frames: If True, include the frame column (see analyze_frame)
+    :return: Header row of the results CSV file
+    """
+
+    header = ["File name", "Frame"] if frames else ["File name"]
+
+    return header + (["IJOQ", "Dense IJOQ"] if dense else ["IJOQ"])
+
+def results_row(result, dense=False, frames=False):
+    """
+    :param result: AnalysisResult
+    :param dense: If True, include the dense IJOQ column
+    :param frames: If True, include the frame column (see analyze_frame)
+    :return: Row of the results CSV file for the result
+    """
+
+    row = [result.name, result.frame] if frames else [result.name]
+
+    return row + ([result.IJOQ, result.dense_IJOQ] if dense else [result.IJOQ])
+
+def summary_header(dense=False):
+    """
+    :param dense: If True, include the dense IJOQ columns
+    :return: Header row of the stack summary CSV file
+    """
+
+    header = ["File name", "Frames", "Mean IJOQ", "Min IJOQ", "Max IJOQ"]
+    if dense:
+        header += ["Mean dense IJOQ", "Min dense IJOQ", "Max dense IJOQ"]
+
+    return header
+
+def summary_row(results, dense=False):
+    """
+    Summarizes the results of the frames of a multi-page image
+    :param results: List of AnalysisResult of the frames of one image
+    :param dense: If True, include the dense IJOQ columns
+    :return: Row of the stack summary CSV file
+    """
+
+    value_lists = [[result.IJOQ for result in results]]
+    if dense:
+        value_lists.append([result.dense_IJOQ for result in results])
+
+    row = [results[0].name, len(results)]
+    for values in value_lists:
+        row += [round(sum(values) / len(values), 4), min(values), max(values)]
+
+    return row
+
+def is_next_frame(previous_result, result):
+    """
+    :param previous_result: AnalysisResult of the previously analyzed frame
+    :param result: AnalysisResult of a frame
+    :return: True if the frame belongs to the same image as the previous frame (a new image starts at frame 1 or when
+        the name changes)
+    """
+
+    return result.frame != 1 and result.name == previous_result.name
+
+def group_frames(results):
+    """
+    Splits a list of results into the frames of each image
+    :param results: Iterable of AnalysisResult, in the order the frames were analyzed
+    :return: Generator yielding a list of AnalysisResult per image
+    """
+
+    stack = []
+    for result in results:
+        if stack and not is_next_frame(stack[-1], result):
+            yield stack
+            stack = []
+        stack.append(result)
+
+    if stack:
+        yield stack
+
+def write_results(file_path, results, dense=False, frames=False):
+    """
+    Writes analysis results to a CSV file
+    :param file_path: Path of the CSV file
+    :param results: List of AnalysisResult
+    :param dense: If True, add a column with the dense IJOQ values
+    :param frames: If True, add a column with the frame numbers (see analyze_frame)
+    :return: None
+    """
+
+    with open(file_path, mode="w", newline="") as results_file:
+        data_writer = csv.writer(results_file)
+        data_writer.writerow(results_header(dense, frames))
+        for result in results:
+            data_writer.writerow(results_row(result, dense, frames))
+
+def write_summary(file_path, results, dense=False):
+    """
+    Writes a summary of the results of each multi-page image to a CSV file
+    :param file_path: Path of the CSV file
+    :param results: List of AnalysisResult, in the order the frames were analyzed
+    :param dense: If True, add columns summarizing the dense IJOQ values
+    :return: None
+    """
+
+    with open(file_path, mode="w", newline="") as summary_file:
+        data_writer = csv.writer(summary_file)
+        data_writer.writerow(summary_header(dense))
+        for stack in group_frames(results):
+            data_writer.writerow(summary_row(stack, dense))
+
+def write_errors(file_path, errors):
+    """
+    Writes the images that could not be analyzed to a CSV file
+    :param file_path: Path of the CSV file
+    :param errors: List of (path to the image file, frame number or None, error message) tuples
+    :return: None
+    """
+
+    with open(file_path, mode="w", newline="") as errors_file:
+        data_writer = csv.writer(errors_file)
+        data_writer.writerow(["File name", "Frame", "Error"])
+        for file, frame, message in errors:
+            data_writer.writerow([source_name(file), "" if frame is None else frame, message])
+
+class ResultWriter:
+    """
+    Saves analysis results to an output folder as soon as each image is analyzed, so that results do not need to be
+    kept in memory. Each result is appended to the results CSV file, and its processed image is saved next to it.
+    When analyzing by frame, the summary of each multi-page image is written once its last frame has been saved
+    """
+
+    def __init__(self, save_path, version, dense=False, save_images=True, frames=False, summary=False):
+        """
+        :param save_path: Output folder, ending with "/" (see create_output_folder)
+        :param version: Current IJOQ version, used in the results file name
+        :param dense: If True, add a column with the dense IJOQ values
+        :param save_images: If True, save the processed image of each result
+        :param frames: If True, add a column with the frame numbers (see analyze_frame)
+        :param summary: If True, also write a stack summary CSV file (see summary_row)
+        """
+
+        self.save_path = save_path
+        self.dense = dense
+        self.save_images = save_images
+        self.frames = frames
+        self.results_file = open(save_path + "IJOQ Results " + version + ".csv", mode="w", newline="")
+        self.data_writer = csv.writer(self.results_file)
+        self.data_writer.writerow(results_header(dense, frames))
+        self.results_file.flush()
+
+        # Results of the frames of the current image, without their processed images
+        self.stack = []
+        self.summary_file = None
+        if summary:
+            self.summary_file = open(save_path + "IJOQ Stack Summary " + version + ".csv", mode="w", newline="")
+            self.summary_writer = csv.writer(self.summary_file)
+            self.summary_writer.writerow(summary_header(dense))
+            self.summary_file.flush()
+
+    def write(self, result):
+        """
+        Saves a result, then releases its processed image
+        :param result: AnalysisResult
+        :return: Path of the saved processed image, or None if it was not saved
+        """
+
+        image_path = None
+        if self.save_images and result.processed_image is not None:
+            image_path = self.save_path + processed_image_name(result.name, result.frame)
+            Image.fromarray(result.processed_image).save(image_path)
+        result.processed_image = None
+
+        self.data_writer.writerow(results_row(result, self.dense, self.frames))
+        self.results_file.flush()
+
+        if self.summary_file is not None:
+            if self.stack and not is_next_frame(self.stack[-1], result):
+                self.write_summary()
+            self.stack.append(result)
+
+        return image_path
+
+    def write_summary(self):
+        """
+        Writes the summary of the frames of the current image
+        :return: None
+        """
+
+        self.summary_writer.writerow(summary_row(self.stack, self.dense))
+        self.summary_file.flush()
+        self.stack = []
+
+    def close(self):
+        """
+        Writes the summary of the last image, if any, then closes the results files
+        :return: None
+        """
+
+        if self.summary_file is not None:
+            if self.stack:
+                self.write_summary()
+            self.summary_file.close()
+        self.results_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class ResultCache:
+    """
+    On-disk cache of analysis results, so that images that have not changed are not analyzed again. Results are keyed
+    by a hash of the image file contents, the settings, ENGINE_VERSION and the frame number, if any. Each entry is a
+    small text file with the IJOQ values, plus the processed image if images are cached. When the folder grows beyond
+    its maximum size, the least recently used entries are removed. Only one process should add entries to a cache
+    folder at a time
+    """
+
+    def __init__(self, folder_path, max_size=RESULT_CACHE_SIZE, save_images=True):
+        """
+        :param folder_path: Cache folder. Created if it does not exist
+        :param max_size: Maximum size (in bytes) of the cache folder
+        :param save_images: If True, processed images are cached along with the IJOQ values
+        """
+
+        makedirs(folder_path, exist_ok=True)
+        self.folder_path = folder_path
+        self.max_size = max_size
+        self.save_images = save_images
+        self.size = sum(entry.stat().st_size for entry in scandir(folder_path) if entry.is_file())
+
+        # Hashes of the most recently hashed files, so that the frames of a multi-page image only hash it once
+        self.file_hashes = OrderedDict()
+
+    def file_hash(self, file_path):
+        """
+        Hashes the contents of a file. The hash is reused while the size and modification time of the file are
+        unchanged
+        :param file_path: Path to the file
+        :return: Hexadecimal SHA-256 hash of the file contents
+        """
+
+        file_stat = stat(file_path)
+        file_key = (file_path, file_stat.st_size, file_stat.st_mtime_ns)
+        if file_key in self.file_hashes:
+            self.file_hashes.move_to_end(file_key)
+        else:
+            file_hash = hashlib.sha256()
+            with open(file_path, mode="rb") as image_file:
+                for chunk in iter(lambda: image_file.read(1024 ** 2), b""):
+                    file_hash.update(chunk)
+            self.file_hashes[file_key] = file_hash.hexdigest()
+            if len(self.file_hashes) > 4:
+                self.file_hashes.popitem(last=False)
+
+        return self.file_hashes[file_key]
+
+    def key(self, source, settings, frame=None):
+        """
+        Determines the cache key of an image
+        :param source: Path to an image file, or an Image object
+        :param settings: Settings used for the analysis
+        :param frame: Number of the analyzed frame of a multi-page image (see analyze_frame), or None
+        :return: Hexadecimal key, or None if the source is not a file (results of Image objects are not cached)
+        """
+
+        if not isinstance(source, str):
+            return None
+
+        key_text = f"{self.file_hash(source)}\n{settings.to_text()}\nengine_version = {ENGINE_VERSION}"
+        if frame is not None:
+            key_text += f"\nframe = {frame}"
+
+        return hashlib.sha256(key_text.encode()).hexdigest()
+
+    def lookup(self, source, settings, dense=False, frame=None):
+        """
+        Looks up the cached result of an image. A result only counts if it has every value that the analysis would
+        return: the dense IJOQ if requested, and the processed image if images are cached
+        :param source: Path to an image file, or an Image object
+        :param settings: Settings used for the analysis
+        :param dense: If True, the dense IJOQ is needed
+        :param frame: Number of the analyzed frame of a multi-page image (see analyze_frame), or None
+        :return: Tuple of the cached AnalysisResult and None, or None and the key to cache the new result under (see
+            put)
+        """
+
+        key = self.key(source, settings, frame)
+        if key is None:
+            return None, None
+
+        entry_path = path.join(self.folder_path, key)
+        try:
+            values = {}
+            with open(entry_path + ".txt", mode="r") as entry_file:
+                for line in entry_file.readlines():
+                    if "=" in line:
+                        name, value = (part.strip() for part in line.split("=", 1))
+                        values[name] = float(value)
+
+            if dense and "dense_IJOQ" not in values:
+                return None, key
+            result = AnalysisResult(source_name(source), values["IJOQ"], values["dense_IJOQ"] if dense else None,
+                                    frame=frame)
+
+            if self.save_images:
+                with Image.open(entry_path + ".png") as processed_image:
+                    result.processed_image = numpy.array(processed_image)
+
+            # Mark the entry as recently used
+            utime(entry_path + ".txt")
+
+        # Missing, incomplete, or removed by another process
+        except (OSError, KeyError, ValueError):
+            return None, key
+
+        return result, None
+
+    def put(self, key, result):
+        """
+        Adds a result to the cache, then removes old entries if the cache has grown too large
+        :param key: Cache key returned by lookup, or None (nothing is cached)
+        :param result: AnalysisResult
+        :return: None
+        """
+
+        if key is None:
+            return
+
+        entry_path = path.join(self.folder_path, key)
+        if self.save_images and result.processed_image is not None:
+            Image.fromarray(result.processed_image).save(entry_path + ".png")
+            self.size += path.getsize(entry_path + ".png")
+
+        # The text file is written last and moved into place, so an entry is never read half-written
+        values = {"IJOQ": result.IJOQ, "dense_IJOQ": result.dense_IJOQ}
+        with open(entry_path + ".tmp", mode="w") as entry_file:
+            entry_file.write("\n".join(f"{name} = {value}" for name, value in values.items() if value is not None))
+        self.size += path.getsize(entry_path + ".tmp")
+        replace_file(entry_path + ".tmp", entry_path + ".txt")
+
+        if self.size > self.max_size:
+            self.evict()
+
+    def clear(self):
+        """
+        Removes every entry from the cache folder
+        :return: None
+        """
+
+        for entry in scandir(self.folder_path):
+            if entry.is_file() and path.splitext(entry.name)[1] in (".txt", ".png", ".tmp"):
+                try:
+                    remove(entry.path)
+                except FileNotFoundError:
+                    pass
+        self.size = sum(entry.stat().st_size for entry in scandir(self.folder_path) if entry.is_file())
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache folder is at most 3/4 of its maximum size, so that the
+        folder does not need to be scanned again for every new entry
+        :return: None
+        """
+
+        # Size and last use of each entry. The text file of an entry is touched whenever the entry is used
+        entries = {}
+        for entry in scandir(self.folder_path):
+            if entry.is_file():
+                key, extension = path.splitext(entry.name)
+                size, last_used = entries.get(key, (0, 0))
+                entry_stat = entry.stat()
+                entries[key] = (size + entry_stat.st_size,
+                                max(last_used, entry_stat.st_mtime) if extension == ".txt" else last_used)
+
+        self.size = sum(size for size, _ in entries.values())
+        for key in sorted(entries, key=lambda key: entries[key][1]):
+            if self.size <= self.max_size * 3 / 4:
+                break
+
+            for extension in (".txt", ".png", ".tmp"):
+                try:
+                    remove(path.join(self.folder_path, key + extension))
+                except FileNotFoundError:
+                    pass
+            self.size -= entries[key][0]
@@ -1,9 +1,12 @@
-import csv
-from os import path, mkdir, walk
 import tkinter
 from tkinter import filedialog, ttk, messagebox
 from PIL import ImageTk
 import modules.IJOQ_backend as Backend
+import modules.IJOQ_engine as Engine
+
+# Milliseconds between updates of the calculation page. Progress sent by the calculation threads in between is shown
+# all at once, so the page is updated at most about 30 times per second
+EVENT_INTERVAL = 33
 
 class GuiWindow:
 
@@ -126,6 +129,13 @@ class GuiWindow:
             file_delete_button.pack(padx=10, pady=2, fill="both")
             file_clear_button.pack(padx=10, pady=2, fill="both")
 
+            # Calibrations saved from the results page can be reopened without the original images
+            if calculation_type == "calibration":
+                session_load_button = ttk.Button(
+                    master=file_options_frame, text="Load session",
+                    command=self.cal_load_session)
+                session_load_button.pack(padx=10, pady=(20, 2), fill="both")
+
             # Add lower button
             self.file_select_button = ttk.Button(
                 master=file_select_frame,
@@ -212,6 +222,10 @@ class GuiWindow:
                 cal_settings_advanced_frame.rowconfigure(4, weight=0)
                 cal_settings_advanced_frame.rowconfigure(5, weight=0)
                 cal_settings_advanced_frame.rowconfigure(6, weight=0)
+                cal_settings_advanced_frame.rowconfigure(7, weight=0)
+                cal_settings_advanced_frame.rowconfigure(8, weight=0)
+                cal_settings_advanced_frame.rowconfigure(9, weight=0)
+                cal_settings_advanced_frame.rowconfigure(10, weight=0)
 
                 # Advanced Settings Label
                 cal_settings_image_compression_label = ttk.Label(
@@ -228,6 +242,10 @@ class GuiWindow:
                     master=cal_settings_advanced_frame, text="Percentage of noise filter")
                 cal_settings_line_number_label = ttk.Label(
                     master=cal_settings_advanced_frame, text="Number of lines drawn")
+                cal_settings_bit_depth_label = ttk.Label(
+                    master=cal_settings_advanced_frame, text="Bit depth (above 8 for 16-bit grayscale images)")
+                cal_settings_tile_size_label = ttk.Label(
+                    master=cal_settings_advanced_frame, text="Tile size (0 to compress the images instead)")
 
                 # Advanced Settings Spinbox
                 cal_settings_image_compression_spinbox = self.spinbox_setup(
@@ -248,6 +266,12 @@ class GuiWindow:
                 cal_settings_line_number_spinbox = self.spinbox_setup(
                     cal_settings_advanced_frame, self.calculation_class.line_number,
                     False, "int", 0, 99)
+                cal_settings_bit_depth_spinbox = self.spinbox_setup(
+                    cal_settings_advanced_frame, self.calculation_class.bit_depth,
+                    False, "int", 8, 16)
+                cal_settings_tile_size_spinbox = self.spinbox_setup(
+                    cal_settings_advanced_frame, self.calculation_class.tile_size,
+                    False, "int", 0, 16384)
 
                 # Advanced Settings Dropdown
                 cal_settings_advanced_channel_dropdown = ttk.OptionMenu(
@@ -263,6 +287,8 @@ class GuiWindow:
                 cal_settings_pixel_number_label.grid(padx=10, pady=6, row=4, column=0, sticky="ew")
                 cal_settings_noise_filter_label.grid(padx=10, pady=6, row=5, column=0, sticky="ew")
                 cal_settings_line_number_label.grid(padx=10, pady=6, row=6, column=0, sticky="ew")
+                cal_settings_bit_depth_label.grid(padx=10, pady=6, row=7, column=0, sticky="ew")
+                cal_settings_tile_size_label.grid(padx=10, pady=6, row=8, column=0, sticky="ew")
                 cal_settings_image_compression_spinbox.grid(padx=10, pady=6, row=0, column=1, sticky="w")
                 cal_settings_advanced_channel_dropdown.grid(padx=10, pady=6, row=1, column=1, sticky="w")
                 cal_settings_blur_radius_spinbox.grid(padx=10, pady=6, row=2, column=1, sticky="w")
@@ -270,6 +296,22 @@ class GuiWindow:
                 cal_settings_pixel_number_spinbox.grid(padx=10, pady=6, row=4, column=1, sticky="w")
                 cal_settings_noise_filter_spinbox.grid(padx=10, pady=6, row=5, column=1, sticky="w")
                 cal_settings_line_number_spinbox.grid(padx=10, pady=6, row=6, column=1, sticky="w")
+                cal_settings_bit_depth_spinbox.grid(padx=10, pady=6, row=7, column=1, sticky="w")
+                cal_settings_tile_size_spinbox.grid(padx=10, pady=6, row=8, column=1, sticky="w")
+
+                # Option to downscale large images while they are loaded (saved in the settings as fast_ingest)
+                cal_settings_fast_ingest_checkbutton = ttk.Checkbutton(
+                    master=cal_settings_advanced_frame,
+                    text="Load large images faster (uncheck to resize the full-resolution images, as in v1.4.0)",
+                    variable=self.calculation_class.fast_ingest)
+                cal_settings_fast_ingest_checkbutton.grid(padx=10, pady=6, row=9, column=0, columnspan=2, sticky="w")
+
+                # Option to approximate the blur with box blurs (saved in the settings as fast_blur)
+                cal_settings_fast_blur_checkbutton = ttk.Checkbutton(
+                    master=cal_settings_advanced_frame,
+                    text="Approximate the blur (faster calibration, slightly different results)",
+                    variable=self.calculation_class.fast_blur)
+                cal_settings_fast_blur_checkbutton.grid(padx=10, pady=6, row=10, column=0, columnspan=2, sticky="w")
 
             else: # analysis
 
@@ -281,6 +323,10 @@ class GuiWindow:
                 settings_frame.rowconfigure(1, weight=0)
                 settings_frame.rowconfigure(2, weight=2)
                 settings_frame.rowconfigure(3, weight=0)
+                settings_frame.rowconfigure(4, weight=0)
+                settings_frame.rowconfigure(5, weight=0)
+                settings_frame.rowconfigure(6, weight=0)
+                settings_frame.rowconfigure(7, weight=0)
 
                 # Description for the settings
                 anl_settings_description_label = ttk.Label(
@@ -303,7 +349,11 @@ class GuiWindow:
                          "Number of pixels: \n"
                          "Normalization threshold: \n"
                          "Noise filter: \n"
-                         "Number of lines: \n",
+                         "Number of lines: \n"
+                         "Fast image loading: \n"
+                         "Fast blur: \n"
+                         "Tile size: \n"
+                         "Bit depth: \n",
                     anchor=tkinter.NW,
                     justify=tkinter.LEFT)
                 anl_settings_parameter_labels.grid(padx=10, pady=2, row=2, column=0, sticky="nsew")
@@ -321,12 +371,53 @@ class GuiWindow:
                     command=self.anl_add_settings)
                 anl_add_settings_button.grid(padx=10, row=1, rowspan=2, column=2, sticky="new")
 
+                # Option to also score every row and column of the processed images
+                anl_dense_lines_checkbutton = ttk.Checkbutton(
+                    master=settings_frame,
+                    text="Also calculate a dense IJOQ using every row and column of the image",
+                    variable=self.calculation_class.dense_lines)
+                anl_dense_lines_checkbutton.grid(padx=10, pady=2, row=3, column=0, columnspan=3, sticky="w")
+
+                # Option to save each result as soon as it is analyzed, instead of keeping all results in memory
+                anl_stream_results_checkbutton = ttk.Checkbutton(
+                    master=settings_frame,
+                    text="Save each result as soon as it is analyzed (select the output folder when starting)",
+                    variable=self.calculation_class.stream_results)
+                anl_stream_results_checkbutton.grid(padx=10, pady=2, row=4, column=0, columnspan=3, sticky="w")
+
+                # Option to analyze every frame of multi-page images (z-stacks and time-lapses), not just the first
+                anl_analyze_frames_checkbutton = ttk.Checkbutton(
+                    master=settings_frame,
+                    text="Analyze every frame of multi-page TIFF images (also saves a summary of each image)",
+                    variable=self.calculation_class.analyze_frames)
+                anl_analyze_frames_checkbutton.grid(padx=10, pady=2, row=5, column=0, columnspan=3, sticky="w")
+
+                # Option to reuse the results of images that have not changed since they were last analyzed with the
+                # same settings, with the maximum size of the cache and a button to empty it
+                anl_cache_frame = ttk.Frame(settings_frame)
+                anl_cache_frame.grid(padx=10, pady=2, row=6, column=0, columnspan=3, sticky="ew")
+                anl_cache_frame.columnconfigure(2, weight=1)
+                anl_cache_checkbutton = ttk.Checkbutton(
+                    master=anl_cache_frame,
+                    text="Reuse the results of unchanged images (cache size in MB:",
+                    variable=self.calculation_class.use_cache)
+                anl_cache_checkbutton.grid(row=0, column=0, sticky="w")
+                anl_cache_size_spinbox = self.spinbox_setup(
+                    anl_cache_frame, self.calculation_class.cache_size, False, "int", 16, 65536)
+                anl_cache_size_spinbox.grid(padx=(4, 0), row=0, column=1, sticky="w")
+                anl_cache_size_label = ttk.Label(master=anl_cache_frame, text=")")
+                anl_cache_size_label.grid(row=0, column=2, sticky="w")
+                anl_clear_cache_button = ttk.Button(
+                    master=anl_cache_frame, text="Clear cache",
+                    command=self.anl_clear_cache)
+                anl_clear_cache_button.grid(row=0, column=3, sticky="e")
+
             # Add previous and confirm button
 
             conditional_command = self.calculation_class.go_to_calibration if self.calculation_type == "calibration" \
                 else self.calculation_class.go_to_analysis #TODO integrate better
 
-            conditional_num = 1 if self.calculation_type == "calibration" else 3
+            conditional_num = 1 if self.calculation_type == "calibration" else 7
             conditional_num2 = 1 if self.calculation_type == "calibration" else 2
             settings_previous_button = ttk.Button(
                 master=settings_frame,
@@ -495,7 +586,11 @@ class GuiWindow:
                          "Number of pixels: \n"
                          "Normalization threshold: \n"
                          "Noise filter: \n"
-                         "Number of lines: \n",
+                         "Number of lines: \n"
+                         "Fast image loading: \n"
+                         "Fast blur: \n"
+                         "Tile size: \n"
+                         "Bit depth: \n",
                     anchor=tkinter.NW,
                     justify=tkinter.LEFT)
                 cal_results_settings_parameter_labels.grid(row=1, column=0, sticky="nsew")
@@ -524,7 +619,7 @@ class GuiWindow:
                 self.cal_results_settings_blur_slider.bind(
                     "<ButtonRelease-1>",
                     lambda e: self.cal_update_results(int(self.calculation_class.results_blur_radius.get()),
-                                                      self.calculation_class.confirmed_noise_filter))
+                                                      self.calculation_class.settings.noise_cutoff))
                 self.cal_results_settings_blur_slider.grid(padx=2, row=3, column=0, columnspan=2, sticky="ew")
 
                 # Spinbox for the blur radius
@@ -553,7 +648,7 @@ class GuiWindow:
                         str(round(round(float(self.calculation_class.results_noise_filter.get()) / 0.005) * 0.005, 3))))
                 self.cal_results_settings_noise_slider.bind(
                     "<ButtonRelease-1>",
-                    lambda e: self.cal_update_results(self.calculation_class.confirmed_blur_radius,
+                    lambda e: self.cal_update_results(self.calculation_class.settings.blur_radius,
                                                       float(self.calculation_class.results_noise_filter.get())))
                 self.cal_results_settings_noise_slider.grid(padx=2, row=5, column=0, columnspan=2, sticky="ew")
 
@@ -584,6 +679,57 @@ class GuiWindow:
             results_previous_button.grid(padx=10, pady=10, row=2, column=0, sticky="sw")
             results_save_button.grid(padx=10, pady=10, row=2, column=1, sticky="se")
 
+            if calculation_type == "calibration":
+                cal_results_session_button = ttk.Button(
+                    master=results_frame,
+                    text="Save session",
+                    width=20,
+                    command=self.cal_save_session)
+                cal_results_session_button.grid(padx=10, pady=10, row=2, column=0, sticky="se")
+
+            # Start showing the progress of the calculation threads
+            self.parent.root.after(EVENT_INTERVAL, self.handle_calculation_events)
+
+        def handle_calculation_events(self):
+            """
+            Handles the events sent by the calculation threads since the last update (see Backend.Calculations), then
+            schedules the next update. Consecutive progress events are combined, so the textbox and progress bar are
+            updated once per batch of messages
+            :return: None
+            """
+
+            messages = []
+            steps = 0
+            try:
+                for event in self.calculation_class.take_events():
+                    if event[0] == "progress":
+                        if event[1] is not None:
+                            messages.append(event[1])
+                        steps += event[2]
+                    else:
+                        # Show the progress sent before the call first, in case the call depends on it
+                        self.show_progress("".join(messages), steps)
+                        messages = []
+                        steps = 0
+                        event[1](*event[2])
+                self.show_progress("".join(messages), steps)
+            finally:
+                self.parent.root.after(EVENT_INTERVAL, self.handle_calculation_events)
+
+        def show_progress(self, message, steps):
+            """
+            Adds text to the calculation textbox and advances the progress bar
+            :param message: Text to add to the textbox (may be empty)
+            :param steps: Number of steps to advance the progress bar by
+            :return: None
+            """
+
+            if message:
+                self.calculation_textbox.insert(tkinter.END, message)
+                self.calculation_textbox.see(tkinter.END)
+            if steps:
+                self.calculation_progress_bar["value"] += steps
+
         def spinbox_setup(self, frame, variable_name, is_even, var_type, var_min, var_max):
             """
             Sets up a ttk spinbox and adds sanitization binding to the spinbox
@@ -692,16 +838,9 @@ class GuiWindow:
             if file_path:
                 if file_path.lower().endswith(self.parent.valid_image_types):
                     if "Output" not in file_path:
-                        # Check current file count
-                        if len(self.calculation_class.input_files) < 99:
-                            file_name = file_path.split("/")[-1]
-                            self.calculation_class.input_files.append(file_path)
-                            self.file_list_box.insert(tkinter.END, file_name)
-                        else:
-                            messagebox.showinfo(
-                                "File limit reached",
-                                "You have reached the image file limit!\n\n"
-                                "The program accepts a maximum of 99 images.")
+                        file_name = file_path.split("/")[-1]
+                        self.calculation_class.input_files.append(file_path)
+                        self.file_list_box.insert(tkinter.END, file_name)
                     else:
                         messagebox.showinfo(
                             "Output file detected",
@@ -734,26 +873,9 @@ class GuiWindow:
                         "A possible output folder was selected!\n\nThis program automatically ignores any "
                         "images saved in a folder containing \"Output\" in its name.")
                 else:
-                    file_limit_reached = False
-                    for (dirpath, dirnames, filenames) in walk(folder_path):
-                        if "Output" not in dirpath:
-                            for file in filenames:
-                                if file.lower().endswith(self.parent.valid_image_types):
-                                    # Check calibration file count
-                                    if len(self.calculation_class.input_files) < 99:
-                                        self.calculation_class.input_files.append(dirpath + "/" + file)
-                                        self.file_list_box.insert(tkinter.END, file)
-                                    else:
-                                        messagebox.showinfo(
-                                            "File limit reached",
-                                            "You have reached the image file limit!\n\n"
-                                            "The program accepts a maximum of 99 images.")
-                                        file_limit_reached = True
-                                        break
-                                if file_limit_reached:
-                                    break
-                        if file_limit_reached:
-                            break
+                    for file_path in Engine.find_images([folder_path], self.parent.valid_image_types):
+                        self.calculation_class.input_files.append(file_path)
+                        self.file_list_box.insert(tkinter.END, file_path.split("/")[-1])
 
             # Enable the confirm files button if there are at least 3 selections for calibration
             # and at least 1 selection for analysis
@@ -845,7 +967,7 @@ class GuiWindow:
             if image_number == 0:
                 self.results_picture_left_arrow_button["state"] = "disabled"
                 self.results_picture_right_arrow_button["state"] = "normal"
-            elif image_number == len(self.calculation_class.confirmed_files) - 1:
+            elif image_number == len(self.calculation_class.processed_files) - 1:
                 self.results_picture_left_arrow_button["state"] = "normal"
                 self.results_picture_right_arrow_button["state"] = "disabled"
             else:
@@ -854,7 +976,7 @@ class GuiWindow:
 
             # Update text label
             self.results_picture_label.configure(
-                text=self.calculation_class.confirmed_file_names[image_number])
+                text=self.calculation_class.get_processed_file_name(image_number))
 
             # Update image
             self.draw_results_image(image_number)
@@ -892,7 +1014,7 @@ class GuiWindow:
             :param image_number: Index of the processed image
             :return: None
             """
-            image = self.calculation_class.processed_files[image_number]
+            image = self.calculation_class.get_processed_file(image_number)
             label = self.results_picture_label
 
             # Resize image according to label's width and height
@@ -914,37 +1036,43 @@ class GuiWindow:
             :return: None
             """
 
-            # TODO figure out why i have blur_number
-            blur_number = new_blur
-
-            # Update internal blur radius and noise filter values
-            self.calculation_class.confirmed_blur_radius = new_blur
-            self.calculation_class.confirmed_normal_threshold = self.calculation_class.normalization_thresholds[blur_number]
-            self.calculation_class.confirmed_noise_filter = new_noise_filter
+            # Update internal blur radius, normalization threshold and noise filter values
+            self.calculation_class.calibration_result.set_blur_radius(new_blur)
+            self.calculation_class.settings.noise_cutoff = new_noise_filter
 
-            # Check for existing threads. If previous threads exist, prompt them to stop
-            if self.calculation_class.noise_filter_threads:
-                for thread in self.calculation_class.noise_filter_threads:
-                    thread.stop = True
+            # Redraw images on the noise filter thread. Requests made while it is busy are coalesced, so the sliders can
+            # stay enabled
+            if self.calculation_class.noise_filter_thread is None:
+                self.calculation_class.noise_filter_thread = Backend.NoiseCalculationThread(self, self.calculation_class)
+                self.calculation_class.noise_filter_thread.start()
+            self.calculation_class.noise_filter_thread.request_update(
+                self.calculation_class.settings.blur_radius, self.calculation_class.settings.noise_cutoff)
 
-            # Redraw images using new thread
-            noise_filter_thread = Backend.NoiseCalculationThread(self, self.calculation_class)
-            self.calculation_class.noise_filter_threads.append(noise_filter_thread)
-            noise_filter_thread.start()
+            self.cal_update_settings_label()
 
-            # Disable the slider and spinbox widgets
-            self.cal_results_settings_blur_slider["state"] = "disabled"
-            self.cal_results_settings_blur_spinbox["state"] = "disabled"
-            self.cal_results_settings_noise_slider["state"] = "disabled"
-            self.cal_results_settings_noise_spinbox["state"] = "disabled"
+        def cal_update_settings_label(self):
+            """
+            Updates the blur radius, normalization threshold and noise filter values shown in the calibration results page
+            :return: None
+            """
 
-            # Update the label text
             settings_values = self.cal_results_settings_value_label.cget("text").split("\n")
-            settings_values[2] = str(self.calculation_class.confirmed_blur_radius)
-            settings_values[5] = str(self.calculation_class.confirmed_normal_threshold)
-            settings_values[6] = str(self.calculation_class.confirmed_noise_filter)
+            settings_values[2] = str(self.calculation_class.settings.blur_radius)
+            settings_values[5] = str(self.calculation_class.settings.normalization_cutoff)
+            settings_values[6] = str(self.calculation_class.settings.noise_cutoff)
             self.cal_results_settings_value_label["text"] = "\n".join(settings_values)
 
+        def cal_show_blur_level_error(self, message):
+            """
+            Tells the user that the selected blur radius could not be calculated
+            :param message: Description of the error
+            :return: None
+            """
+
+            messagebox.showinfo(
+                "Blur radius unavailable",
+                f"The selected blur radius could not be calculated!\n\n{message}")
+
         def cal_results_blur_spinbox_update(self, _):
             """
             Takes the current value from the blur spinbox in the calibration results page and updates the processed images
@@ -954,7 +1082,7 @@ class GuiWindow:
 
             self.sanitize_input(self.calculation_class.results_blur_radius, False, "int", 0, 5) # TODO: might be simpler if I use a dict for these variables? So that I don't have to retype these every time
             self.cal_update_results(int(self.calculation_class.results_blur_radius.get()),
-                                    self.calculation_class.confirmed_noise_filter)
+                                    self.calculation_class.settings.noise_cutoff)
 
         def cal_results_noise_spinbox_update(self, _):
             """
@@ -964,7 +1092,7 @@ class GuiWindow:
             """
 
             self.sanitize_input(self.calculation_class.results_noise_filter, False, "float", -0.5, 0.5)
-            self.cal_update_results(self.calculation_class.confirmed_blur_radius,
+            self.cal_update_results(self.calculation_class.settings.blur_radius,
                                     float(self.calculation_class.results_noise_filter.get()))
 
         def cal_save_settings(self):  # TODO: save with folder names to prevent naming conflict
@@ -973,41 +1101,92 @@ class GuiWindow:
             :return: None
             """
 
+            # The normalization threshold of the selected blur radius may still be being calculated in the background,
+            # or may have failed
+            calibration_result = self.calculation_class.calibration_result
+            if not calibration_result.has_blur_level(self.calculation_class.settings.blur_radius) and \
+                    calibration_result.blur_level_error is not None:
+                self.cal_show_blur_level_error(calibration_result.blur_level_error)
+                return
+            if not calibration_result.has_blur_level(self.calculation_class.settings.blur_radius):
+                messagebox.showinfo(
+                    "Calibration in progress",
+                    "The selected blur radius is still being calculated!\n\n"
+                    "Please wait for the processed images to update, then try again.")
+                return
+
             folder_path = filedialog.askdirectory()
 
             # If user did not press cancel
             if folder_path:
 
                 # If save folder exists, add a number until an available save folder is found
-                save_path = folder_path + "/Settings_Output/"
-                if path.isdir(save_path):
-                    folder_number = 2
-                    while path.isdir(save_path[:-1] + " (" + str(folder_number) + ")/"):
-                        folder_number += 1
-                    save_path = save_path[:-1] + " (" + str(folder_number) + ")/"
-                mkdir(save_path)
-
-                with open(save_path + "Settings " + self.parent.current_version + ".txt", mode="w") as settings_file:
-                    settings_file.write(
-                        f"compressed_image_size = {self.calculation_class.confirmed_image_compression}\n"
-                        f"channel = {self.calculation_class.confirmed_channel}\n"
-                        f"blur_radius = {self.calculation_class.confirmed_blur_radius}\n"
-                        f"section_size = {self.calculation_class.confirmed_section_number}\n"
-                        f"pixels_sampled = {self.calculation_class.confirmed_pixel_number}\n"
-                        f"normalization_cutoff = {self.calculation_class.confirmed_normal_threshold}\n"
-                        f"noise_cutoff = {self.calculation_class.confirmed_noise_filter}\n"
-                        f"lines = {self.calculation_class.confirmed_line_number}")
+                save_path = Engine.create_output_folder(folder_path, "Settings_Output")
+
+                self.calculation_class.settings.write(save_path + "Settings " + self.parent.current_version + ".txt")
+                if self.calculation_class.timer is not None:
+                    self.calculation_class.timer.write(
+                        save_path + "Calibration Timings " + self.parent.current_version + ".json")
 
                 for i in range(len(self.calculation_class.processed_files)):
-                    image_name = ".".join(self.calculation_class.confirmed_file_names[i].split(".")[:-1])
                     image = self.calculation_class.processed_files[i]
-                    image.save(save_path + image_name + "_processed.png")
+                    image.save(save_path + Engine.processed_image_name(self.calculation_class.confirmed_file_names[i]))
 
                 messagebox.showinfo(
                     "Settings saved successfully",
                     "The settings have been saved successfully to:\n\n" +
                     save_path)
 
+        def cal_save_session(self):
+            """
+            Opens a file select screen and saves the calibration session, so that the results can be reviewed later
+            without running the calibration again
+            :return: None
+            """
+
+            # The normalization threshold of the selected blur radius may still be being calculated in the background,
+            # or may have failed
+            calibration_result = self.calculation_class.calibration_result
+            if not calibration_result.has_blur_level(self.calculation_class.settings.blur_radius) and \
+                    calibration_result.blur_level_error is not None:
+                self.cal_show_blur_level_error(calibration_result.blur_level_error)
+                return
+            if not calibration_result.has_blur_level(self.calculation_class.settings.blur_radius):
+                messagebox.showinfo(
+                    "Calibration in progress",
+                    "The selected blur radius is still being calculated!\n\n"
+                    "Please wait for the processed images to update, then try again.")
+                return
+
+            file_path = filedialog.asksaveasfilename(
+                defaultextension=".npz", filetypes=[("IJOQ calibration session", "*.npz")])
+
+            # If user did not press cancel
+            if file_path:
+                self.calculation_class.calibration_result.save(file_path)
+
+                messagebox.showinfo(
+                    "Session saved successfully",
+                    "The calibration session has been saved successfully to:\n\n" +
+                    file_path)
+
+        def cal_load_session(self):
+            """
+            Opens a file select screen, where a calibration session saved from the results page can be loaded. Opens the
+            results page of the loaded calibration
+            :return: None
+            """
+
+            file_path = filedialog.askopenfilename(filetypes=[("IJOQ calibration session", "*.npz")])
+            if file_path:
+                try:
+                    self.calculation_class.load_calibration_session(file_path)
+                except (OSError, ValueError):
+                    messagebox.showinfo(
+                        "Unable to load session",
+                        "Unable to load the calibration session!\n\n"
+                        "Please select a session file saved from the calibration results page.")
+
         def anl_add_settings(self):
             """
             Opens a file select screen, where a calibration settings file can be imported. Scans the settings and imports
@@ -1018,79 +1197,75 @@ class GuiWindow:
             file_path = filedialog.askopenfilename()
             if file_path:
                 if file_path.lower().endswith(".txt"):
-                    with open(file_path, mode="r") as settings:
-                        setting_list = settings.readlines()
-
-                        for setting in setting_list:
-                            if "compressed_image_size" in setting:
-                                self.calculation_class.image_compression = int(setting[len("compressed_image_size = "):])
-                            elif "channel" in setting:
-                                self.calculation_class.channel_selection = int(setting[len("channel = "):])
-                            elif "blur_radius" in setting:
-                                self.calculation_class.blur_radius = int(setting[len("blur_radius = "):])
-                            elif "section_size" in setting:
-                                self.calculation_class.section_number = int(setting[len("section_size = "):])
-                            elif "pixels_sampled" in setting:
-                                self.calculation_class.pixel_number = int(setting[len("pixels_sampled = "):])
-                            elif "normalization_cutoff" in setting:
-                                self.calculation_class.normal_threshold = int(setting[len("normalization_cutoff = "):])
-                            elif "noise_cutoff" in setting:
-                                self.calculation_class.noise_filter = float(setting[len("noise_cutoff = "):])
-                            elif "lines" in setting:
-                                self.calculation_class.line_number = int(setting[len("lines = "):])
-
-                        # Update label values in settings page
-                        self.anl_settings_value_label.config(
-                            text=f"{self.calculation_class.image_compression}\n"
-                                 f"{self.calculation_class.channel_selection}\n"
-                                 f"{self.calculation_class.blur_radius}\n"
-                                 f"{self.calculation_class.section_number}\n"
-                                 f"{self.calculation_class.pixel_number}\n"
-                                 f"{self.calculation_class.normal_threshold}\n"
-                                 f"{self.calculation_class.noise_filter}\n"
-                                 f"{self.calculation_class.line_number}")
-
-                        # Enable analysis button if files are confirmed
-                        if self.calculation_class.input_files == self.calculation_class.confirmed_files:
-                            self.settings_confirm_button["state"] = "normal"
-
-                        self.calculation_class.has_uploaded_settings = True
+                    self.calculation_class.uploaded_settings = Engine.Settings.read(file_path)
+
+                    # Update label values in settings page
+                    self.anl_settings_value_label.config(
+                        text=self.calculation_class.settings_text(self.calculation_class.uploaded_settings))
+
+                    # Enable analysis button if files are confirmed
+                    if self.calculation_class.input_files == self.calculation_class.confirmed_files:
+                        self.settings_confirm_button["state"] = "normal"
+
+                    self.calculation_class.has_uploaded_settings = True
 
                 else:
                     messagebox.showinfo(
                         "Incompatible file type selected",
                         "Incompatible file type selected!\n\nThis program can only accept TXT files.")
 
+        def anl_clear_cache(self):
+            """
+            Removes every cached analysis result, so that all images are analyzed again
+            :return: None
+            """
+
+            try:
+                self.calculation_class.clear_result_cache()
+            except OSError:
+                messagebox.showinfo(
+                    "Unable to clear cache",
+                    "Unable to clear the result cache!\n\nPlease check that the folder is not in use:\n\n" +
+                    self.calculation_class.result_cache_path())
+                return
+
+            messagebox.showinfo("Cache cleared", "The cached analysis results have been removed.")
+
         def anl_save_results(self):  # TODO save with folder names to prevent naming conflicts
             """
             Opens a file select screen and saves the analysis output to a folder at the selected location
             :return: None
             """
+            # Results were already saved during the analysis
+            if self.calculation_class.results_path is not None:
+                messagebox.showinfo(
+                    "Results already saved",
+                    "The analysis results were saved during the analysis to:\n\n" +
+                    self.calculation_class.results_path)
+                return
+
             folder_path = filedialog.askdirectory()
 
             # If user did not press cancel
             if folder_path:
 
                 # If save folder exists, add a number until an available save folder is found
-                save_path = folder_path + "/Analysis_Output/"
-                if path.isdir(save_path):
-                    folder_number = 2
-                    while path.isdir(save_path[:-1] + " (" + str(folder_number) + ")/"):
-                        folder_number += 1
-                    save_path = save_path[:-1] + " (" + str(folder_number) + ")/"
-                mkdir(save_path)
-
-                with open(save_path + "IJOQ Results " + self.parent.current_version + ".csv", mode="w",
-                          newline="") as results_file:
-                    data_writer = csv.writer(results_file)
-                    data_writer.writerow(["File name", "IJOQ"])
-                    for i in range(len(self.calculation_class.confirmed_files)):
-                        data_writer.writerow([self.calculation_class.confirmed_file_names[i], self.calculation_class.IJOQ_list[i]])
+                save_path = Engine.create_output_folder(folder_path, "Analysis_Output")
+
+                Engine.write_results(save_path + "IJOQ Results " + self.parent.current_version + ".csv",
+                                     self.calculation_class.results, self.calculation_class.confirmed_dense_lines,
+                                     self.calculation_class.confirmed_analyze_frames)
+                if self.calculation_class.confirmed_analyze_frames:
+                    Engine.write_summary(save_path + "IJOQ Stack Summary " + self.parent.current_version + ".csv",
+                                         self.calculation_class.results, self.calculation_class.confirmed_dense_lines)
+                if self.calculation_class.timer is not None:
+                    self.calculation_class.timer.write(
+                        save_path + "IJOQ Timings " + self.parent.current_version + ".json")
 
                 for i in range(len(self.calculation_class.processed_files)):
-                    image_name = ".".join(self.calculation_class.confirmed_file_names[i].split(".")[:-1])
+                    result = self.calculation_class.results[i]
                     image = self.calculation_class.processed_files[i]
-                    image.save(save_path + image_name + "_processed.png")
+                    image.save(save_path + Engine.processed_image_name(result.name, result.frame))
 
                 messagebox.showinfo(
                     "Results saved successfully",
@@ -1122,6 +1297,7 @@ class GuiWindow:
 
         self.valid_image_types = image_formats
         self.current_version = version
+        self.working_directory = directory
 
         # Initiate classes that handle calibration and analysis calculations
         self.calibration = Backend.Calculations("calibration", self)
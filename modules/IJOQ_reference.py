@@ -0,0 +1,451 @@
+# Reference implementation of the IJOQ calibration and analysis, copied from the original run_calibration and
+# run_analysis (IJOQ v1.4.0) with only the GUI updates removed. Images go through the same steps as in the original:
+# the analyzed channel is copied into all three RGB channels pixel by pixel, the blurred image is converted to HSV and
+# its V channel is used, and the white pixels of each calibration section are counted by scanning the section again.
+# It is slow on purpose and must not be optimized or changed: it is the ground truth that the optimized engine
+# (IJOQ_engine) is checked against (see Equivalence.py). Only PIL and numpy are used, so that changes to the engine
+# cannot change the reference
+
+from dataclasses import replace
+from math import floor
+from PIL import Image, ImageFilter
+import numpy
+
+# Blur radii of the calibration blur levels
+BLUR_RADIUS_VALUES = (0, 1, 2, 3, 4, 5)
+
+def calculate_threshold(x, y, section_count, threshold_array, section_width, section_height):
+    """
+    Calculates the threshold value for a given pixel
+    :param x: x-coordinate of the pixel (left to right)
+    :param y: y-coordinate of the pixel (top to bottom)
+    :param section_count: The number of sections that the image is split into along a single axis
+    :param threshold_array: A 2D array containing the calculated thresholds for each bin
+    :param section_width: Width (in pixels) of a bin
+    :param section_height: Height (in pixels) of a bin
+    :return: Brightness (out of 255) of the threshold
+    """
+
+    # Calculate a pixel's upper left section, as well as its relative position to the next section
+    x_percent = round(((x - section_width / 2) % section_width) / section_width, 2)
+    y_percent = round(((y - section_height / 2) % section_height) / section_height, 2)
+    left_section = floor((x / section_width) - 0.5)
+    top_section = floor((y / section_height) - 0.5)
+
+    # If pixel is not near a border, find the normalization thresholds of the 4 closest sections
+    if 0 <= left_section <= (section_count - 2) and 0 <= top_section <= (section_count - 2):
+        top_left_threshold = threshold_array[left_section][top_section]
+        top_right_threshold = threshold_array[left_section + 1][top_section]
+        bottom_left_threshold = threshold_array[left_section][top_section + 1]
+        bottom_right_threshold = threshold_array[left_section + 1][top_section + 1]
+    # If pixel is less than half a grid away from the border, copy the normalization threshold value
+    else:
+        top_left_value = (left_section, top_section)
+        top_right_value = (left_section + 1, top_section)
+        bottom_left_value = (left_section, top_section + 1)
+        bottom_right_value = (left_section + 1, top_section + 1)
+
+        # Pixel is on the left border
+        if left_section < 0:
+            top_left_value = top_right_value
+            bottom_left_value = bottom_right_value
+        # Pixel is on the right border
+        elif left_section >= section_count - 1:
+            top_right_value = top_left_value
+            bottom_right_value = bottom_left_value
+
+        # Pixel is on top border
+        if top_section < 0:
+            top_left_value = bottom_left_value
+            top_right_value = bottom_right_value
+        # Pixel is on bottom border
+        elif top_section >= section_count - 1:
+            bottom_left_value = top_left_value
+            bottom_right_value = top_right_value
+
+        top_left_threshold = threshold_array[top_left_value[0]][top_left_value[1]]
+        top_right_threshold = threshold_array[top_right_value[0]][top_right_value[1]]
+        bottom_left_threshold = threshold_array[bottom_left_value[0]][bottom_left_value[1]]
+        bottom_right_threshold = threshold_array[bottom_right_value[0]][bottom_right_value[1]]
+
+    # Calculate the weighted average of the normalization cutoff value
+    threshold_top = ((1 - x_percent) * top_left_threshold) + (x_percent * top_right_threshold)
+    threshold_bottom = ((1 - x_percent) * bottom_left_threshold) + (x_percent * bottom_right_threshold)
+
+    threshold_final = round(((1 - y_percent) * threshold_top) + (y_percent * threshold_bottom))
+
+    return threshold_final
+
+def load_image(source, compressed_image_size, channel):
+    """
+    Opens an image, resizes the full image to the compressed size, and copies a channel into all three RGB channels
+    :param source: Path to an image file, or an Image object
+    :param compressed_image_size: Target size of the average of the image width and height, or 0 to keep the full
+        resolution
+    :param channel: Index of the channel to extract (0 = red, 1 = green, 2 = blue)
+    :return: 3D uint8 array containing the RGB values of the pixels
+    """
+
+    image = source if isinstance(source, Image.Image) else Image.open(source)
+    if compressed_image_size:
+        width, height = image.size
+        compression_amount = (compressed_image_size / 2) * (width + height) / (width * height)
+        image = image.resize((round(compression_amount * width), round(compression_amount * height)))
+    width, height = image.size
+
+    # Take the RGB values from all the pixels in the image as an array
+    image_array = numpy.array(image.convert("RGB"))
+
+    # Extract channel
+    for x in range(width):
+        for y in range(height):
+            image_array[y][x] = [image_array[y][x][channel]] * 3
+
+    return image_array
+
+def blur_image(image_array, blur_radius):
+    """
+    :param image_array: 3D uint8 array containing the RGB values of the pixels
+    :param blur_radius: Radius of the Gaussian blur
+    :return: Blurred RGB Image object
+    """
+
+    image = Image.fromarray(image_array.astype("uint8"))
+
+    return image.filter(ImageFilter.GaussianBlur(radius=blur_radius))
+
+def pixel_deviation(image_array):
+    """
+    :param image_array: 3D uint8 array containing the RGB values of the pixels of an unblurred image
+    :return: Interquartile range of the brightness difference between neighboring pixels along the center lines
+    """
+
+    height, width = image_array.shape[:2]
+
+    # Calculate deviation in brightness of neighboring pixels
+    brightness_deviation = []
+    for y in range(1, height):
+        brightness_deviation.append(int(image_array[y][round(width / 2)][2]) -
+                                    int(image_array[y - 1][round(width / 2)][2]))
+    for x in range(1, width):
+        brightness_deviation.append(int(image_array[round(height / 2)][x][2]) -
+                                    int(image_array[round(height / 2)][x - 1][2]))
+
+    brightness_deviation.sort()
+    IQR = brightness_deviation[round(3 * len(brightness_deviation) / 4)] - \
+        brightness_deviation[round(len(brightness_deviation) / 4)]
+
+    return IQR
+
+def normalization_threshold(blurred_image, section_count, pixel_number):
+    """
+    :param blurred_image: Blurred RGB Image object of a calibration image
+    :param section_count: Number of sections along each image axis
+    :param pixel_number: Number of pixels sampled along each section axis
+    :return: Normalization threshold of the image, from the fraction of pixels above the Otsu threshold of their section
+    """
+
+    width, height = blurred_image.size
+    image_array = numpy.array(blurred_image.convert("HSV"))
+
+    # Split the picture into sections
+    section_width = width / section_count
+    section_height = height / section_count
+
+    white_pixel_counter = 0
+    for section_x in range(section_count):
+        for section_y in range(section_count):
+            # Take a histogram of the current section
+            histogram = [0] * 256
+            for x in range(round(section_x * section_width),
+                           round((section_x + 1) * section_width)):
+                for y in range(round(section_y * section_height),
+                               round((section_y + 1) * section_height)):
+                    histogram[image_array[y][x][2]] += 1
+
+            # Use Otsu's Method to determine threshold for current section
+            maximum_variance_threshold = 0
+            maximum_variance = 0
+            # Try different thresholds until a maximum variance is found
+            for i in range(256):
+                prob_zero = sum(histogram[:i])
+                prob_one = sum(histogram[i:])
+
+                if prob_zero > 0 and prob_one > 0:  # Must have at least 1 pixel in both classes
+                    # Calculate mean zero and mean one
+                    mean_zero = 0
+                    mean_one = 0
+                    for j in range(256):
+                        if j < i:
+                            mean_zero += j * histogram[j]
+                        else:
+                            mean_one += j * histogram[j]
+                    mean_zero /= prob_zero
+                    mean_one /= prob_one
+
+                    # Calculate variance
+                    variance = prob_zero * prob_one * ((mean_zero - mean_one) ** 2)
+
+                    if variance >= maximum_variance:
+                        maximum_variance_threshold = i
+                        maximum_variance = variance
+
+            # Use the determined threshold to set current section to black and white
+            for x in range(round(section_x * section_width),
+                           round((section_x + 1) * section_width)):
+                for y in range(round(section_y * section_height),
+                               round((section_y + 1) * section_height)):
+                    if image_array[y][x][2] > maximum_variance_threshold:
+                        white_pixel_counter += 1
+
+    # Determine normalization threshold
+    white_percent = white_pixel_counter / (width * height)
+
+    return numpy.ceil((1 - white_percent) * (pixel_number ** 2))
+
+def brightness_map(image_array, section_count, pixel_number, normal_threshold):
+    """
+    :param image_array: 3D uint8 array containing the HSV values of the pixels of a blurred image
+    :param section_count: Number of sections along each image axis
+    :param pixel_number: Number of pixels sampled along each section axis
+    :param normal_threshold: Rank (starting from 1) of the sampled pixel used as the section threshold
+    :return: 2D array (height x width) containing the threshold of every pixel
+    """
+
+    height, width = image_array.shape[:2]
+
+    # Split the picture into sections
+    section_width = width / section_count
+    section_height = height / section_count
+    normalization_threshold_array = numpy.zeros((section_count, section_count))
+
+    # For each section, sample pixels, then find the normalization threshold
+    for section_x in range(section_count):
+        for section_y in range(section_count):
+
+            sampled_values = []
+            for x in range(pixel_number):
+                for y in range(pixel_number):
+                    pixel_x = round(section_width * (section_x + ((x + 0.5) / pixel_number)))
+                    pixel_y = round(section_height * (section_y + ((y + 0.5) / pixel_number)))
+
+                    sampled_values.append(image_array[pixel_y][pixel_x][2])
+
+            sampled_values.sort()
+            normalization_threshold_array[section_x][section_y] = sampled_values[normal_threshold - 1]
+
+    # Parse through the image array and calculate brightness map
+    brightness_map_array = numpy.zeros((height, width))
+    for x in range(width):
+        for y in range(height):
+            brightness_map_array[y][x] = calculate_threshold(x, y, section_count, normalization_threshold_array,
+                                                             section_width, section_height)
+
+    return brightness_map_array
+
+def peak_deviation(blurred_image):
+    """
+    :param blurred_image: Blurred RGB Image object of a calibration image
+    :return: Median relative difference between local maxima and minima along the center lines (0 if none)
+    """
+
+    width, height = blurred_image.size
+    image_array = numpy.array(blurred_image.convert("HSV"))
+
+    # Calculate difference in brightness between local minima/maxima
+    # Local minima of 0 are set to 1 to avoid dividing by zero
+    brightness_deviation = []
+    local_minimum = -1
+    local_maximum = 0
+    increasing = True
+    for y in range(1, height):
+        if increasing:
+            if image_array[y][round(width / 2)][2] < 0.95 * local_maximum:
+                increasing = False
+                if local_minimum != -1:
+                    difference = (local_maximum / local_minimum) - 1
+                    brightness_deviation.append(difference)
+                local_minimum = max(int(image_array[y][round(width / 2)][2]), 1)
+            else:
+                local_maximum = image_array[y][round(width / 2)][2]
+        else:
+            if image_array[y][round(width / 2)][2] > 1.05 * local_minimum:
+                increasing = True
+                difference = (local_maximum / local_minimum) - 1
+                brightness_deviation.append(difference)
+                local_maximum = image_array[y][round(width / 2)][2]
+            else:
+                local_minimum = max(int(image_array[y][round(width / 2)][2]), 1)
+
+    local_minimum = -1
+    local_maximum = 0
+    increasing = True
+    for x in range(1, width):
+        if increasing:
+            if image_array[round(height / 2)][x][2] < 0.95 * local_maximum:
+                increasing = False
+                if local_minimum != -1:
+                    difference = (local_maximum / local_minimum) - 1
+                    brightness_deviation.append(difference)
+                local_minimum = max(int(image_array[round(height / 2)][x][2]), 1)
+            else:
+                local_maximum = image_array[round(height / 2)][x][2]
+        else:
+            if image_array[round(height / 2)][x][2] > 1.05 * local_minimum:
+                increasing = True
+                difference = (local_maximum / local_minimum) - 1
+                brightness_deviation.append(difference)
+                local_maximum = image_array[round(height / 2)][x][2]
+            else:
+                local_minimum = max(int(image_array[round(height / 2)][x][2]), 1)
+
+    if brightness_deviation:
+        brightness_deviation.sort()
+        return brightness_deviation[round(len(brightness_deviation) / 2)]
+
+    return 0
+
+def normalize_image(pixel_array, brightness_map_array, width, height, noise_threshold):
+    """
+    Passes an image through a threshold to produce the final processed image
+    :param pixel_array: 3D array containing the HSV values of the pixels in a pre-blurred image. Thresholded in place
+    :param brightness_map_array: 2D array containing all pixel threshold values
+    :param width: Width (in pixels) of the image
+    :param height: Height (in pixels) of the image
+    :param noise_threshold: Arbitrary value added on top of the brightness threshold value to account for noise
+    :return: 3D array containing the HSV values of the pixels after thresholding
+    """
+
+    for x in range(width):
+        for y in range(height):
+            pixel_brightness = pixel_array[y][x][2]
+
+            if pixel_brightness > max(brightness_map_array[y][x] * (1 + noise_threshold), 20):
+                pixel_array[y][x][2] = 255
+            else:
+                pixel_array[y][x][2] = 0
+
+    return pixel_array
+
+def processed_image(normalized_image_array):
+    """
+    :param normalized_image_array: 3D array containing the HSV values of the pixels after thresholding
+    :return: 2D uint8 array containing the thresholded image, taken from the RGB image shown by the original (whose
+        three channels are equal)
+    """
+
+    normalized_image = Image.fromarray(normalized_image_array.astype("uint8"), "HSV").convert("RGB")
+
+    return numpy.array(normalized_image)[:, :, 0]
+
+def process_image(blurred_image, settings, normal_threshold):
+    """
+    :param blurred_image: Blurred RGB Image object
+    :param settings: Settings (uses section_size, pixels_sampled and noise_cutoff)
+    :param normal_threshold: Normalization cutoff
+    :return: 3D array containing the HSV values of the pixels after thresholding
+    """
+
+    width, height = blurred_image.size
+    image_array = numpy.array(blurred_image.convert("HSV"))
+    brightness_map_array = brightness_map(image_array, settings.section_size, settings.pixels_sampled,
+                                          normal_threshold)
+
+    # Normalize image using calculated brightness map
+    return normalize_image(image_array, brightness_map_array, width, height, settings.noise_cutoff)
+
+def calculate_IJOQ(image_array, line_number):
+    """
+    :param image_array: 3D array containing the HSV values of the pixels after thresholding
+    :param line_number: Number of lines drawn along each axis
+    :return: IJOQ value (rounded to 4 decimal places)
+    """
+
+    height, width = image_array.shape[:2]
+
+    # Draw horizontal lines
+    cell_border_frequency = 0
+    for y in range(line_number):
+        pixel_y = round((y + 0.5) * height / line_number)
+
+        previous_pixel = image_array[pixel_y][0][2]
+        for x in range(1, width):
+            current_pixel = image_array[pixel_y][x][2]
+            # If the line detects a color change (i.e. black to white or white to black)
+            if not previous_pixel == current_pixel:
+                cell_border_frequency += 0.5 / width
+
+            # Set current pixel as the previous pixel before moving to the next pixel
+            previous_pixel = current_pixel
+
+    # Repeat the same steps vertical lines
+    for x in range(line_number):
+        pixel_x = round((x + 0.5) * width / line_number)
+
+        previous_pixel = image_array[0][pixel_x][2]
+        for y in range(1, height):
+            current_pixel = image_array[y][pixel_x][2]
+            if not previous_pixel == current_pixel:
+                cell_border_frequency += 0.5 / height
+
+            # Set current pixel as the previous pixel before moving to the next pixel
+            previous_pixel = current_pixel
+
+    # Take average of all lines
+    return round(cell_border_frequency / (2 * line_number), 4)
+
+def analyze_image(source, settings):
+    """
+    Runs the reference IJOQ analysis on a single image
+    :param source: Path to an image file, or an Image object
+    :param settings: Settings obtained from calibration. Images are always resized from full resolution, blurred with
+        the exact Gaussian blur, and analyzed whole
+    :return: Tuple of the IJOQ value and the 2D uint8 array containing the thresholded image
+    """
+
+    image_array = load_image(source, settings.compressed_image_size, settings.channel)
+    normalized_image_array = process_image(blur_image(image_array, settings.blur_radius), settings,
+                                           settings.normalization_cutoff)
+
+    return calculate_IJOQ(normalized_image_array, settings.lines), processed_image(normalized_image_array)
+
+def calibrate(sources, settings, cell_count=0, estimate_noise=False):
+    """
+    Runs the reference calibration on a set of negative control images. The original also calculated the
+    normalization thresholds and brightness maps of the blur radii that are not chosen, which does not affect the
+    result, so only those of the chosen blur radius are calculated here
+    :param sources: Paths to image files, or Image objects
+    :param settings: Settings to calibrate. The normalization cutoff is determined by the calibration
+    :param cell_count: Average number of cells along an image axis. If above 0, the blur radius is estimated
+    :param estimate_noise: If True, the noise cutoff is estimated
+    :return: Tuple of the calibrated settings and the list of thresholded images (2D uint8 arrays)
+    """
+
+    image_arrays = [load_image(source, settings.compressed_image_size, settings.channel) for source in sources]
+
+    # Take average of brightness deviations and set as blur radius
+    blur_radius = settings.blur_radius
+    if cell_count > 0:
+        brightness_deviation_list = [pixel_deviation(image_array) for image_array in image_arrays]
+        average_brightness_deviation = sum(brightness_deviation_list) / len(brightness_deviation_list)
+        blur_radius = max(min(round(25 * average_brightness_deviation / (cell_count ** 2.5)), 5), 1)
+
+    # Take geometric mean of thresholds
+    blurred_images = [blur_image(image_array, BLUR_RADIUS_VALUES[blur_radius]) for image_array in image_arrays]
+    product = 1
+    for blurred_image in blurred_images:
+        product *= normalization_threshold(blurred_image, settings.section_size, settings.pixels_sampled)
+    normalization_cutoff = round(product ** (1 / len(blurred_images)))
+
+    # Calculate noise filter
+    noise_cutoff = settings.noise_cutoff
+    if estimate_noise:
+        brightness_deviation_list = [peak_deviation(blurred_image) for blurred_image in blurred_images]
+        average_brightness_deviation = sum(brightness_deviation_list) / len(brightness_deviation_list)
+        noise_cutoff = max(min(round(round((average_brightness_deviation / 10) / 0.05) * 0.05, 2), 0.5), 0)
+
+    settings = replace(settings, blur_radius=blur_radius, normalization_cutoff=normalization_cutoff,
+                       noise_cutoff=noise_cutoff)
+
+    return settings, [processed_image(process_image(blurred_image, settings, normalization_cutoff))
+                      for blurred_image in blurred_images]